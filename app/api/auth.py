@@ -1,5 +1,6 @@
 from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.core.database import get_db
 from app.schemas.auth import RegisterRequest, LoginRequest, AuthResponse, AuthUserResponse
@@ -30,21 +31,21 @@ def _user_payload(u: User) -> AuthUserResponse:
 
 
 @router.post("/register", response_model=AuthResponse, status_code=201)
-def register(data: RegisterRequest, db: Session = Depends(get_db)):
+async def register(data: RegisterRequest, db: AsyncSession = Depends(get_db)):
     # 409 если email занят
-    exists = db.query(User).filter(User.email == data.email).first()
+    exists = await db.scalar(select(User).where(User.email == data.email))
     if exists:
         raise HTTPException(status_code=409, detail="Email already exists")
 
-    user = auth_service.register(db, data)
-    token, _ = auth_service.authenticate(db, data.email, data.password)
+    user = await auth_service.register(db, data)
+    token, _ = await auth_service.authenticate(db, data.email, data.password)
 
     return AuthResponse(accessToken=token, expiresIn=3600, user=_user_payload(user))
 
 
 @router.post("/login", response_model=AuthResponse)
-def login(data: LoginRequest, db: Session = Depends(get_db)):
-    result = auth_service.authenticate(db, data.email, data.password)
+async def login(data: LoginRequest, db: AsyncSession = Depends(get_db)):
+    result = await auth_service.authenticate(db, data.email, data.password)
     if not result:
         raise HTTPException(status_code=401, detail="Invalid credentials")
 
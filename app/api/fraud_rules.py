@@ -1,10 +1,12 @@
 from fastapi import APIRouter, Depends, HTTPException, Response
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from app.core.database import get_db
 from app.core.deps import require_admin
-from app.schemas.fraud_rule import FraudRuleCreateRequest, FraudRuleUpdateRequest, FraudRuleResponse, FraudRuleValidateRequest, FraudRuleValidateResponse
+from app.schemas.fraud_rule import FraudRuleCreateRequest, FraudRuleUpdateRequest, FraudRuleResponse, FraudRuleValidateRequest, FraudRuleValidateResponse, RuleOrderingResponse, RuleStatsResponse
 from app.services import fraud_rules as svc
 from app.dsl.simple_engine import validate_expression
+from app.dsl.compiler import parse
+from app.dsl.optimizer import optimize
 
 router = APIRouter(prefix="/api/v1/fraud-rules", tags=["fraud-rules"])
 
@@ -16,48 +18,63 @@ def _to(r):
     )
 
 @router.post("", response_model=FraudRuleResponse, status_code=201)
-def create(data: FraudRuleCreateRequest, db: Session = Depends(get_db), _=Depends(require_admin)):
-    if svc.get_by_name(db, data.name):
+async def create(data: FraudRuleCreateRequest, db: AsyncSession = Depends(get_db), _=Depends(require_admin)):
+    if await svc.get_by_name(db, data.name):
         raise HTTPException(409, "Rule name already exists")
-    return _to(svc.create_rule(db, data))
+    return _to(await svc.create_rule(db, data))
 
 
 @router.get("", response_model=list[FraudRuleResponse])
-def list_all(db: Session = Depends(get_db), _=Depends(require_admin)):
-    return [_to(x) for x in svc.list_rules(db)]
+async def list_all(db: AsyncSession = Depends(get_db), _=Depends(require_admin)):
+    return [_to(x) for x in await svc.list_rules(db)]
+
+
+# порядок исполнения операндов AND/OR, выученный по статистике (до /{id})
+@router.get("/ordering", response_model=list[RuleOrderingResponse])
+async def ordering(db: AsyncSession = Depends(get_db), _=Depends(require_admin)):
+    return await svc.rules_ordering(db)
+
+
+# профиль правил: исполнения, срабатывания, ошибки, гистограмма времени (до /{id})
+@router.get("/stats", response_model=RuleStatsResponse)
+async def stats(db: AsyncSession = Depends(get_db), _=Depends(require_admin)):
+    return await svc.rules_stats(db)
 
 
 @router.get("/{id}", response_model=FraudRuleResponse)
-def get_one(id: str, db: Session = Depends(get_db), _=Depends(require_admin)):
-    r = svc.get_rule(db, id)
+async def get_one(id: str, db: AsyncSession = Depends(get_db), _=Depends(require_admin)):
+    r = await svc.get_rule(db, id)
     if not r: raise HTTPException(404, "Not found")
     return _to(r)
 
 
 @router.put("/{id}", response_model=FraudRuleResponse)
-def put(id: str, data: FraudRuleUpdateRequest, db: Session = Depends(get_db), _=Depends(require_admin)):
-    r = svc.get_rule(db, id)
+async def put(id: str, data: FraudRuleUpdateRequest, db: AsyncSession = Depends(get_db), _=Depends(require_admin)):
+    r = await svc.get_rule(db, id)
     if not r: raise HTTPException(404, "Not found")
-    ex = svc.get_by_name(db, data.name)
+    ex = await svc.get_by_name(db, data.name)
     if ex and str(ex.id) != str(r.id):
         raise HTTPException(409, "Rule name already exists")
-    return _to(svc.update_rule(db, r, data))
+    return _to(await svc.update_rule(db, r, data))
 
 
 @router.delete("/{id}", status_code=204)
-def delete(id: str, db: Session = Depends(get_db), _=Depends(require_admin)):
-    r = svc.get_rule(db, id)
+async def delete(id: str, db: AsyncSession = Depends(get_db), _=Depends(require_admin)):
+    r = await svc.get_rule(db, id)
     if not r: raise HTTPException(404, "Not found")
-    svc.disable_rule(db, r)
+    await svc.disable_rule(db, r)
     return Response(status_code=204)
 
 
-# Tier 0 validate: всегда 200, но isValid=false + DSL_UNSUPPORTED_TIER
+# validate: всегда 200; ошибки синтаксиса -> isValid=false,
+# для валидного выражения — предупреждения оптимизатора (например, правило никогда не сработает)
 @router.post("/validate", response_model=FraudRuleValidateResponse)
-def validate(req: FraudRuleValidateRequest):
+async def validate(req: FraudRuleValidateRequest):
     res = validate_expression(req.dslExpression)
-    return {
-        "isValid": res.is_valid,
-        "normalizedExpression": res.normalized if res.is_valid else None,
-        "errors": [e.__dict__ for e in res.errors],
-    }
\ No newline at end of file
+    warnings = []
+    if res["isValid"]:
+        try:
+            warnings = [w.__dict__ for w in optimize(parse(req.dslExpression), req.dslExpression).issues]
+        except ValueError:
+            pass
+    return {**res, "warnings": warnings}
\ No newline at end of file
@@ -1,7 +1,14 @@
+import base64
+import json
+import tempfile
 from datetime import datetime, timezone
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
-from sqlalchemy import desc
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import ValidationError
+from sqlalchemy import desc, select, tuple_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.core.database import get_db
 from app.core.deps import get_current_user, require_admin
@@ -16,8 +23,16 @@ from app.schemas.transaction import (
     BatchTransactionRequest,
     BatchTransactionResponse,
     BatchItemResult,
+    ResultSpoolResponse,
+)
+from app.core.config import RULE_RESULTS_WRITE, STREAM_BUFFER_BYTES, STREAM_CHUNK_ITEMS, STREAM_MAX_LINE_BYTES
+from app.services import idempotency, totals
+from app.services.result_spool import spool
+from app.services.transactions import (
+    create_transaction_tier0,
+    create_transactions_batch,
+    get_transaction_with_results,
 )
-from app.services.transactions import create_transaction_tier0, get_transaction_with_results
 
 router = APIRouter(prefix="/api/v1/transactions", tags=["transactions"])
 
@@ -66,47 +81,144 @@ def _results_to_schema(results) -> list[RuleResultResponse]:
     ]
 
 
+async def _claim(
+    db: AsyncSession, user_id: str, keyed: dict[str, str]
+) -> dict[str, TransactionDecisionResponse | HTTPException]:
+    """
+    Ключи идемпотентности запроса (ключ -> хэш тела): для выполненных —
+    сохранённый ответ, для выполняющихся или отправленных с другим телом —
+    ошибка. Остальные ключи занимаются до конца запроса и в результат не попадают.
+    user_id — строкой: после отката сессии ORM-объект пользователя истёк.
+    """
+    known = await idempotency.stored(db, user_id, list(keyed))
+    free = [k for k in keyed if k not in known]
+    reserved = await idempotency.reserve(user_id, free)
+    lost = [k for k in free if k not in reserved]
+    if lost:
+        # ключ заняли между проверкой и SET NX
+        known.update(await idempotency.stored(db, user_id, lost))
+
+    out: dict[str, TransactionDecisionResponse | HTTPException] = {}
+    rebuilt: dict[str, tuple[str, dict]] = {}
+    for key, fp in keyed.items():
+        if key in reserved:
+            continue
+        value = known.get(key, idempotency.PENDING)
+        if value == idempotency.PENDING:
+            out[key] = HTTPException(409, "Request with this Idempotency-Key is in progress")
+        elif value["h"] != fp:
+            out[key] = HTTPException(422, "Idempotency-Key was already used with a different request")
+        elif "r" in value:
+            out[key] = TransactionDecisionResponse.model_validate(value["r"])
+        else:
+            # ответа нет в Redis — собираем по транзакции из БД и кладём обратно
+            tx, results = await get_transaction_with_results(db, value["tx"])
+            out[key] = TransactionDecisionResponse(
+                transaction=_tx_to_response(tx),
+                ruleResults=_results_to_schema(results),
+            )
+            rebuilt[key] = (fp, out[key].model_dump())
+    if rebuilt:
+        await idempotency.remember(user_id, rebuilt)
+    return out
+
+
+def _replayed(claimed: TransactionDecisionResponse | HTTPException):
+    if isinstance(claimed, HTTPException):
+        raise claimed
+    return JSONResponse(
+        status_code=201,
+        content=claimed.model_dump(),
+        headers={"Idempotent-Replayed": "true"},
+    )
+
+
+def _item_error(idx: int, e: HTTPException) -> BatchItemResult:
+    # В батче в error нужен машиночитаемый code (в ТЗ пример VALIDATION_FAILED)
+    code = {422: "VALIDATION_FAILED", 409: "CONFLICT"}.get(e.status_code, "ERROR")
+    return BatchItemResult(index=idx, error={"code": code, "message": str(e.detail)})
+
+
 @router.post("", response_model=TransactionDecisionResponse, status_code=201)
-def create_transaction(
+async def create_transaction(
     data: TransactionCreateRequest,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current: User = Depends(get_current_user),
+    idempotency_key: str | None = Header(None, alias="Idempotency-Key", min_length=1, max_length=255),
 ):
     """
     Tier 0:
     - matched=false для всех правил
     - status APPROVED (так как нет совпадений)
     - ruleResults полный список активных правил (enabled=true) в порядке priority,id
+
+    Idempotency-Key: повтор с тем же ключом и телом возвращает сохранённый
+    ответ (заголовок Idempotent-Replayed: true), ничего не пересчитывая;
+    пока первый запрос выполняется — 409, тот же ключ с другим телом — 422.
     """
     # ADMIN обязан передавать userId
     if current.role == "ADMIN":
         if not data.userId:
             raise HTTPException(status_code=422, detail="userId is required for ADMIN")
-        target_user = db.query(User).filter(User.id == data.userId).first()
+        target_user = await db.scalar(select(User).where(User.id == data.userId))
         if not target_user:
             raise HTTPException(status_code=404, detail="User not found")
         if not target_user.is_active:
             raise HTTPException(status_code=403, detail="User deactivated")
-        user_id = str(target_user.id)
     else:
         # USER: игнорируем userId из тела
-        user_id = str(current.id)
+        target_user = current
 
-    tx, results = create_transaction_tier0(db, user_id, data)
+    key = idempotency_key or data.idempotencyKey
+    if not key:
+        tx, results = await create_transaction_tier0(db, target_user, data)
+        return TransactionDecisionResponse(
+            transaction=_tx_to_response(tx),
+            ruleResults=_results_to_schema(results),
+        )
 
-    return TransactionDecisionResponse(
+    user_id = str(current.id)
+    fp = idempotency.fingerprint(data)
+    claimed = await _claim(db, user_id, {key: fp})
+    if key in claimed:
+        return _replayed(claimed[key])
+    try:
+        tx, results = await create_transaction_tier0(db, target_user, data, idempotency.row(user_id, key, fp))
+    except IntegrityError:
+        # ключ успел записать параллельный запрос (без Redis) — отдаём его ответ
+        await idempotency.release(user_id, [key])
+        claimed = await _claim(db, user_id, {key: fp})
+        if isinstance(claimed.get(key), TransactionDecisionResponse):
+            return _replayed(claimed[key])
+        if key not in claimed:
+            # повторный _claim снова занял ключ — иначе повторы получали бы 409
+            await idempotency.release(user_id, [key])
+        raise
+    except BaseException:
+        await idempotency.release(user_id, [key])
+        raise
+
+    decision = TransactionDecisionResponse(
         transaction=_tx_to_response(tx),
         ruleResults=_results_to_schema(results),
     )
+    await idempotency.remember(user_id, {key: (fp, decision.model_dump())})
+    return decision
+
+
+# отставание переноса rule_results из журнала в БД (до /{id})
+@router.get("/spool", response_model=ResultSpoolResponse)
+async def spool_lag(_: User = Depends(require_admin)):
+    return {"mode": RULE_RESULTS_WRITE, **spool.lag()}
 
 
 @router.get("/{id}", response_model=TransactionDecisionResponse)
-def get_transaction(
+async def get_transaction(
     id: str,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current: User = Depends(get_current_user),
 ):
-    tx, results = get_transaction_with_results(db, id)
+    tx, results = await get_transaction_with_results(db, id)
     if not tx:
         raise HTTPException(status_code=404, detail="Not found")
 
@@ -119,106 +231,336 @@ def get_transaction(
     )
 
 
+def _encode_cursor(tx: Transaction) -> str:
+    # непрозрачный для клиента курсор: позиция (timestamp, id) последней записи страницы
+    raw = json.dumps([tx.timestamp.isoformat(), str(tx.id)], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def _decode_cursor(cursor: str) -> tuple[datetime, str]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        ts, tx_id = json.loads(raw)
+        return datetime.fromisoformat(ts), str(tx_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=422, detail="Invalid cursor")
+
+
 @router.get("", response_model=TransactionsListResponse)
-def list_transactions(
+async def list_transactions(
     page: int = 0,
     size: int = 20,
     userId: str | None = None,
     status: str | None = None,
     isFraud: bool | None = None,
-    db: Session = Depends(get_db),
+    cursor: str | None = None,
+    includeTotal: bool | None = None,
+    db: AsyncSession = Depends(get_db),
     current: User = Depends(get_current_user),
 ):
     """
     Упрощённый листинг (Tier0):
     - USER видит только свои
     - ADMIN видит все, может фильтровать по userId
-    - сортировка по времени операции (timestamp desc) по ТЗ
+    - сортировка по времени операции (timestamp desc) по ТЗ, при равенстве — по id
+
+    Режим курсора (параметр cursor, для первой страницы — пустой): вместо
+    OFFSET продолжение с позиции (timestamp, id) последней записи страницы
+    по индексу, стоимость не зависит от глубины; nextCursor — курсор
+    следующей страницы (null — страниц больше нет). total считается только
+    при includeTotal=true; в режиме page — по умолчанию, как раньше.
     """
     if page < 0 or size < 1 or size > 100:
         raise HTTPException(status_code=422, detail="Invalid pagination")
 
-    q = db.query(Transaction)
+    q = select(Transaction)
 
     if current.role != "ADMIN":
-        q = q.filter(Transaction.user_id == str(current.id))
+        q = q.where(Transaction.user_id == str(current.id))
     else:
         if userId:
-            q = q.filter(Transaction.user_id == userId)
+            q = q.where(Transaction.user_id == userId)
 
     if status:
-        q = q.filter(Transaction.status == status)
+        q = q.where(Transaction.status == status)
     if isFraud is not None:
-        q = q.filter(Transaction.is_fraud == isFraud)
+        q = q.where(Transaction.is_fraud == isFraud)
+
+    # total — из счётчиков/кэша/оценки (app.services.totals), не COUNT(*) по запросу
+    total = total_kind = None
+    with_total = includeTotal if includeTotal is not None else cursor is None
+    if with_total:
+        scope = str(current.id) if current.role != "ADMIN" else userId or None
+        total, total_kind = await totals.transactions_total(db, scope, status or None, isFraud)
+
+    order = (desc(Transaction.timestamp), desc(Transaction.id))
+    if cursor is not None:
+        if cursor:
+            ts, tx_id = _decode_cursor(cursor)
+            # timestamp <= ts повторяет условие по строке: по нему отсекаются
+            # более новые партиции (по сравнению строк (a, b) < (...) — нет)
+            q = q.where(
+                tuple_(Transaction.timestamp, Transaction.id) < tuple_(ts, tx_id),
+                Transaction.timestamp <= ts,
+            )
+        # лишняя запись — признак следующей страницы
+        items = (await db.scalars(q.order_by(*order).limit(size + 1))).all()
+        next_cursor = _encode_cursor(items[size - 1]) if len(items) > size else None
+        return TransactionsListResponse(
+            items=[_tx_to_response(x) for x in items[:size]],
+            total=total,
+            totalKind=total_kind,
+            size=size,
+            nextCursor=next_cursor,
+        )
 
-    total = q.count()
     items = (
-        q.order_by(desc(Transaction.timestamp))
-        .offset(page * size)
-        .limit(size)
-        .all()
-    )
+        await db.scalars(
+            q.order_by(*order)
+            .offset(page * size)
+            .limit(size)
+        )
+    ).all()
 
     return TransactionsListResponse(
         items=[_tx_to_response(x) for x in items],
         total=total,
+        totalKind=total_kind,
         page=page,
         size=size,
     )
 
 
-@router.post("/batch", response_model=BatchTransactionResponse)
-def batch_create(
-    body: BatchTransactionRequest,
-    db: Session = Depends(get_db),
-    current: User = Depends(get_current_user),
-):
+async def _score_items(
+    db: AsyncSession,
+    current: User,
+    items: list[tuple[int, TransactionCreateRequest]],
+    copy: bool = False,
+) -> dict[int, BatchItemResult]:
     """
-    Батч:
-    - каждый элемент обрабатывается независимо
-    - 201 если все ок, 207 если частично
-    - ошибки не откатывают успешные (мы коммитим поэлементно в сервисе)
+    Общая часть батча и потоковой загрузки: проверка userId и оценка
+    пакета; результат — по индексу элемента.
     """
-    results: list[BatchItemResult] = []
-    has_errors = False
+    results: dict[int, BatchItemResult] = {}
+    accepted: list[tuple[int, User, TransactionCreateRequest]] = []
+
+    # все пользователи пакета — одним запросом
+    users: dict[str, User] = {}
+    if current.role == "ADMIN":
+        ids = {item.userId for _, item in items if item.userId}
+        if ids:
+            users = {str(u.id): u for u in await db.scalars(select(User).where(User.id.in_(ids)))}
 
-    for idx, item in enumerate(body.items):
+    for idx, item in items:
         try:
             # повторяем логику userId
             if current.role == "ADMIN":
                 if not item.userId:
                     raise HTTPException(422, "userId is required for ADMIN")
-                target_user = db.query(User).filter(User.id == item.userId).first()
+                target_user = users.get(item.userId)
                 if not target_user:
                     raise HTTPException(404, "User not found")
                 if not target_user.is_active:
                     raise HTTPException(403, "User deactivated")
-                user_id = str(target_user.id)
             else:
-                user_id = str(current.id)
-
-            tx, rr = create_transaction_tier0(db, user_id, item)
-            decision = TransactionDecisionResponse(
-                transaction=_tx_to_response(tx),
-                ruleResults=_results_to_schema(rr),
-            )
-            results.append(BatchItemResult(index=idx, decision=decision))
+                target_user = current
+            accepted.append((idx, target_user, item))
         except HTTPException as e:
-            has_errors = True
-            # В батче в error нужен машиночитаемый code (в ТЗ пример VALIDATION_FAILED)
-            code = "VALIDATION_FAILED" if e.status_code == 422 else "ERROR"
-            results.append(
-                BatchItemResult(
-                    index=idx,
-                    error={"code": code, "message": str(e.detail)},
-                )
+            results[idx] = _item_error(idx, e)
+
+    # ключи идемпотентности: повторы отдаются из сохранённых ответов, без оценки;
+    # повтор ключа внутри пакета получает результат первого элемента с ним
+    user_id = str(current.id)
+    fps = {idx: idempotency.fingerprint(item) for idx, _, item in accepted if item.idempotencyKey}
+    first: dict[str, int] = {}
+    for idx, _, item in accepted:
+        if item.idempotencyKey:
+            first.setdefault(item.idempotencyKey, idx)
+    claimed = await _claim(db, user_id, {key: fps[idx] for key, idx in first.items()}) if first else {}
+
+    scored: list[tuple[int, User, TransactionCreateRequest]] = []
+    for idx, user, item in accepted:
+        key = item.idempotencyKey
+        if key is None or first[key] == idx and key not in claimed:
+            scored.append((idx, user, item))
+        elif first[key] == idx:
+            c = claimed[key]
+            results[idx] = _item_error(idx, c) if isinstance(c, HTTPException) else BatchItemResult(index=idx, decision=c)
+
+    # правила по всем принятым элементам считаются одним колоночным проходом
+    try:
+        decided = await create_transactions_batch(
+            db,
+            [(user, item) for _, user, item in scored],
+            copy=copy,
+            idempotency=[
+                idempotency.row(user_id, item.idempotencyKey, fps[idx]) if item.idempotencyKey else None
+                for idx, _, item in scored
+            ],
+        )
+    except BaseException:
+        await idempotency.release(user_id, [item.idempotencyKey for _, _, item in scored if item.idempotencyKey])
+        raise
+
+    remembered: dict[str, tuple[str, dict]] = {}
+    failed_keys: list[str] = []
+    for (idx, _, item), outcome in zip(scored, decided):
+        if isinstance(outcome, Exception):
+            results[idx] = BatchItemResult(
+                index=idx,
+                error={"code": "ERROR", "message": "Failed to save transaction"},
             )
+            if item.idempotencyKey:
+                failed_keys.append(item.idempotencyKey)
+            continue
+        tx, rr = outcome
+        decision = TransactionDecisionResponse(
+            transaction=_tx_to_response(tx),
+            ruleResults=_results_to_schema(rr),
+        )
+        results[idx] = BatchItemResult(index=idx, decision=decision)
+        if item.idempotencyKey:
+            remembered[item.idempotencyKey] = (fps[idx], decision.model_dump())
+    if remembered:
+        await idempotency.remember(user_id, remembered)
+    if failed_keys:
+        # элемент не записан — ключ свободен для повтора (если его записал
+        # параллельный запрос, повтор получит сохранённый ответ)
+        await idempotency.release(user_id, failed_keys)
+
+    for idx, _, item in accepted:
+        key = item.idempotencyKey
+        if key is not None and first[key] != idx:
+            if fps[idx] != fps[first[key]]:
+                results[idx] = _item_error(idx, HTTPException(422, "Idempotency-Key was already used with a different request"))
+            else:
+                results[idx] = results[first[key]].model_copy(update={"index": idx})
+    return results
+
+
+@router.post("/batch", response_model=BatchTransactionResponse)
+async def batch_create(
+    body: BatchTransactionRequest,
+    db: AsyncSession = Depends(get_db),
+    current: User = Depends(get_current_user),
+):
+    """
+    Батч:
+    - каждый элемент обрабатывается независимо
+    - 201 если все ок, 207 если частично
+    - ошибки не откатывают успешные (в сервисе каждый элемент при сбое пакета пишется в своём SAVEPOINT)
+    """
+    results = await _score_items(db, current, list(enumerate(body.items)))
+    has_errors = any(r.error is not None for r in results.values())
 
     # 201 если без ошибок, иначе 207
     # FastAPI позволяет вернуть Response(status_code=207, ...)
     from fastapi.responses import JSONResponse
-    payload = BatchTransactionResponse(items=results).model_dump()
+    payload = BatchTransactionResponse(items=[results[i] for i in sorted(results)]).model_dump()
 
     if has_errors:
         return JSONResponse(status_code=207, content=payload)
     return JSONResponse(status_code=201, content=payload)
+
+
+def _parse_line(idx: int, line: bytes) -> TransactionCreateRequest | BatchItemResult:
+    try:
+        return TransactionCreateRequest.model_validate_json(line)
+    except ValidationError as e:
+        issues = [
+            {"field": ".".join(str(p) for p in err["loc"]) or None, "issue": err["msg"]}
+            for err in e.errors(include_input=False, include_url=False)
+        ]
+        return BatchItemResult(
+            index=idx,
+            error={"code": "VALIDATION_FAILED", "message": "Invalid item", "details": issues},
+        )
+
+
+@router.post("/stream")
+async def stream_create(
+    request: Request,
+    db: AsyncSession = Depends(get_db),
+    current: User = Depends(get_current_user),
+):
+    """
+    Потоковая загрузка: тело — NDJSON (по транзакции на строку, как элемент
+    батча), без ограничения на число строк. Тело читается по мере прихода,
+    каждые STREAM_CHUNK_ITEMS строк оцениваются и пишутся через COPY одной
+    транзакцией БД. Ответ — NDJSON тех же элементов, что и у /batch
+    ({"index", "decision"} или {"index", "error"}), в порядке строк.
+
+    Решения копятся во временном файле (в памяти до STREAM_BUFFER_BYTES,
+    дальше на диске) и отдаются потоком после чтения тела: клиенты HTTP/1.1
+    обычно не читают ответ, пока отправляют запрос, а встречная отправка
+    упёрлась бы в их буферы.
+    """
+    out = tempfile.SpooledTemporaryFile(max_size=STREAM_BUFFER_BYTES)
+    pending: list[tuple[int, TransactionCreateRequest]] = []
+    ready: list[BatchItemResult] = []
+
+    def add(idx: int, line: bytes):
+        item = _parse_line(idx, line)
+        if isinstance(item, BatchItemResult):
+            ready.append(item)
+        else:
+            pending.append((idx, item))
+
+    async def flush():
+        results = {r.index: r for r in ready}
+        if pending:
+            results.update(await _score_items(db, current, pending, copy=True))
+        for i in sorted(results):
+            out.write(results[i].model_dump_json().encode() + b"\n")
+        pending.clear()
+        ready.clear()
+
+    def too_long(idx: int) -> BatchItemResult:
+        return BatchItemResult(
+            index=idx,
+            error={"code": "VALIDATION_FAILED", "message": "Line too long"},
+        )
+
+    idx = 0
+    buf = b""
+    skipping = False  # дочитываем хвост слишком длинной строки
+    try:
+        async for chunk in request.stream():
+            lines = (buf + chunk).split(b"\n")
+            buf = lines.pop()
+            for line in lines:
+                if skipping:
+                    skipping = False
+                    continue
+                line = line.strip()
+                if not line:
+                    continue
+                if len(line) > STREAM_MAX_LINE_BYTES:
+                    ready.append(too_long(idx))
+                else:
+                    add(idx, line)
+                idx += 1
+                if len(pending) + len(ready) >= STREAM_CHUNK_ITEMS:
+                    await flush()
+            if len(buf) > STREAM_MAX_LINE_BYTES:
+                # строка без конца не копится в памяти: ошибка сразу, остаток пропускаем
+                if not skipping:
+                    ready.append(too_long(idx))
+                    idx += 1
+                skipping = True
+                buf = b""
+        if buf.strip() and not skipping:
+            add(idx, buf.strip())
+        await flush()
+    except BaseException:
+        out.close()
+        raise
+
+    out.seek(0)
+
+    def body():
+        with out:
+            while block := out.read(64 * 1024):
+                yield block
+
+    return StreamingResponse(body(), media_type="application/x-ndjson")
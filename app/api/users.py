@@ -1,5 +1,5 @@
 from fastapi import APIRouter, Depends, HTTPException, Request, Response
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.core.database import get_db
 from app.core.deps import get_current_user, require_admin
@@ -61,14 +61,14 @@ async def _require_full_put(request: Request):
 
 
 @router.get("/me", response_model=UserResponse)
-def me(current: User = Depends(get_current_user)):
+async def me(current: User = Depends(get_current_user)):
     return _to(current)
 
 
 @router.put("/me", response_model=UserResponse)
 async def update_me(
     request: Request,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current: User = Depends(get_current_user),
 ):
     raw = await _require_full_put(request)
@@ -76,20 +76,20 @@ async def update_me(
         return raw  # это JSONResponse 422 из errors.py
 
     data = UserUpdateRequest(**raw)
-    updated = users_service.update_user_full(db, current, data)
+    updated = await users_service.update_user_full(db, current, data)
     return _to(updated)
 
 
 @router.get("/{id}", response_model=UserResponse)
-def get_by_id(
+async def get_by_id(
     id: str,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current: User = Depends(get_current_user),
 ):
     if current.role != "ADMIN" and str(current.id) != id:
         raise HTTPException(status_code=403, detail="Forbidden")
 
-    u = users_service.get_user(db, id)
+    u = await users_service.get_user(db, id)
     if not u:
         raise HTTPException(status_code=404, detail="Not found")
     return _to(u)
@@ -99,7 +99,7 @@ def get_by_id(
 async def update_by_id(
     id: str,
     request: Request,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current: User = Depends(get_current_user),
 ):
     raw = await _require_full_put(request)
@@ -114,59 +114,60 @@ async def update_by_id(
             raise HTTPException(status_code=403, detail="Forbidden")
 
         data = UserUpdateRequest(**raw)
-        updated = users_service.update_user_full(db, current, data)
+        updated = await users_service.update_user_full(db, current, data)
         return _to(updated)
 
     # ADMIN
-    u = users_service.get_user(db, id)
+    u = await users_service.get_user(db, id)
     if not u:
         raise HTTPException(status_code=404, detail="Not found")
 
     data = AdminUserUpdateRequest(**raw)
-    updated = users_service.admin_update_user_full(db, u, data)
+    updated = await users_service.admin_update_user_full(db, u, data)
     return _to(updated)
 
 
 @router.get("", response_model=UsersListResponse)
-def list_all(
+async def list_all(
     page: int = 0,
     size: int = 20,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     _: User = Depends(require_admin),
 ):
     if page < 0 or size < 1 or size > 100:
         raise HTTPException(status_code=422, detail="Invalid pagination")
 
-    items, total = users_service.list_users(db, page, size)
+    items, total, total_kind = await users_service.list_users(db, page, size)
     return UsersListResponse(
         items=[_to(x) for x in items],
         total=total,
+        totalKind=total_kind,
         page=page,
         size=size,
     )
 
 
 @router.post("", response_model=UserResponse, status_code=201)
-def admin_create(
+async def admin_create(
     data: AdminUserCreateRequest,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     _: User = Depends(require_admin),
 ):
-    if users_service.get_by_email(db, data.email):
+    if await users_service.get_by_email(db, data.email):
         raise HTTPException(status_code=409, detail="Email already exists")
-    u = users_service.admin_create_user(db, data)
+    u = await users_service.admin_create_user(db, data)
     return _to(u)
 
 
 @router.delete("/{id}", status_code=204)
-def admin_delete(
+async def admin_delete(
     id: str,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     _: User = Depends(require_admin),
 ):
-    u = users_service.get_user(db, id)
+    u = await users_service.get_user(db, id)
     if not u:
         raise HTTPException(status_code=404, detail="Not found")
 
-    users_service.deactivate_user(db, u)
+    await users_service.deactivate_user(db, u)
     return Response(status_code=204)
@@ -14,6 +14,10 @@ DB_PASSWORD = os.getenv("DB_PASSWORD")
 DATABASE_URL = (
     f"postgresql+psycopg2://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
 )
+# запросы API идут через asyncpg; синхронный движок — для старта приложения и фоновых потоков
+ASYNC_DATABASE_URL = (
+    f"postgresql+asyncpg://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+)
 
 REDIS_HOST = os.getenv("REDIS_HOST", "localhost")
 REDIS_PORT = int(os.getenv("REDIS_PORT", "6379"))
@@ -26,3 +30,60 @@ ADMIN_EMAIL = os.getenv("ADMIN_EMAIL")
 ADMIN_FULLNAME = os.getenv("ADMIN_FULLNAME")
 ADMIN_PASSWORD = os.getenv("ADMIN_PASSWORD")
 
+
+# сколько пользователей держать в памяти со скользящими окнами velocity-признаков
+VELOCITY_MAX_USERS = int(os.getenv("VELOCITY_MAX_USERS", "100000"))
+
+# ALL — решение после исполнения всех правил; FIRST_MATCH — решает первое
+# сработавшее по приоритету правило, остальные досчитываются в фоне для аудита
+DECISION_MODE = os.getenv("DECISION_MODE", "ALL").upper()
+AUDIT_WORKERS = int(os.getenv("AUDIT_WORKERS", "2"))
+
+# профилирование правил: каждая N-я транзакция исполняется с замером каждого правила, 0 — выключено
+RULE_PROFILE_EVERY = int(os.getenv("RULE_PROFILE_EVERY", "100"))
+
+# как часто перечитывать версию набора правил из Redis в дополнение к pub/sub (секунды)
+RULES_VERSION_CHECK_SECONDS = float(os.getenv("RULES_VERSION_CHECK_SECONDS", "30"))
+# блокировка загрузки набора правил между процессами (мс) и сколько ждать чужую загрузку
+RULES_LOAD_LOCK_MS = int(os.getenv("RULES_LOAD_LOCK_MS", "5000"))
+RULES_LOAD_WAIT_MS = int(os.getenv("RULES_LOAD_WAIT_MS", "2000"))
+
+# ROWS — строка rule_results на каждое правило; BITMAP — снимок набора правил
+# один раз (ruleset_snapshots) и битовая карта matched в самой транзакции
+RULE_RESULTS_STORAGE = os.getenv("RULE_RESULTS_STORAGE", "ROWS").upper()
+
+# SYNC — строки rule_results пишутся в той же транзакции БД, что и транзакция;
+# SPOOL — решение и транзакция коммитятся сразу, строки идут через локальный
+# журнал на диске и переносятся в БД фоновой задачей (только для ROWS);
+# каталог журнала должен переживать перезапуск (в Docker — том)
+RULE_RESULTS_WRITE = os.getenv("RULE_RESULTS_WRITE", "SYNC").upper()
+RESULT_SPOOL_DIR = os.getenv("RESULT_SPOOL_DIR", "/var/lib/antifraud/spool")
+RESULT_SPOOL_FLUSH_MS = int(os.getenv("RESULT_SPOOL_FLUSH_MS", "500"))
+RESULT_SPOOL_SEGMENT_BYTES = int(os.getenv("RESULT_SPOOL_SEGMENT_BYTES", str(8 * 1024 * 1024)))
+# после стольких неудачных переносов подряд (не из-за недоступности БД)
+# сегмент откладывается в *.failed, чтобы не задерживать следующие
+RESULT_SPOOL_MAX_ATTEMPTS = int(os.getenv("RESULT_SPOOL_MAX_ATTEMPTS", "10"))
+
+# POST /transactions/stream: строк в одном пакете оценки и COPY, сколько
+# держать ответ в памяти до сброса на диск, предельная длина строки NDJSON
+STREAM_CHUNK_ITEMS = int(os.getenv("STREAM_CHUNK_ITEMS", "1000"))
+STREAM_BUFFER_BYTES = int(os.getenv("STREAM_BUFFER_BYTES", str(8 * 1024 * 1024)))
+STREAM_MAX_LINE_BYTES = int(os.getenv("STREAM_MAX_LINE_BYTES", str(64 * 1024)))
+
+# Idempotency-Key: сколько хранить ответ в Redis (секунды) и сколько держать
+# ключ занятым, пока запрос с ним выполняется (мс)
+IDEMPOTENCY_TTL_SECONDS = int(os.getenv("IDEMPOTENCY_TTL_SECONDS", str(24 * 3600)))
+IDEMPOTENCY_LOCK_MS = int(os.getenv("IDEMPOTENCY_LOCK_MS", "30000"))
+
+# total в листингах: сколько секунд кэшировать посчитанные суммы (фильтры ADMIN без userId)
+# и с какого размера таблицы отдавать оценку планировщика вместо точного числа
+TOTALS_CACHE_SECONDS = float(os.getenv("TOTALS_CACHE_SECONDS", "5"))
+TOTALS_ESTIMATE_MIN_ROWS = int(os.getenv("TOTALS_ESTIMATE_MIN_ROWS", "100000"))
+
+# помесячные партиции transactions / rule_results: на сколько месяцев вперёд
+# держать созданные партиции и как часто это проверять (секунды); транзакции
+# старше PARTITIONS_MAX_AGE_MONTHS месяцев (от текущего) не принимаются —
+# клиент не должен создавать партиции произвольных месяцев
+PARTITIONS_AHEAD_MONTHS = int(os.getenv("PARTITIONS_AHEAD_MONTHS", "3"))
+PARTITIONS_CHECK_SECONDS = float(os.getenv("PARTITIONS_CHECK_SECONDS", "3600"))
+PARTITIONS_MAX_AGE_MONTHS = int(os.getenv("PARTITIONS_MAX_AGE_MONTHS", "24"))
@@ -1,7 +1,8 @@
 from fastapi import Depends, HTTPException
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
 from jose import jwt, JWTError
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.core.config import JWT_SECRET, JWT_ALGORITHM
 from app.core.database import get_db
@@ -9,9 +10,9 @@ from app.models.user import User
 
 bearer = HTTPBearer(auto_error=False)
 
-def get_current_user(
+async def get_current_user(
     creds: HTTPAuthorizationCredentials | None = Depends(bearer),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ) -> User:
     if creds is None or creds.scheme.lower() != "bearer":
         raise HTTPException(401, "Unauthorized")
@@ -25,14 +26,14 @@ def get_current_user(
     if not uid:
         raise HTTPException(401, "Unauthorized")
 
-    user = db.query(User).filter(User.id == uid).first()
+    user = await db.scalar(select(User).where(User.id == uid))
     if not user:
         raise HTTPException(401, "Unauthorized")
     if not user.is_active:
         raise HTTPException(403, "Forbidden")
     return user
 
-def require_admin(u: User = Depends(get_current_user)) -> User:
+async def require_admin(u: User = Depends(get_current_user)) -> User:
     if u.role != "ADMIN":
         raise HTTPException(403, "Forbidden")
     return u
@@ -1,23 +1,110 @@
 """
 Redis используется как ОПЦИОНАЛЬНЫЙ кэш.
 Мы кэшируем список активных правил, чтобы не ходить в БД каждый раз.
-При изменении rules — инвалидируем ключ.
+При изменении rules — увеличиваем версию набора и публикуем её:
+воркеры держат скомпилированный набор в памяти и пересобирают его
+только при смене версии.
+Клиент асинхронный (redis.asyncio): вызовы не блокируют event loop.
 """
 
+import asyncio
 import json
-import redis
+import logging
+import uuid
+import redis.asyncio as redis
 from app.core.config import REDIS_HOST, REDIS_PORT
 
+logger = logging.getLogger(__name__)
+
 r = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, decode_responses=True)
 
 ACTIVE_RULES_KEY = "active_rules_v1"
+RULES_VERSION_KEY = "active_rules_version"
+RULES_VERSION_CHANNEL = "active_rules_version"
 
-def cache_get_active_rules():
-    raw = r.get(ACTIVE_RULES_KEY)
+async def cache_get_active_rules(version: int):
+    # ключ по версии: запись, сделанная по устаревшей версии, не будет прочитана
+    raw = await r.get(f"{ACTIVE_RULES_KEY}:{version}")
     return json.loads(raw) if raw else None
 
-def cache_set_active_rules(rules: list[dict], ttl_seconds: int = 30):
-    r.setex(ACTIVE_RULES_KEY, ttl_seconds, json.dumps(rules))
+async def cache_set_active_rules(rules: list[dict], version: int, ttl_seconds: int = 30):
+    await r.setex(f"{ACTIVE_RULES_KEY}:{version}", ttl_seconds, json.dumps(rules))
+
+# снять блокировку, только если она ещё наша (могла истечь и достаться другому)
+_UNLOCK = r.register_script(
+    "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('del', KEYS[1]) end return 0"
+)
+
+async def cache_lock_active_rules(version: int, ttl_ms: int = 5000) -> str | None:
+    """
+    Короткая блокировка загрузки набора версии version между процессами:
+    токен, если загружать нам, иначе None.
+    """
+    token = uuid.uuid4().hex
+    if await r.set(f"{ACTIVE_RULES_KEY}:{version}:lock", token, nx=True, px=ttl_ms):
+        return token
+    return None
+
+async def cache_unlock_active_rules(version: int, token: str):
+    await _UNLOCK(keys=[f"{ACTIVE_RULES_KEY}:{version}:lock"], args=[token])
+
+IDEMPOTENCY_KEY = "idempotency_v1"
+
+async def idempotency_get_many(keys: list[str]) -> list[str | None]:
+    if not keys:
+        return []
+    return await r.mget([f"{IDEMPOTENCY_KEY}:{k}" for k in keys])
+
+async def idempotency_reserve(key: str, value: str, ttl_ms: int) -> bool:
+    return bool(await r.set(f"{IDEMPOTENCY_KEY}:{key}", value, nx=True, px=ttl_ms))
+
+async def idempotency_set_many(values: dict[str, str], ttl_seconds: int):
+    if not values:
+        return
+    async with r.pipeline(transaction=False) as pipe:
+        for k, v in values.items():
+            pipe.setex(f"{IDEMPOTENCY_KEY}:{k}", ttl_seconds, v)
+        await pipe.execute()
+
+async def idempotency_delete_many(keys: list[str]):
+    if keys:
+        await r.delete(*[f"{IDEMPOTENCY_KEY}:{k}" for k in keys])
+
+async def rules_version_get() -> int:
+    return int(await r.get(RULES_VERSION_KEY) or 0)
+
+async def rules_version_bump() -> int:
+    version = await r.incr(RULES_VERSION_KEY)
+    await r.publish(RULES_VERSION_CHANNEL, version)
+    return version
 
-def cache_invalidate_active_rules():
-    r.delete(ACTIVE_RULES_KEY)
+async def listen_rules_version(on_version, on_subscribed=None, retry_seconds: float = 1.0):
+    """
+    Бесконечный цикл (фоновая задача): on_version(version) на каждую
+    публикацию. После (пере)подключения версия читается заново, чтобы не
+    потерять изменения за время разрыва; on_subscribed(bool) — состояние подписки.
+    """
+    while True:
+        pubsub = r.pubsub(ignore_subscribe_messages=True)
+        try:
+            await pubsub.subscribe(RULES_VERSION_CHANNEL)
+            on_version(await rules_version_get())
+            if on_subscribed:
+                on_subscribed(True)
+            async for msg in pubsub.listen():
+                if msg["type"] == "message":
+                    on_version(int(msg["data"]))
+        except asyncio.CancelledError:
+            raise
+        except (redis.RedisError, OSError, ValueError) as e:
+            # разрыв соединения (или чужое сообщение в канале): пока подписки
+            # нет, версия проверяется опросом — переподключаемся
+            logger.warning("rules version subscription failed, retrying in %ss: %r", retry_seconds, e)
+        finally:
+            if on_subscribed:
+                on_subscribed(False)
+            try:
+                await pubsub.aclose()
+            except (redis.RedisError, OSError) as e:
+                logger.warning("closing rules version subscription failed: %r", e)
+        await asyncio.sleep(retry_seconds)
@@ -30,6 +30,14 @@ class Compare(Node):
     right: Node
 
 
+@dataclass(frozen=True)
+class InList(Node):
+    # left IN (values...) / left NOT IN (values...)
+    left: Node
+    values: tuple[Node, ...]
+    negated: bool = False
+
+
 @dataclass(frozen=True)
 class Not(Node):
     expr: Node
@@ -45,3 +53,35 @@ class And(Node):
 class Or(Node):
     left: Node
     right: Node
+
+
+def unparse(node: Node) -> str:
+    """
+    Обратно в текст DSL (скобки только там, где нужны по приоритету).
+    """
+    if isinstance(node, Field):
+        return node.name
+    if isinstance(node, Number):
+        v = node.value
+        return str(int(v)) if float(v).is_integer() else str(v)
+    if isinstance(node, String):
+        return "'" + node.value.replace("\\", "\\\\").replace("'", "\\'") + "'"
+    if isinstance(node, Compare):
+        return f"{unparse(node.left)} {node.op} {unparse(node.right)}"
+    if isinstance(node, InList):
+        op = "NOT IN" if node.negated else "IN"
+        return f"{unparse(node.left)} {op} ({', '.join(unparse(v) for v in node.values)})"
+    if isinstance(node, Not):
+        inner = unparse(node.expr)
+        if isinstance(node.expr, (And, Or)):
+            inner = f"({inner})"
+        return f"NOT {inner}"
+    if isinstance(node, And):
+        parts = []
+        for side in (node.left, node.right):
+            s = unparse(side)
+            parts.append(f"({s})" if isinstance(side, Or) else s)
+        return " AND ".join(parts)
+    if isinstance(node, Or):
+        return f"{unparse(node.left)} OR {unparse(node.right)}"
+    raise ValueError(f"Unsupported node: {type(node).__name__}")
@@ -0,0 +1,222 @@
+"""
+Бенчмарк движка правил.
+
+Запуск:
+    python -m app.dsl.bench [--rules 200] [--txs 2000] [--seed 1]
+
+Генерирует случайный набор правил и транзакций, сверяет результаты
+компилятора с evaluate_simple и печатает время на одну транзакцию.
+Отдельно сверяет tokenize_fast с tokenize на корпусе сгенерированных
+правил и случайных строк (включая мусор и незакрытые строки) и меряет оба.
+Блок-лист merchantId сравнивается в двух видах: цепочка OR из равенств
+(evaluate_simple) и один IN-список (компилятор, frozenset).
+"""
+
+from __future__ import annotations
+
+import argparse
+import random
+import time
+
+from app.dsl.compiler import get_compiled, clear_cache
+from app.dsl.ruleset import CompiledRuleset
+from app.dsl.simple_engine import evaluate_simple
+from app.dsl.tokenizer import tokenize, tokenize_fast
+from app.dsl.vectorized import evaluate_matrix
+
+CURRENCIES = ["RUB", "USD", "EUR", "KZT", "CNY"]
+CHANNELS = ["WEB", "MOBILE", "POS", "OTHER"]
+COUNTRIES = ["RU", "US", "DE", "KZ", "CN"]
+MCCS = ["5411", "5812", "6011", "7995", "4829"]
+
+
+def gen_predicate(rnd: random.Random) -> str:
+    kind = rnd.randrange(6)
+    if kind == 0:
+        return f"amount {rnd.choice(['>', '>=', '<', '<='])} {rnd.choice([100, 1000, 5000, 10000, 50000])}"
+    if kind == 1:
+        return f"user.age {rnd.choice(['>', '<', '>=', '<='])} {rnd.randint(18, 80)}"
+    if kind == 2:
+        return f"currency {rnd.choice(['=', '!='])} '{rnd.choice(CURRENCIES)}'"
+    if kind == 3:
+        return f"channel = '{rnd.choice(CHANNELS)}'"
+    if kind == 4:
+        return f"location.country = '{rnd.choice(COUNTRIES)}'"
+    return f"merchantCategoryCode = '{rnd.choice(MCCS)}'"
+
+
+KEYS = [
+    ("currency", CURRENCIES),
+    ("channel", CHANNELS),
+    ("location.country", COUNTRIES),
+    ("merchantCategoryCode", MCCS),
+]
+
+
+def gen_keyed_rule(rnd: random.Random) -> str:
+    """
+    Типичное продовое правило: равенство по ключевому полю AND остальное.
+    """
+    field, values = rnd.choice(KEYS)
+    # evaluate_simple не знает скобок, поэтому только цепочка AND
+    return f"{field} = '{rnd.choice(values)}' AND {gen_rule(rnd, joins=(' AND ',))}"
+
+
+def gen_rule(rnd: random.Random, joins: tuple[str, ...] = (" AND ", " AND ", " OR ")) -> str:
+    parts = []
+    for _ in range(rnd.randint(1, 4)):
+        p = gen_predicate(rnd)
+        if rnd.random() < 0.15:
+            p = "NOT " + p
+        parts.append(p)
+    out = parts[0]
+    for p in parts[1:]:
+        out += rnd.choice(joins) + p
+    return out
+
+
+def gen_tx(rnd: random.Random) -> tuple[dict, dict]:
+    tx = {
+        "amount": round(rnd.uniform(1, 100_000), 2),
+        "currency": rnd.choice(CURRENCIES),
+        "merchantId": f"m{rnd.randint(1, 500)}",
+        "merchantCategoryCode": rnd.choice(MCCS + [None]),
+        "ipAddress": None,
+        "deviceId": None,
+        "channel": rnd.choice(CHANNELS + [None]),
+        "location": {"country": rnd.choice(COUNTRIES)} if rnd.random() < 0.8 else {},
+    }
+    user = {
+        "age": rnd.randint(18, 90) if rnd.random() < 0.9 else None,
+        "region": None,
+    }
+    return tx, user
+
+
+FUZZ_ALPHABET = "abxyZ_09.() <>=!'\\\t\n,-@ANDORNOT"
+
+
+def gen_fuzz(rnd: random.Random) -> str:
+    return "".join(rnd.choice(FUZZ_ALPHABET) for _ in range(rnd.randint(0, 40)))
+
+
+def bench_tokenizer(rnd: random.Random, rules: list[dict], fuzz: int) -> None:
+    exprs = [r["dsl"] for r in rules]
+    corpus = exprs + [gen_fuzz(rnd) for _ in range(fuzz)]
+    for src in corpus:
+        if tokenize(src) != tokenize_fast(src):
+            raise SystemExit(f"tokenizer mismatch on {src!r}")
+
+    # замер — на реальных выражениях правил (перекомпиляция набора)
+    def run(fn) -> float:
+        t0 = time.perf_counter()
+        for _ in range(20):
+            for src in exprs:
+                fn(src)
+        return time.perf_counter() - t0
+
+    t_slow = run(tokenize)
+    t_fast = run(tokenize_fast)
+    chars = sum(len(s) for s in exprs) * 20
+    print(f"tokenizer equivalence {len(corpus)} expressions ({len(exprs)} rules + {fuzz} fuzz), all equal")
+    print(f"tokenize              {t_slow / chars * 1e9:10.1f} ns/char")
+    print(f"tokenize_fast         {t_fast / chars * 1e9:10.1f} ns/char  x{t_slow / t_fast:.1f}")
+
+
+def bench_blocklist(rnd: random.Random, txs: list[tuple[dict, dict]], size: int) -> None:
+    ids = rnd.sample(range(1, 501), size)
+    chain = " OR ".join(f"merchantId = 'm{i}'" for i in ids)
+    in_list = "merchantId IN (" + ", ".join(f"'m{i}'" for i in ids) + ")"
+    clear_cache()
+    fn = get_compiled("blocklist", in_list)
+
+    for tx, user in txs:
+        if evaluate_simple(chain, tx, user) != fn(tx, user):
+            raise SystemExit(f"blocklist mismatch on {tx}")
+
+    t_chain = _timeit(lambda tx, user: evaluate_simple(chain, tx, user), txs)
+    t_in = _timeit(fn, txs)
+    per_tx = lambda t: t / len(txs) * 1e6
+    print(f"blocklist of {size} merchantId values")
+    print(f"OR chain (simple)     {per_tx(t_chain):10.1f} us/tx")
+    print(f"IN (compiled)         {per_tx(t_in):10.3f} us/tx  x{t_chain / t_in:.0f}")
+
+
+def _timeit(fn, txs) -> float:
+    t0 = time.perf_counter()
+    for tx, user in txs:
+        fn(tx, user)
+    return time.perf_counter() - t0
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rules", type=int, default=200)
+    ap.add_argument("--txs", type=int, default=2000)
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--keyed", type=float, default=0.5, help="доля правил с равенством по ключевому полю")
+    ap.add_argument("--blocklist", type=int, default=300, help="размер блок-листа merchantId")
+    ap.add_argument("--fuzz", type=int, default=20000, help="случайных строк для сверки токенайзеров")
+    args = ap.parse_args()
+
+    rnd = random.Random(args.seed)
+    rules = [
+        {"id": f"r{i}", "dsl": gen_keyed_rule(rnd) if rnd.random() < args.keyed else gen_rule(rnd)}
+        for i in range(args.rules)
+    ]
+    txs = [gen_tx(rnd) for _ in range(args.txs)]
+
+    def run_simple(tx, user):
+        return [evaluate_simple(r["dsl"], tx, user) for r in rules]
+
+    def run_compiled(tx, user):
+        return [get_compiled(r["id"], r["dsl"])(tx, user) for r in rules]
+
+    clear_cache()
+    t0 = time.perf_counter()
+    for r in rules:
+        get_compiled(r["id"], r["dsl"])
+    compile_time = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    program = CompiledRuleset(rules)
+    ruleset_time = time.perf_counter() - t0
+
+    for tx, user in txs:
+        expected = run_simple(tx, user)
+        if expected != run_compiled(tx, user) or expected != program.evaluate(tx, user):
+            raise SystemExit(f"mismatch on {tx} {user}")
+
+    t_simple = _timeit(run_simple, txs)
+    t_compiled = _timeit(run_compiled, txs)
+    t_ruleset = _timeit(program.evaluate, txs)
+
+    tx_cols = [tx for tx, _ in txs]
+    user_cols = [u for _, u in txs]
+    matrix = evaluate_matrix(program, tx_cols, user_cols)
+    if matrix.T.tolist() != [program.evaluate(tx, u) for tx, u in txs]:
+        raise SystemExit("vectorized mismatch")
+    t0 = time.perf_counter()
+    evaluate_matrix(program, tx_cols, user_cols)
+    t_vector = time.perf_counter() - t0
+
+    per_tx = lambda t: t / len(txs) * 1e6
+    print(f"rules={len(rules)} txs={len(txs)}")
+    print(f"compile (all rules)   {compile_time * 1e3:10.2f} ms")
+    print(f"compile (ruleset)     {ruleset_time * 1e3:10.2f} ms  "
+          f"{len(program.predicates)} unique predicates of {sum(program.references)}, "
+          f"{program.eq_index.indexed} rules in equality index, "
+          f"{sum(len(g.thresholds) for g in program.thresholds.groups.values())} thresholds "
+          f"in {len(program.thresholds.groups)} fields, "
+          f"{sum(a is None for a in program.asts)} dead rules")
+    print(f"evaluate_simple       {per_tx(t_simple):10.1f} us/tx")
+    print(f"compiled              {per_tx(t_compiled):10.1f} us/tx  x{t_simple / t_compiled:.1f}")
+    print(f"ruleset (shared)      {per_tx(t_ruleset):10.1f} us/tx  x{t_simple / t_ruleset:.1f}")
+    print(f"vectorized (batch)    {per_tx(t_vector):10.1f} us/tx  x{t_simple / t_vector:.1f}")
+
+    bench_blocklist(rnd, txs, args.blocklist)
+    bench_tokenizer(rnd, rules, args.fuzz)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,272 @@
+"""
+Компилятор DSL: AST (tokenizer + Parser) -> Python-замыкание.
+
+Правило разбирается один раз, дальше на каждую транзакцию вызывается
+готовая функция fn(tx, user) -> bool без normalize/split/regex.
+Семантика совпадает с evaluate_simple:
+- поле со значением None -> сравнение ложно;
+- числовой литерал -> сравнение через float(), ошибка приведения -> False;
+- строковый литерал -> только = / !=, сравнение через str();
+- IN (...) — то же, что OR из `=`, NOT IN — AND из `!=`, но через frozenset
+  (поиск O(1) при любом размере списка).
+"""
+
+from __future__ import annotations
+
+from typing import Any, Callable
+
+from app.dsl.ast import Field, Number, String, Compare, InList, Not, And, Or, Node
+from app.dsl.parcer import Parser
+from app.dsl.tokenizer import tokenize_fast
+
+Evaluator = Callable[[dict, dict], bool]
+Getter = Callable[[dict, dict], Any]
+
+OPS = {
+    ">": lambda a, b: a > b,
+    ">=": lambda a, b: a >= b,
+    "<": lambda a, b: a < b,
+    "<=": lambda a, b: a <= b,
+    "=": lambda a, b: a == b,
+    "!=": lambda a, b: a != b,
+}
+
+# a OP b  <=>  b SWAPPED[OP] a
+SWAPPED = {">": "<", ">=": "<=", "<": ">", "<=": ">=", "=": "=", "!=": "!="}
+
+STRING_OPS = {"=", "!="}
+
+
+def parse(src: str) -> Node:
+    return Parser(tokenize_fast(src), src).parse()
+
+
+def field_getter(name: str) -> Getter:
+    """
+    То же, что resolve_field, но разбор имени делается один раз.
+    """
+    if name.startswith("user."):
+        key = name.split(".", 1)[1]
+        return lambda tx, user: user.get(key)
+
+    if "." in name:
+        root, sub = name.split(".", 1)
+        return lambda tx, user: (tx.get(root) or {}).get(sub)
+
+    return lambda tx, user: tx.get(name)
+
+
+def operand_key(node: Node) -> tuple:
+    if isinstance(node, Field):
+        return ("f", node.name)
+    if isinstance(node, Number):
+        return ("n", float(node.value))
+    if isinstance(node, String):
+        return ("s", node.value)
+    raise ValueError(f"Unsupported operand: {type(node).__name__}")
+
+
+def canonical_compare(node: Compare) -> Compare:
+    """
+    Литерал переносим направо (100 < amount -> amount > 100),
+    чтобы одно и то же условие давало один ключ.
+    """
+    if not isinstance(node.left, Field) and isinstance(node.right, Field):
+        return Compare(pos=node.pos, op=SWAPPED[node.op], left=node.right, right=node.left)
+    return node
+
+
+def compare_key(node: Compare) -> tuple:
+    """
+    Ключ сравнения без позиции в исходнике.
+    """
+    node = canonical_compare(node)
+    return ("cmp", node.op, operand_key(node.left), operand_key(node.right))
+
+
+def in_key(node: InList) -> tuple:
+    """
+    Ключ IN-списка: порядок и повторы литералов не важны.
+    """
+    return ("in", node.negated, operand_key(node.left), frozenset(operand_key(v) for v in node.values))
+
+
+def predicate_key(node: Compare | InList) -> tuple:
+    return in_key(node) if isinstance(node, InList) else compare_key(node)
+
+
+def canonical_predicate(node: Compare | InList) -> Compare | InList:
+    return node if isinstance(node, InList) else canonical_compare(node)
+
+
+def _false(tx: dict, user: dict) -> bool:
+    return False
+
+
+def _true(tx: dict, user: dict) -> bool:
+    return True
+
+
+def compile_compare(node: Compare) -> Evaluator:
+    left, right, op = node.left, node.right, node.op
+
+    # литерал слева: 100 < amount -> amount > 100
+    if not isinstance(left, Field) and isinstance(right, Field):
+        left, right, op = right, left, SWAPPED[op]
+
+    fn = OPS[op]
+
+    # константа: 1 > 0
+    if not isinstance(left, Field):
+        try:
+            if isinstance(left, String) or isinstance(right, String):
+                value = op in STRING_OPS and fn(str(left.value), str(right.value))
+            else:
+                value = fn(float(left.value), float(right.value))
+        except Exception:
+            value = False
+        return _true if value else _false
+
+    # поле с полем не поддерживаем (как и evaluate_simple)
+    if isinstance(right, Field):
+        return _false
+
+    get = field_getter(left.name)
+
+    if isinstance(right, Number):
+        num = float(right.value)
+
+        def cmp_number(tx: dict, user: dict) -> bool:
+            v = get(tx, user)
+            if v is None:
+                return False
+            try:
+                return fn(float(v), num)
+            except Exception:
+                return False
+
+        return cmp_number
+
+    if op not in STRING_OPS:
+        return _false
+
+    text = right.value
+
+    def cmp_string(tx: dict, user: dict) -> bool:
+        v = get(tx, user)
+        if v is None:
+            return False
+        return fn(str(v), text)
+
+    return cmp_string
+
+
+def in_sets(node: InList) -> tuple[frozenset[str], frozenset[float]]:
+    strings = frozenset(v.value for v in node.values if isinstance(v, String))
+    numbers = frozenset(float(v.value) for v in node.values if isinstance(v, Number))
+    return strings, numbers
+
+
+def compile_in(node: InList) -> Evaluator:
+    strings, numbers = in_sets(node)
+    negated = node.negated
+
+    # литерал слева: 'a' IN ('a', 'b') — константа
+    if not isinstance(node.left, Field):
+        probe = {"v": node.left.value}
+        value = compile_in(InList(pos=node.pos, left=Field(pos=0, name="v"), values=node.values, negated=negated))(probe, {})
+        return _true if value else _false
+
+    get = field_getter(node.left.name)
+
+    def contains(v) -> bool | None:
+        """
+        True/False — есть ли значение в списке; None — число не привелось
+        (для числовых литералов это как ошибка сравнения: False в обе стороны).
+        """
+        if strings and str(v) in strings:
+            return True
+        if numbers:
+            try:
+                return float(v) in numbers
+            except Exception:
+                return None
+        return False
+
+    if not negated:
+        def in_list(tx: dict, user: dict) -> bool:
+            v = get(tx, user)
+            if v is None:
+                return False
+            return contains(v) is True
+
+        return in_list
+
+    def not_in_list(tx: dict, user: dict) -> bool:
+        v = get(tx, user)
+        if v is None:
+            return False
+        return contains(v) is False
+
+    return not_in_list
+
+
+def compile_predicate(node: Compare | InList) -> Evaluator:
+    return compile_in(node) if isinstance(node, InList) else compile_compare(node)
+
+
+def compile_node(node: Node) -> Evaluator:
+    if isinstance(node, (Compare, InList)):
+        return compile_predicate(node)
+
+    if isinstance(node, Not):
+        inner = compile_node(node.expr)
+        return lambda tx, user: not inner(tx, user)
+
+    if isinstance(node, And):
+        a, b = compile_node(node.left), compile_node(node.right)
+        return lambda tx, user: a(tx, user) and b(tx, user)
+
+    if isinstance(node, Or):
+        a, b = compile_node(node.left), compile_node(node.right)
+        return lambda tx, user: a(tx, user) or b(tx, user)
+
+    # одиночный операнд без сравнения парсер не пропускает
+    raise ValueError(f"Unsupported node: {type(node).__name__}")
+
+
+def compile_rule(src: str) -> Evaluator:
+    """
+    Компилирует выражение. Ошибка разбора -> ValueError с dsl_issue (как у Parser).
+    """
+    return compile_node(parse(src))
+
+
+# rule_id -> (выражение, скомпилированная функция)
+# на одно правило храним ровно одну версию, поэтому кэш не растёт при правках;
+# сверка выражения дешёвая: у str hash кэшируется, а при совпадении объекта
+# сравнение строк вообще не идёт по символам
+_CACHE: dict[str, tuple[str, Evaluator]] = {}
+
+
+def get_compiled(rule_id: str, src: str) -> Evaluator:
+    """
+    Возвращает скомпилированное правило из кэша (ключ: id правила + выражение).
+    Невалидное выражение кэшируется как "никогда не срабатывает",
+    ровно как evaluate_simple возвращает False на неподдерживаемом синтаксисе.
+    """
+    hit = _CACHE.get(rule_id)
+    if hit is not None and hit[0] == src:
+        return hit[1]
+
+    try:
+        fn = compile_rule(src)
+    except (ValueError, IndexError):
+        fn = _false
+
+    _CACHE[rule_id] = (src, fn)
+    return fn
+
+
+def clear_cache() -> None:
+    _CACHE.clear()
@@ -0,0 +1,188 @@
+"""
+Индексы над набором правил, позволяющие не исполнять правила,
+которые заведомо не могут сработать на данной транзакции.
+"""
+
+from __future__ import annotations
+
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+
+from app.dsl.ast import Field, Number, String, Compare, InList, And, Node
+from app.dsl.compiler import Getter, field_getter
+
+
+def conjuncts(node: Node) -> list[Node]:
+    """
+    Операнды AND верхнего уровня: a AND (b AND c) -> [a, b, c].
+    """
+    if isinstance(node, And):
+        return conjuncts(node.left) + conjuncts(node.right)
+    return [node]
+
+
+def _equality(node: Node) -> tuple[str, tuple[str, ...]] | None:
+    """
+    (поле, строковые литералы) для `field = 'literal'` / `'literal' = field`
+    и `field IN ('a', 'b', ...)` (только строки: ключ корзины — str(значение)).
+    """
+    if isinstance(node, InList):
+        if node.negated or not isinstance(node.left, Field):
+            return None
+        if not all(isinstance(v, String) for v in node.values):
+            return None
+        return node.left.name, tuple(v.value for v in node.values)
+    if not isinstance(node, Compare) or node.op != "=":
+        return None
+    if isinstance(node.left, Field) and isinstance(node.right, String):
+        return node.left.name, (node.right.value,)
+    if isinstance(node.right, Field) and isinstance(node.left, String):
+        return node.right.name, (node.left.value,)
+    return None
+
+
+class EqualityIndex:
+    """
+    Инвертированный индекс (поле, литерал) -> номера правил.
+
+    Правило вида `... AND currency = 'RUB' AND ...` не может сработать, если
+    currency транзакции не 'RUB': такое правило кладём в корзину
+    ('currency', 'RUB') и исполняем, только если значение поля совпало.
+    Каждое правило индексируется по одному равенству — по полю с наибольшим
+    числом различных литералов в наборе (самому избирательному); правило с
+    `field IN (...)` попадает в корзину каждого литерала списка.
+    Правила без подходящих равенств исполняются всегда.
+    """
+
+    def __init__(self, asts: list[Node | None]):
+        self.always: list[int] = []
+        self.buckets: dict[str, dict[str, list[int]]] = defaultdict(dict)
+        self.indexed = 0
+
+        per_rule: list[list[tuple[str, tuple[str, ...]]]] = []
+        distinct: dict[str, set[str]] = defaultdict(set)
+        for ast in asts:
+            eqs = []
+            if ast is not None:
+                eqs = [e for e in map(_equality, conjuncts(ast)) if e is not None]
+            for f, vs in eqs:
+                distinct[f].update(vs)
+            per_rule.append(eqs)
+
+        for i, (ast, eqs) in enumerate(zip(asts, per_rule)):
+            if ast is None:
+                # невалидное правило не срабатывает никогда
+                continue
+            if not eqs:
+                self.always.append(i)
+                continue
+            # при равной избирательности поля — равенство с меньшим числом литералов
+            f, vs = max(eqs, key=lambda e: (len(distinct[e[0]]), -len(e[1])))
+            for v in set(vs):
+                self.buckets[f].setdefault(v, []).append(i)
+            self.indexed += 1
+
+        self._getters: list[tuple[str, Getter]] = [(f, field_getter(f)) for f in self.buckets]
+
+    def candidates(self, tx: dict, user: dict) -> list[int]:
+        """
+        Номера правил, которые надо исполнить; остальные заведомо matched=false.
+        У поля одно значение, поэтому правило попадает в кандидаты не больше раза.
+        """
+        out = list(self.always)
+        for f, get in self._getters:
+            v = get(tx, user)
+            if v is None:
+                continue
+            ids = self.buckets[f].get(str(v))
+            if ids:
+                out.extend(ids)
+        return out
+
+
+NUMERIC_OPS = {">", ">=", "<", "<=", "=", "!="}
+
+# cut() для NaN: любое сравнение ложно, кроме !=
+NAN_CUT = (-1, -1)
+
+
+class ThresholdGroup:
+    """
+    Все числовые сравнения одного поля: `amount > 100`, `amount <= 5000`, ...
+
+    Пороги лежат в отсортированном массиве; для значения x две бисекции дают
+    lo = #{t < x} и hi = #{t <= x}, после чего любое сравнение с порогом
+    ранга r решается без обращения к транзакции:
+        x > t  <=> r < lo        x >= t <=> r < hi
+        x < t  <=> r >= hi       x <= t <=> r >= lo
+        x = t  <=> lo <= r < hi
+    """
+
+    def __init__(self, field: str, thresholds: list[float]):
+        self.field = field
+        self.thresholds = sorted(set(thresholds))
+        self._rank = {t: r for r, t in enumerate(self.thresholds)}
+        self._get = field_getter(field)
+
+    def rank(self, threshold: float) -> int:
+        return self._rank[threshold]
+
+    def cut(self, tx: dict, user: dict) -> tuple[int, int] | None:
+        """
+        (lo, hi) для значения поля; None — поля нет или оно не число
+        (тогда любое сравнение ложно, как в compile_compare); NAN_CUT — NaN.
+        """
+        v = self._get(tx, user)
+        if v is None:
+            return None
+        try:
+            x = float(v)
+        except Exception:
+            return None
+        if x != x:
+            return NAN_CUT
+        return bisect_left(self.thresholds, x), bisect_right(self.thresholds, x)
+
+
+def threshold_test(op: str, rank: int):
+    """
+    Проверка результата ThresholdGroup.cut для порога ранга rank.
+    """
+    if op == ">":
+        return lambda lo, hi: rank < lo
+    if op == ">=":
+        return lambda lo, hi: rank < hi
+    if op == "<":
+        return lambda lo, hi: rank >= hi
+    if op == "<=":
+        return lambda lo, hi: rank >= lo
+    if op == "=":
+        return lambda lo, hi: lo <= rank < hi
+    return lambda lo, hi: not (lo <= rank < hi)
+
+
+class ThresholdIndex:
+    """
+    Группы порогов по полям для всех сравнений `field OP number` набора.
+    """
+
+    def __init__(self, compares: list[Node]):
+        per_field: dict[str, list[float]] = defaultdict(list)
+        for c in compares:
+            if is_threshold(c):
+                per_field[c.left.name].append(float(c.right.value))
+        self.groups: dict[str, ThresholdGroup] = {
+            f: ThresholdGroup(f, ts) for f, ts in per_field.items()
+        }
+
+
+def is_threshold(node: Node) -> bool:
+    """
+    Каноническое (литерал справа) сравнение поля с числом.
+    """
+    return (
+        isinstance(node, Compare)
+        and isinstance(node.left, Field)
+        and isinstance(node.right, Number)
+        and node.op in NUMERIC_OPS
+    )
@@ -0,0 +1,398 @@
+"""
+Оптимизирующий проход по AST правила (выход Parser).
+
+- свёртка констант: сравнения литералов, NOT NOT x -> x, AND/OR с константой;
+- уплощение вложенных AND/OR и удаление повторов;
+- в AND: противоречия (currency = 'RUB' AND currency = 'USD',
+  amount > 10 AND amount < 5) и поглощённые условия
+  (amount > 10 AND amount > 5 -> amount > 10);
+- в OR: поглощённые условия (amount > 10 OR amount > 5 -> amount > 5);
+- IN: повторы литералов убираются, IN из одного литерала -> `=`, в AND
+  допустимые множества строк пересекаются, а цепочка строковых `=`/IN
+  по одному полю в OR сливается в один IN (один frozenset вместо N сравнений).
+
+Семантика сохраняется с учётом того, что сравнение с отсутствующим
+(None) или нечисловым значением ложно: все упрощения выполняются
+только внутри AND/OR над одним и тем же полем.
+Правило, свернувшееся в False, никогда не сработает — его можно не исполнять.
+"""
+
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+
+from app.dsl.ast import Field, Number, String, Compare, InList, Not, And, Or, Node, unparse
+from app.dsl.compiler import OPS, canonical_compare, compile_compare, compile_in, operand_key, predicate_key
+from app.dsl.errors import DslIssue
+
+
+@dataclass
+class Optimized:
+    # None, если выражение целиком свернулось в константу
+    node: Node | None
+    constant: bool | None = None
+    issues: list[DslIssue] = field(default_factory=list)
+
+    @property
+    def never_matches(self) -> bool:
+        return self.constant is False
+
+
+def flatten(node: Node) -> list[Node]:
+    """
+    Операнды цепочки одного типа: (a AND b) AND c -> [a, b, c].
+    """
+    kind = type(node)
+    out: list[Node] = []
+    stack = [node]
+    while stack:
+        n = stack.pop()
+        if type(n) is kind:
+            stack.append(n.right)
+            stack.append(n.left)
+        else:
+            out.append(n)
+    return out
+
+
+def node_key(node: Node) -> tuple:
+    """
+    Структурный ключ узла без позиций в исходнике.
+    """
+    if isinstance(node, (Compare, InList)):
+        return predicate_key(node)
+    if isinstance(node, Not):
+        return ("not", node_key(node.expr))
+    if isinstance(node, (And, Or)):
+        return (type(node).__name__, tuple(node_key(x) for x in flatten(node)))
+    raise ValueError(f"Unsupported node: {type(node).__name__}")
+
+
+def _start(node: Node) -> int:
+    """
+    Позиция начала узла в исходнике (у Compare/And/Or pos указывает на оператор).
+    """
+    if isinstance(node, Compare):
+        return min(node.left.pos, node.right.pos)
+    if isinstance(node, InList):
+        return node.left.pos
+    if isinstance(node, (And, Or)):
+        return _start(node.left)
+    return node.pos
+
+
+def _rebuild(kind: type, operands: list[Node]) -> Node:
+    node = operands[0]
+    for x in operands[1:]:
+        node = kind(pos=x.pos, left=node, right=x)
+    return node
+
+
+def _string_in(like: Node, name: str, values: list[str]) -> Node:
+    """
+    `name = 'v'` для одного значения, иначе `name IN ('v1', 'v2', ...)`.
+    """
+    field = Field(pos=like.left.pos, name=name)
+    if len(values) == 1:
+        return Compare(pos=like.pos, op="=", left=field, right=String(pos=like.pos, value=values[0]))
+    return InList(
+        pos=like.pos,
+        left=field,
+        values=tuple(String(pos=like.pos, value=v) for v in values),
+    )
+
+
+class _Bound:
+    """
+    Числовое ограничение поля: value + op из {>, >=, <, <=, =}.
+    """
+
+    def __init__(self, node: Compare):
+        self.node = node
+        self.op = node.op
+        self.value = float(node.right.value)
+
+    @property
+    def lower(self) -> bool:
+        return self.op in (">", ">=")
+
+    @property
+    def upper(self) -> bool:
+        return self.op in ("<", "<=")
+
+    def admits(self, x: float) -> bool:
+        return OPS[self.op](x, self.value)
+
+    def tighter(self, other: "_Bound") -> bool:
+        """
+        self строже other (для границ одного направления).
+        """
+        if self.value != other.value:
+            return self.value > other.value if self.lower else self.value < other.value
+        return self.op in (">", "<")
+
+
+class Optimizer:
+    def __init__(self, src: str = ""):
+        self.src = src
+        self.issues: list[DslIssue] = []
+
+    def _warn(self, code: str, message: str, node: Node) -> None:
+        pos = _start(node)
+        self.issues.append(DslIssue(
+            code=code,
+            message=message,
+            position=pos,
+            near=self.src[pos:pos + 20] if self.src else unparse(node)[:20],
+        ))
+
+    def run(self, node: Node) -> Optimized:
+        out = self._opt(node)
+        if isinstance(out, bool):
+            if out:
+                self._warn("DSL_ALWAYS_MATCHES", "Rule always matches", node)
+            else:
+                self._warn("DSL_NEVER_MATCHES", "Rule can never match", node)
+            return Optimized(node=None, constant=out, issues=self.issues)
+        return Optimized(node=out, issues=self.issues)
+
+    def _opt(self, node: Node) -> Node | bool:
+        if isinstance(node, Compare):
+            return self._compare(node)
+
+        if isinstance(node, InList):
+            return self._in_list(node)
+
+        if isinstance(node, Not):
+            inner = self._opt(node.expr)
+            if isinstance(inner, bool):
+                return not inner
+            if isinstance(inner, Not):
+                return inner.expr
+            return Not(pos=node.pos, expr=inner)
+
+        if isinstance(node, (And, Or)):
+            return self._junction(node)
+
+        raise ValueError(f"Unsupported node: {type(node).__name__}")
+
+    def _compare(self, node: Compare) -> Compare | bool:
+        node = canonical_compare(node)
+        if not isinstance(node.left, Field) or isinstance(node.right, Field):
+            # сравнение литералов или полей: результат не зависит от транзакции
+            return compile_compare(node)({}, {})
+        if isinstance(node.right, String) and node.op not in ("=", "!="):
+            self._warn("DSL_INVALID_OPERATOR", f"Operator {node.op} is never true for strings", node)
+            return False
+        return node
+
+    def _in_list(self, node: InList) -> Node | bool:
+        if not isinstance(node.left, Field):
+            return compile_in(node)({}, {})
+
+        values: list[Node] = []
+        seen: set[tuple] = set()
+        for v in node.values:
+            key = operand_key(v)
+            if key in seen:
+                self._warn("DSL_REDUNDANT", f"Duplicate value in list: {unparse(v)}", v)
+                continue
+            seen.add(key)
+            values.append(v)
+
+        if len(values) == 1:
+            # x IN (a) == x = a, x NOT IN (a) == x != a (в т.ч. для None и не-чисел)
+            return Compare(pos=node.pos, op="!=" if node.negated else "=", left=node.left, right=values[0])
+        return InList(pos=node.pos, left=node.left, values=tuple(values), negated=node.negated)
+
+    def _junction(self, node: And | Or) -> Node | bool:
+        is_and = isinstance(node, And)
+        kind = type(node)
+        # AND: False решает, True нейтрален; OR — наоборот
+        absorbing = not is_and
+
+        operands: list[Node] = []
+        seen: set[tuple] = set()
+        for x in flatten(node):
+            x = self._opt(x)
+            if isinstance(x, bool):
+                if x is absorbing:
+                    return absorbing
+                continue
+            for y in flatten(x) if type(x) is kind else [x]:
+                key = node_key(y)
+                if key in seen:
+                    self._warn("DSL_REDUNDANT", f"Duplicate condition: {unparse(y)}", y)
+                    continue
+                seen.add(key)
+                operands.append(y)
+
+        simplified = self._simplify_and(operands) if is_and else self._simplify_or(operands)
+        if isinstance(simplified, bool):
+            return simplified
+        if not simplified:
+            return not absorbing
+        if len(simplified) == 1:
+            return simplified[0]
+        return _rebuild(kind, simplified)
+
+    def _by_field(self, operands: list[Node]) -> tuple[dict[str, list[tuple[Node, bool, frozenset]]], dict[str, list[Compare]]]:
+        """
+        strings: поле -> [(узел, положительный ли, множество строк)] для
+        `=`/IN (положительные) и `!=`/NOT IN только со строковыми литералами;
+        numbers: поле -> сравнения с числом.
+        """
+        strings: dict[str, list[tuple[Node, bool, frozenset]]] = {}
+        numbers: dict[str, list[Compare]] = {}
+        for x in operands:
+            if isinstance(x, Compare) and isinstance(x.left, Field):
+                if isinstance(x.right, String) and x.op in ("=", "!="):
+                    strings.setdefault(x.left.name, []).append((x, x.op == "=", frozenset([x.right.value])))
+                elif isinstance(x.right, Number):
+                    numbers.setdefault(x.left.name, []).append(x)
+            elif isinstance(x, InList) and isinstance(x.left, Field):
+                if all(isinstance(v, String) for v in x.values):
+                    values = frozenset(v.value for v in x.values)
+                    strings.setdefault(x.left.name, []).append((x, not x.negated, values))
+        return strings, numbers
+
+    def _simplify_and(self, operands: list[Node]) -> list[Node] | bool:
+        drop: set[int] = set()
+        replace: dict[int, Node] = {}
+        strings, numbers = self._by_field(operands)
+
+        for name, cs in strings.items():
+            pos = [(n, vs) for n, positive, vs in cs if positive]
+            neg = [(n, vs) for n, positive, vs in cs if not positive]
+            if not pos:
+                continue
+
+            allowed = frozenset.intersection(*(vs for _, vs in pos))
+            excluded = frozenset().union(*(vs for _, vs in neg))
+            if not allowed or allowed <= excluded:
+                self._warn("DSL_CONTRADICTION", f"No value of {name} satisfies all conditions", pos[0][0])
+                return False
+
+            for n, vs in neg:
+                if not (vs & allowed):
+                    # = 'A' уже влечёт != 'B'
+                    self._warn("DSL_REDUNDANT", f"Implied condition: {unparse(n)}", n)
+                    drop.add(id(n))
+
+            # из положительных оставляем одно условие с итоговым множеством
+            narrowest = min(pos, key=lambda p: len(p[1]))
+            for n, vs in pos:
+                if n is not narrowest[0]:
+                    self._warn("DSL_REDUNDANT", f"Implied condition: {unparse(n)}", n)
+                    drop.add(id(n))
+            if narrowest[1] != allowed:
+                n = narrowest[0]
+                replace[id(n)] = _string_in(n, name, sorted(allowed))
+
+        for name, cs in numbers.items():
+            bounds = [_Bound(c) for c in cs if c.op != "!="]
+            ne = [c for c in cs if c.op == "!="]
+
+            eqs = {b.value for b in bounds if b.op == "="}
+            if len(eqs) > 1:
+                self._warn("DSL_CONTRADICTION", f"{name} cannot equal several values at once", cs[0])
+                return False
+
+            if eqs:
+                # точное значение: остальные границы либо лишние, либо противоречат ему
+                (value,) = eqs
+                for b in bounds:
+                    if b.op == "=":
+                        continue
+                    if not b.admits(value):
+                        self._warn("DSL_CONTRADICTION", f"Conflicting conditions on {name}", b.node)
+                        return False
+                    self._warn("DSL_REDUNDANT", f"Implied condition: {unparse(b.node)}", b.node)
+                    drop.add(id(b.node))
+                for c in ne:
+                    if float(c.right.value) == value:
+                        self._warn("DSL_CONTRADICTION", f"{name} = and != the same value", c)
+                        return False
+                    self._warn("DSL_REDUNDANT", f"Implied condition: {unparse(c)}", c)
+                    drop.add(id(c))
+                continue
+
+            lower = [b for b in bounds if b.lower]
+            upper = [b for b in bounds if b.upper]
+            lo = self._keep_tightest(lower, drop)
+            hi = self._keep_tightest(upper, drop)
+
+            if lo and hi:
+                empty = lo.value > hi.value or (
+                    lo.value == hi.value and (lo.op == ">" or hi.op == "<")
+                )
+                if empty:
+                    self._warn("DSL_CONTRADICTION", f"Conflicting conditions on {name}", hi.node)
+                    return False
+
+            for c in ne:
+                v = float(c.right.value)
+                if (lo and not lo.admits(v)) or (hi and not hi.admits(v)):
+                    self._warn("DSL_REDUNDANT", f"Implied condition: {unparse(c)}", c)
+                    drop.add(id(c))
+
+        return [replace.get(id(x), x) for x in operands if id(x) not in drop]
+
+    def _keep_tightest(self, bounds: list[_Bound], drop: set[int]) -> _Bound | None:
+        if not bounds:
+            return None
+        best = bounds[0]
+        for b in bounds[1:]:
+            if b.tighter(best):
+                best = b
+        for b in bounds:
+            if b is not best:
+                self._warn("DSL_REDUNDANT", f"Subsumed condition: {unparse(b.node)}", b.node)
+                drop.add(id(b.node))
+        return best
+
+    def _simplify_or(self, operands: list[Node]) -> list[Node]:
+        drop: set[int] = set()
+        replace: dict[int, Node] = {}
+        strings, numbers = self._by_field(operands)
+
+        # a = 'x' OR a = 'y' OR a IN ('z') -> a IN ('x', 'y', 'z')
+        for name, cs in strings.items():
+            pos = [(n, vs) for n, positive, vs in cs if positive]
+            if len(pos) < 2:
+                continue
+            merged = frozenset().union(*(vs for _, vs in pos))
+            replace[id(pos[0][0])] = _string_in(pos[0][0], name, sorted(merged))
+            for n, _ in pos[1:]:
+                drop.add(id(n))
+
+        for name, cs in numbers.items():
+            bounds = [_Bound(c) for c in cs if c.op != "!="]
+            lower = [b for b in bounds if b.lower]
+            upper = [b for b in bounds if b.upper]
+
+            # в OR остаётся самая слабая граница каждого направления
+            keep = []
+            for group in (lower, upper):
+                if not group:
+                    continue
+                loosest = group[0]
+                for b in group[1:]:
+                    if loosest.tighter(b):
+                        loosest = b
+                for b in group:
+                    if b is not loosest:
+                        self._warn("DSL_REDUNDANT", f"Subsumed condition: {unparse(b.node)}", b.node)
+                        drop.add(id(b.node))
+                keep.append(loosest)
+
+            for b in bounds:
+                if b.op == "=" and any(k.admits(b.value) for k in keep):
+                    self._warn("DSL_REDUNDANT", f"Subsumed condition: {unparse(b.node)}", b.node)
+                    drop.add(id(b.node))
+
+        return [replace.get(id(x), x) for x in operands if id(x) not in drop]
+
+
+def optimize(node: Node, src: str = "") -> Optimized:
+    return Optimizer(src).run(node)
@@ -1,7 +1,7 @@
 from __future__ import annotations
 
 from app.dsl.tokenizer import Token
-from app.dsl.ast import Field, Number, String, Compare, Not, And, Or, Node
+from app.dsl.ast import Field, Number, String, Compare, InList, Not, And, Or, Node
 from app.dsl.errors import DslIssue
 
 
@@ -35,8 +35,9 @@ class Parser:
     # andExpr := unary (AND unary)*
     # unary := NOT unary | primary
     # primary := '(' expr ')' | comparison
-    # comparison := operand OP operand
+    # comparison := operand OP operand | operand [NOT] IN '(' literal (',' literal)* ')'
     # operand := IDENT | NUMBER | STRING
+    # literal := NUMBER | STRING
     def parse(self) -> Node:
         node = self._or()
         if self.cur().kind != "EOF":
@@ -78,12 +79,38 @@ class Parser:
 
     def _comparison(self) -> Node:
         left = self._operand()
+        if self.cur().kind == "IN" or (
+            self.cur().kind == "NOT" and self.toks[self.i + 1].kind == "IN"
+        ):
+            return self._in_list(left)
         if self.cur().kind != "OP":
             raise self._err("DSL_PARSE_ERROR", "Expected operator", self.cur().pos)
         op = self.eat("OP")
         right = self._operand()
         return Compare(pos=op.pos, op=op.text, left=left, right=right)
 
+    def _in_list(self, left: Node) -> Node:
+        negated = self.cur().kind == "NOT"
+        if negated:
+            self.eat("NOT")
+        op = self.eat("IN")
+        if self.cur().kind != "LPAREN":
+            raise self._err("DSL_PARSE_ERROR", "Expected '(' after IN", self.cur().pos)
+        lp = self.eat("LPAREN")
+        values = [self._literal()]
+        while self.cur().kind == "COMMA":
+            self.eat("COMMA")
+            values.append(self._literal())
+        if self.cur().kind != "RPAREN":
+            raise self._err("DSL_PARSE_ERROR", "Missing ')'", lp.pos)
+        self.eat("RPAREN")
+        return InList(pos=op.pos, left=left, values=tuple(values), negated=negated)
+
+    def _literal(self) -> Node:
+        if self.cur().kind not in ("NUMBER", "STRING"):
+            raise self._err("DSL_PARSE_ERROR", "Expected literal", self.cur().pos)
+        return self._operand()
+
     def _operand(self) -> Node:
         t = self.cur()
         if t.kind == "IDENT":
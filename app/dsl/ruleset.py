@@ -0,0 +1,351 @@
+"""
+Компиляция всего набора активных правил в одну программу решения.
+
+Одинаковые сравнения (например currency = 'RUB' или amount > 10000)
+в разных правилах сводятся к одному предикату: на транзакцию он
+вычисляется не больше одного раза, а результат раздаётся всем
+правилам, которые его используют.
+"""
+
+from __future__ import annotations
+
+import time
+from typing import Callable
+
+from app.dsl.ast import Field, Compare, InList, Not, And, Or, Node, unparse
+from app.dsl.compiler import Evaluator, compile_predicate, canonical_predicate, predicate_key, parse
+from app.dsl.index import EqualityIndex, ThresholdIndex, NAN_CUT, is_threshold, threshold_test
+from app.dsl.optimizer import flatten, optimize
+from app.dsl.profiler import RuleProfiler
+
+# (memo, tx, user) -> bool
+RuleProgram = Callable[[list, dict, dict], bool]
+
+
+def _never(memo: list, tx: dict, user: dict) -> bool:
+    return False
+
+
+class Junction:
+    """
+    n-арный AND/OR с обучаемым порядком операндов.
+
+    Пока включён сэмплинг (общий флаг набора), для каждого операнда
+    считаются вызовы, число True и время. reorder() ставит первым операнд
+    с наименьшей ценой за решающий исход: для AND — cost / P(False),
+    для OR — cost / P(True). Предикаты не бросают исключений и не имеют
+    побочных эффектов, поэтому порядок не влияет на результат.
+    """
+
+    def __init__(self, node: Node, operands: list[Node], fns: list[RuleProgram], sampling: list[bool]):
+        self.is_and = isinstance(node, And)
+        self.operands = operands
+        self.fns = fns
+        n = len(fns)
+        self.calls = [0] * n
+        self.hits = [0] * n
+        self.cost_ns = [0] * n
+        # порядок — индексы в operands/fns; ordered — те же функции, уже переставленные
+        self.order: tuple[int, ...] = tuple(range(n))
+        self.ordered: tuple[RuleProgram, ...] = tuple(fns)
+        self._sampling = sampling
+
+    def __call__(self, memo: list, tx: dict, user: dict) -> bool:
+        if self._sampling[0]:
+            return self._measured(memo, tx, user)
+        if self.is_and:
+            for fn in self.ordered:
+                if not fn(memo, tx, user):
+                    return False
+            return True
+        for fn in self.ordered:
+            if fn(memo, tx, user):
+                return True
+        return False
+
+    def _measured(self, memo: list, tx: dict, user: dict) -> bool:
+        decisive = not self.is_and
+        for i in self.order:
+            t0 = time.perf_counter_ns()
+            v = bool(self.fns[i](memo, tx, user))
+            self.cost_ns[i] += time.perf_counter_ns() - t0
+            self.calls[i] += 1
+            self.hits[i] += v
+            if v is decisive:
+                return decisive
+        return not decisive
+
+    def score(self, i: int) -> float:
+        calls = self.calls[i]
+        if not calls:
+            return float("inf")
+        decisive = self.hits[i] if not self.is_and else calls - self.hits[i]
+        # сглаживание Лапласа, чтобы редкие исходы не давали деления на 0
+        p = (decisive + 1) / (calls + 2)
+        return (self.cost_ns[i] / calls) / p
+
+    def reorder(self) -> None:
+        # sorted стабилен: операнды без статистики остаются в прежнем порядке в конце
+        order = tuple(sorted(self.order, key=self.score))
+        if order != self.order:
+            self.order = order
+            self.ordered = tuple(self.fns[i] for i in order)
+
+    def describe(self) -> dict:
+        return {
+            "op": "AND" if self.is_and else "OR",
+            "operands": [
+                {
+                    "expression": unparse(self.operands[i]),
+                    "calls": self.calls[i],
+                    "hitRate": self.hits[i] / self.calls[i] if self.calls[i] else None,
+                    "avgCostNs": self.cost_ns[i] / self.calls[i] if self.calls[i] else None,
+                }
+                for i in self.order
+            ],
+        }
+
+
+class CompiledRuleset:
+    """
+    rules — список dict как из _load_active_rules (id, name, priority, enabled, dsl),
+    порядок сохраняется: evaluate() возвращает matched в том же порядке.
+    profile_every — каждая такая транзакция исполняется с замером каждого
+    правила (RuleProfiler), 0 — профилирование выключено.
+    """
+
+    # каждая SAMPLE_EVERY-я транзакция собирает статистику операндов,
+    # каждые REORDER_EVERY транзакций операнды AND/OR переупорядочиваются
+    SAMPLE_EVERY = 32
+    REORDER_EVERY = 4096
+
+    def __init__(self, rules: list[dict], profile_every: int = 0):
+        self.rules = rules
+        self.profile_every = profile_every
+        self.profiler = RuleProfiler(len(rules)) if profile_every > 0 else None
+        self.junctions: list[list[Junction]] = []
+        self.evaluations = 0
+        self._sampling = [False]
+        self.asts: list[Node | None] = []
+        # уникальные сравнения / IN-списки и их скомпилированные предикаты (индекс = слот memo)
+        self.compares: list[Compare | InList] = []
+        self.predicates: list[Evaluator] = []
+        self._slots: dict[tuple, int] = {}
+        # сколько раз каждое сравнение встречается во всех правилах (после оптимизации)
+        self.references: list[int] = []
+        # имена полей, на которые ссылаются правила (например для velocity-признаков)
+        self.fields: set[str] = set()
+        self.programs: list[RuleProgram] = []
+
+        # 1) разбор, оптимизация и регистрация уникальных сравнений;
+        # правило, свернувшееся в False, не исполняется вообще (ast=None),
+        # свернувшееся в True оставляем как есть — оно из одних литералов
+        for r in rules:
+            try:
+                ast = parse(r["dsl"])
+                opt = optimize(ast)
+                if opt.node is not None:
+                    ast = opt.node
+                elif opt.never_matches:
+                    ast = None
+                if ast is not None:
+                    self._register(ast)
+            except (ValueError, IndexError):
+                ast = None
+            self.asts.append(ast)
+
+        # 2) числовые пороги по полям: memo-слоты после предикатов хранят cut() группы
+        self.thresholds = ThresholdIndex(self.compares)
+        self._group_slots = {
+            f: len(self.predicates) + i for i, f in enumerate(self.thresholds.groups)
+        }
+        self.memo_size = len(self.predicates) + len(self._group_slots)
+
+        # 3) компиляция программ правил
+        self._rule_junctions: list[Junction] = []
+        for ast in self.asts:
+            self._rule_junctions = []
+            self.programs.append(_never if ast is None else self._compile(ast))
+            self.junctions.append(self._rule_junctions)
+        del self._rule_junctions
+
+        self.eq_index = EqualityIndex(self.asts)
+
+    def _register(self, node: Node) -> None:
+        if isinstance(node, (Compare, InList)):
+            self._slot(node)
+        elif isinstance(node, Not):
+            self._register(node.expr)
+        elif isinstance(node, (And, Or)):
+            self._register(node.left)
+            self._register(node.right)
+        else:
+            raise ValueError(f"Unsupported node: {type(node).__name__}")
+
+    def _slot(self, node: Compare | InList) -> int:
+        key = predicate_key(node)
+        slot = self._slots.get(key)
+        if slot is None:
+            slot = len(self.compares)
+            self._slots[key] = slot
+            node = canonical_predicate(node)
+            for operand in (node.left, *(node.values if isinstance(node, InList) else (node.right,))):
+                if isinstance(operand, Field):
+                    self.fields.add(operand.name)
+            self.compares.append(node)
+            self.predicates.append(compile_predicate(node))
+            self.references.append(0)
+        self.references[slot] += 1
+        return slot
+
+    def slot_of(self, node: Compare | InList) -> int:
+        """
+        Слот memo для сравнения / IN-списка из self.asts.
+        """
+        return self._slots[predicate_key(node)]
+
+    def _compile_threshold(self, slot: int, compare: Compare) -> RuleProgram:
+        """
+        Сравнение с порогом решается по cut() группы поля: две бисекции
+        на поле и транзакцию, сколько бы порогов ни было в наборе.
+        """
+        group = self.thresholds.groups[compare.left.name]
+        group_slot = self._group_slots[compare.left.name]
+        test = threshold_test(compare.op, group.rank(float(compare.right.value)))
+        on_nan = compare.op == "!="
+        cut = group.cut
+
+        def threshold(memo: list, tx: dict, user: dict) -> bool:
+            v = memo[slot]
+            if v is None:
+                c = memo[group_slot]
+                if c is None:
+                    c = memo[group_slot] = cut(tx, user) or False
+                if c is False:
+                    v = False
+                elif c is NAN_CUT:
+                    v = on_nan
+                else:
+                    v = test(*c)
+                memo[slot] = v
+            return v
+
+        return threshold
+
+    def _compile(self, node: Node) -> RuleProgram:
+        if isinstance(node, (Compare, InList)):
+            slot = self.slot_of(node)
+            compare = self.compares[slot]
+            if is_threshold(compare):
+                return self._compile_threshold(slot, compare)
+
+            pred = self.predicates[slot]
+
+            def cached(memo: list, tx: dict, user: dict) -> bool:
+                v = memo[slot]
+                if v is None:
+                    v = memo[slot] = pred(tx, user)
+                return v
+
+            return cached
+
+        if isinstance(node, Not):
+            inner = self._compile(node.expr)
+            return lambda memo, tx, user: not inner(memo, tx, user)
+
+        if isinstance(node, (And, Or)):
+            operands = flatten(node)
+            j = Junction(node, operands, [self._compile(x) for x in operands], self._sampling)
+            self._rule_junctions.append(j)
+            return j
+
+        raise ValueError(f"Unsupported node: {type(node).__name__}")
+
+    def evaluate(self, tx: dict, user: dict) -> list[bool]:
+        """
+        matched для каждого правила; ошибка в правиле -> False (как в цикле сервиса).
+        Исполняются только кандидаты из eq_index, остальные сразу False.
+        """
+        if self._tick():
+            return self._profiled(tx, user, first_match=False)[0]
+        memo: list = [None] * self.memo_size
+        out = [False] * len(self.programs)
+        programs = self.programs
+        for i in self.eq_index.candidates(tx, user):
+            try:
+                out[i] = bool(programs[i](memo, tx, user))
+            except Exception:
+                pass
+        return out
+
+    def first_match(self, tx: dict, user: dict) -> tuple[list[bool], int]:
+        """
+        Правила по порядку (приоритету) до первого сработавшего включительно.
+        Возвращает (matched, decided): matched[:decided] посчитаны окончательно,
+        остальные ещё не исполнялись; decided == len(rules), если не сработало ни одно.
+        """
+        if self._tick():
+            return self._profiled(tx, user, first_match=True)
+        memo: list = [None] * self.memo_size
+        out = [False] * len(self.programs)
+        programs = self.programs
+        for i in sorted(self.eq_index.candidates(tx, user)):
+            try:
+                matched = bool(programs[i](memo, tx, user))
+            except Exception:
+                matched = False
+            if matched:
+                out[i] = True
+                return out, i + 1
+        return out, len(out)
+
+    def _tick(self) -> bool:
+        """
+        Счётчик транзакций; True — эту транзакцию надо профилировать.
+        """
+        self.evaluations += 1
+        n = self.evaluations
+        self._sampling[0] = n % self.SAMPLE_EVERY == 0
+        if n % self.REORDER_EVERY == 0:
+            self.reorder()
+        return self.profiler is not None and n % self.profile_every == 0
+
+    def _profiled(self, tx: dict, user: dict, first_match: bool) -> tuple[list[bool], int]:
+        """
+        evaluate / first_match с замером каждого исполненного правила.
+        """
+        profiler = self.profiler
+        profiler.sampled += 1
+        memo: list = [None] * self.memo_size
+        out = [False] * len(self.programs)
+        candidates = self.eq_index.candidates(tx, user)
+        for i in sorted(candidates) if first_match else candidates:
+            error = False
+            t0 = time.perf_counter_ns()
+            try:
+                matched = bool(self.programs[i](memo, tx, user))
+            except Exception:
+                matched, error = False, True
+            profiler.record(i, time.perf_counter_ns() - t0, matched, error)
+            out[i] = matched
+            if matched and first_match:
+                return out, i + 1
+        return out, len(out)
+
+    def reorder(self) -> None:
+        for rule_junctions in self.junctions:
+            for j in rule_junctions:
+                j.reorder()
+
+    def ordering(self) -> list[dict]:
+        """
+        Текущий (обученный) порядок операндов AND/OR по каждому правилу.
+        """
+        return [
+            {
+                "ruleId": r["id"],
+                "ruleName": r["name"],
+                "junctions": [j.describe() for j in js],
+            }
+            for r, js in zip(self.rules, self.junctions)
+        ]
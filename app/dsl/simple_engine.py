@@ -1,5 +1,7 @@
 import re
 
+from app.dsl.types import parse_velocity_field
+
 OPS = {
     ">": lambda a, b: a > b,
     ">=": lambda a, b: a >= b,
@@ -11,6 +13,12 @@ OPS = {
 
 NUMBER_RE = re.compile(r"^\s*(\w+(?:\.\w+)*)\s*(>=|<=|!=|=|>|<)\s*(\d+(\.\d+)?)\s*$")
 STRING_RE = re.compile(r"^\s*(\w+(?:\.\w+)*)\s*(=|!=)\s*'([^']*)'\s*$")
+IN_RE = re.compile(
+    r"^\s*(\w+(?:\.\w+)*)\s+(?:NOT\s+)?IN\s*\(\s*"
+    r"(?:'[^']*'|\d+(?:\.\d+)?)(?:\s*,\s*(?:'[^']*'|\d+(?:\.\d+)?))*\s*\)\s*$",
+    # ключевые слова регистронезависимы, как в токенизаторе
+    re.IGNORECASE,
+)
 
 ALLOWED_FIELDS = {
     "amount",
@@ -26,6 +34,11 @@ ALLOWED_FIELDS = {
 }
 
 
+def is_allowed_field(name: str) -> bool:
+    # кроме фиксированных полей — velocity-признаки вида user.txCount1h / user.amountSum24h
+    return name in ALLOWED_FIELDS or parse_velocity_field(name) is not None
+
+
 def validate_expression(expr: str) -> dict:
     """
     Возвращает формат как в ТЗ:
@@ -68,7 +81,7 @@ def validate_expression(expr: str) -> dict:
         m = NUMBER_RE.match(p)
         if m:
             field, op, _, _ = m.groups()
-            if field not in ALLOWED_FIELDS:
+            if not is_allowed_field(field):
                 return {
                     "isValid": False,
                     "normalizedExpression": None,
@@ -88,7 +101,7 @@ def validate_expression(expr: str) -> dict:
         m = STRING_RE.match(p)
         if m:
             field, op, _ = m.groups()
-            if field not in ALLOWED_FIELDS:
+            if not is_allowed_field(field):
                 return {
                     "isValid": False,
                     "normalizedExpression": None,
@@ -102,6 +115,18 @@ def validate_expression(expr: str) -> dict:
                 }
             continue
 
+        # IN / NOT IN (...)
+        m = IN_RE.match(p)
+        if m:
+            field = m.group(1)
+            if not is_allowed_field(field):
+                return {
+                    "isValid": False,
+                    "normalizedExpression": None,
+                    "errors": [{"code": "DSL_INVALID_FIELD", "message": f"Unknown field: {field}", "position": 0, "near": field}],
+                }
+            continue
+
         # иначе — синтаксис не распознан
         return {
             "isValid": False,
@@ -1,4 +1,5 @@
 from __future__ import annotations
+import re
 from dataclasses import dataclass
 
 
@@ -9,7 +10,7 @@ class Token:
     pos: int  # 0-based char position
 
 
-KEYWORDS = {"AND", "OR", "NOT"}
+KEYWORDS = {"AND", "OR", "NOT", "IN"}
 
 
 def tokenize(src: str) -> list[Token]:
@@ -37,6 +38,10 @@ def tokenize(src: str) -> list[Token]:
             add("RPAREN", ")", i)
             i += 1
             continue
+        if c == ",":
+            add("COMMA", ",", i)
+            i += 1
+            continue
 
         # operators (2-char first)
         if src.startswith(">=", i) or src.startswith("<=", i) or src.startswith("!=", i):
@@ -99,3 +104,60 @@ def tokenize(src: str) -> list[Token]:
 
     add("EOF", "", n)
     return tokens
+
+
+# Однопроходный сканер: одна скомпилированная альтернатива с именованными
+# группами, порядок веток повторяет порядок проверок в tokenize().
+# Пробелы поглощаются префиксом \s* каждого совпадения (хвостовые пробелы
+# finditer просто пропускает), поэтому итераций ровно столько, сколько токенов.
+_MASTER_RE = re.compile(
+    r"""
+    \s*
+    (?:
+    (?P<LPAREN>\()
+  | (?P<RPAREN>\))
+  | (?P<COMMA>,)
+  | (?P<OP>>=|<=|!=|[<>=])
+  | (?P<STRING>'(?:[^'\\]|\\[\s\S])*')
+  | (?P<UNTERM_STRING>'[\s\S]*)
+  | (?P<NUMBER>[0-9][0-9.]*)
+  | (?P<IDENT>[A-Za-z_][A-Za-z0-9._]*)
+  | (?P<UNKNOWN>\S)
+    )
+    """,
+    re.VERBOSE,
+)
+
+_ESCAPE_RE = re.compile(r"\\([\\'])")
+
+
+def tokenize_fast(src: str) -> list[Token]:
+    """
+    То же, что tokenize(), но на одном regex вместо посимвольного цикла.
+    Классы символов в regex ASCII-шные; для не-ASCII исходника
+    (isalpha/isdigit шире [A-Za-z0-9]) откатываемся на tokenize().
+    """
+    if not src.isascii():
+        return tokenize(src)
+
+    tokens: list[Token] = []
+    append = tokens.append
+    for m in _MASTER_RE.finditer(src):
+        kind = m.lastgroup
+        text = m.group(kind)
+        pos = m.start(kind)
+        if kind == "STRING":
+            body = text[1:-1]
+            if "\\" in body:
+                body = _ESCAPE_RE.sub(r"\1", body)
+            append(Token("STRING", body, pos))
+        elif kind == "IDENT":
+            up = text.upper()
+            if up in KEYWORDS:
+                append(Token(up, up, pos))
+            else:
+                append(Token("IDENT", text, pos))
+        else:
+            append(Token(kind, text, pos))
+    append(Token("EOF", "", len(src)))
+    return tokens
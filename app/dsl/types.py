@@ -1,4 +1,5 @@
 from __future__ import annotations
+import re
 from dataclasses import dataclass
 from enum import Enum
 
@@ -15,3 +16,24 @@ class FieldDef:
     name: str
     type: ValueType
     nullable: bool = False
+
+
+# скользящие окна по пользователю: user.txCount1h, user.amountSum24h, user.txCount15m, user.amountSum7d
+VELOCITY_FIELD_RE = re.compile(r"^user\.(txCount|amountSum)([1-9]\d{0,3})([mhd])$")
+VELOCITY_UNITS = {"m": 60, "h": 3600, "d": 86400}
+
+
+@dataclass(frozen=True)
+class VelocityFeature:
+    # ключ в user-контексте (без префикса user.), например txCount1h
+    key: str
+    kind: str  # txCount | amountSum
+    span: int  # длина окна, секунды
+
+
+def parse_velocity_field(name: str) -> VelocityFeature | None:
+    m = VELOCITY_FIELD_RE.match(name)
+    if not m:
+        return None
+    kind, n, unit = m.groups()
+    return VelocityFeature(key=name.split(".", 1)[1], kind=kind, span=int(n) * VELOCITY_UNITS[unit])
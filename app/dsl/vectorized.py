@@ -0,0 +1,176 @@
+"""
+Колоночное (векторное) исполнение набора правил для батча транзакций.
+
+Батч раскладывается в NumPy-колонки (amount, currency, user.age, ...),
+каждое уникальное сравнение CompiledRuleset считается одной операцией над
+массивом, And/Or/Not — поэлементными &, |, ~. Результат — матрица bool
+формы (правила × транзакции) с той же семантикой, что CompiledRuleset.evaluate.
+"""
+
+from __future__ import annotations
+
+import numpy as np
+
+from app.dsl.ast import Field, Number, Compare, InList, Not, And, Or, Node
+from app.dsl.compiler import STRING_OPS, field_getter, in_sets
+from app.dsl.ruleset import CompiledRuleset
+
+# ниже этого размера дешевле скалярный путь (нет накладных расходов на колонки)
+VECTORIZE_MIN_BATCH = 16
+
+NP_OPS = {
+    ">": np.greater,
+    ">=": np.greater_equal,
+    "<": np.less,
+    "<=": np.less_equal,
+    "=": np.equal,
+    "!=": np.not_equal,
+}
+
+
+def _to_float(v):
+    try:
+        return float(v)
+    except Exception:
+        return None
+
+
+class Columns:
+    """
+    Ленивые колонки батча: поле извлекается из dict-ов один раз на батч.
+    """
+
+    def __init__(self, txs: list[dict], users: list[dict]):
+        self.txs = txs
+        self.users = users
+        self.n = len(txs)
+        self._raw: dict[str, list] = {}
+        self._num: dict[str, tuple[np.ndarray, np.ndarray]] = {}
+        self._str: dict[str, tuple[np.ndarray, np.ndarray]] = {}
+
+    def raw(self, name: str) -> list:
+        col = self._raw.get(name)
+        if col is None:
+            get = field_getter(name)
+            col = self._raw[name] = [get(tx, u) for tx, u in zip(self.txs, self.users)]
+        return col
+
+    def numeric(self, name: str) -> tuple[np.ndarray, np.ndarray]:
+        """
+        (значения float64, маска "значение есть и приводится к float").
+        """
+        hit = self._num.get(name)
+        if hit is None:
+            conv = [None if v is None else _to_float(v) for v in self.raw(name)]
+            ok = np.fromiter((v is not None for v in conv), dtype=bool, count=self.n)
+            vals = np.fromiter((0.0 if v is None else v for v in conv), dtype=np.float64, count=self.n)
+            hit = self._num[name] = (vals, ok)
+        return hit
+
+    def string(self, name: str) -> tuple[np.ndarray, np.ndarray]:
+        """
+        (значения str как object-массив, маска "значение не None").
+        """
+        hit = self._str.get(name)
+        if hit is None:
+            raw = self.raw(name)
+            ok = np.fromiter((v is not None for v in raw), dtype=bool, count=self.n)
+            vals = np.empty(self.n, dtype=object)
+            vals[:] = ["" if v is None else str(v) for v in raw]
+            hit = self._str[name] = (vals, ok)
+        return hit
+
+
+def _in_list(program: CompiledRuleset, slot: int, cols: Columns) -> np.ndarray:
+    """
+    IN / NOT IN по колонке: строки — проверка по frozenset, числа — np.isin.
+    """
+    node: InList = program.compares[slot]
+    if not isinstance(node.left, Field):
+        return np.full(cols.n, bool(program.predicates[slot]({}, {})))
+
+    strings, numbers = in_sets(node)
+    svals, present = cols.string(node.left.name)
+
+    s_hit = np.zeros(cols.n, dtype=bool)
+    if strings:
+        s_hit = present & np.fromiter((v in strings for v in svals), dtype=bool, count=cols.n)
+
+    if numbers:
+        nvals, n_ok = cols.numeric(node.left.name)
+        n_hit = n_ok & np.isin(nvals, np.fromiter(numbers, dtype=np.float64))
+    else:
+        n_ok = n_hit = np.zeros(cols.n, dtype=bool)
+
+    if not node.negated:
+        return present & (s_hit | n_hit)
+    # NOT IN: ни одного совпадения, а для числовых литералов значение должно быть числом
+    out = present & ~s_hit
+    if numbers:
+        out &= n_ok & ~n_hit
+    return out
+
+
+def _compare(program: CompiledRuleset, slot: int, cols: Columns) -> np.ndarray:
+    node: Compare | InList = program.compares[slot]
+    if isinstance(node, InList):
+        return _in_list(program, slot, cols)
+    left, right, op = node.left, node.right, node.op
+
+    # константа или поле с полем: результат не зависит от транзакции
+    if not isinstance(left, Field) or isinstance(right, Field):
+        value = program.predicates[slot]({}, {})
+        return np.full(cols.n, bool(value))
+
+    if isinstance(right, Number):
+        vals, ok = cols.numeric(left.name)
+        return ok & NP_OPS[op](vals, float(right.value))
+
+    if op not in STRING_OPS:
+        return np.zeros(cols.n, dtype=bool)
+
+    vals, ok = cols.string(left.name)
+    return ok & NP_OPS[op](vals, right.value).astype(bool)
+
+
+def evaluate_matrix(program: CompiledRuleset, txs: list[dict], users: list[dict]) -> np.ndarray:
+    """
+    Матрица matched формы (len(program.rules), len(txs)).
+    """
+    cols = Columns(txs, users)
+    memo: list[np.ndarray | None] = [None] * len(program.compares)
+
+    def walk(node: Node) -> np.ndarray:
+        if isinstance(node, (Compare, InList)):
+            slot = program.slot_of(node)
+            v = memo[slot]
+            if v is None:
+                v = memo[slot] = _compare(program, slot, cols)
+            return v
+        if isinstance(node, Not):
+            return ~walk(node.expr)
+        if isinstance(node, And):
+            return walk(node.left) & walk(node.right)
+        if isinstance(node, Or):
+            return walk(node.left) | walk(node.right)
+        raise ValueError(f"Unsupported node: {type(node).__name__}")
+
+    out = np.zeros((len(program.rules), cols.n), dtype=bool)
+    for i, ast in enumerate(program.asts):
+        if ast is None:
+            continue
+        try:
+            out[i] = walk(ast)
+        except Exception:
+            out[i] = False
+    return out
+
+
+def evaluate_batch(program: CompiledRuleset, txs: list[dict], users: list[dict]) -> list[list[bool]]:
+    """
+    matched по правилам для каждой транзакции (как program.evaluate на каждой).
+    Маленькие батчи считаются скалярно.
+    """
+    if len(txs) < VECTORIZE_MIN_BATCH:
+        return [program.evaluate(tx, u) for tx, u in zip(txs, users)]
+    return evaluate_matrix(program, txs, users).T.tolist()
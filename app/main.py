@@ -1,25 +1,45 @@
 """
 Точка входа приложения.
-Создает таблицы и начального администратора.
+Создает начального администратора (схема БД — миграции Alembic: alembic upgrade head).
 """
 
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 from sqlalchemy.orm import Session
 
-from app.core.database import Base, engine, SessionLocal
+from app.core.database import SessionLocal, AsyncSessionLocal
 from app.core.errors import register_error_handlers
 from app.core.config import ADMIN_EMAIL, ADMIN_FULLNAME, ADMIN_PASSWORD
 from app.core.security import hash_password
 
 from app.models.user import User
 from app.api import ping, auth, users, fraud_rules, transactions, ui
+from app.services import partitions, totals
+from app.services.transactions import shutdown_audit
+from app.services.rules_snapshot import start_listener, stop_listener
+from app.services.result_spool import start_flusher, stop_flusher
 
-app = FastAPI(title="AntiFraud")
 
-register_error_handlers(app)
+@asynccontextmanager
+async def lifespan(_: FastAPI):
+    async with AsyncSessionLocal() as db:
+        await totals.backfill(db)
+    # партиции текущего и следующих месяцев — до приёма транзакций
+    await partitions.start_maintenance()
+    await start_listener()
+    await start_flusher()
+    yield
+    await stop_listener()
+    shutdown_audit()
+    # после аудита: он тоже пишет в журнал результатов
+    await stop_flusher()
+    await partitions.stop_maintenance()
+
 
-# создаём таблицы
-Base.metadata.create_all(bind=engine)
+app = FastAPI(title="AntiFraud", lifespan=lifespan)
+
+register_error_handlers(app)
 
 def ensure_admin():
     db: Session = SessionLocal()
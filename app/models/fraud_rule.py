@@ -5,12 +5,16 @@ DSL НЕ парсится (Tier 0), хранится как строка.
 
 import uuid
 from datetime import datetime, timezone
-from sqlalchemy import Column, String, Boolean, Integer, DateTime
+from sqlalchemy import Column, String, Boolean, Integer, DateTime, Index, text
 from app.core.database import Base
 
 
 class FraudRule(Base):
     __tablename__ = "fraud_rules"
+    __table_args__ = (
+        # загрузка набора активных правил (WHERE enabled ORDER BY priority, id)
+        Index("ix_fraud_rules_enabled_priority_id", "priority", "id", postgresql_where=text("enabled")),
+    )
 
     id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
     name = Column(String(120), unique=True, nullable=False)
@@ -0,0 +1,23 @@
+"""
+Ключ идемпотентности отправки транзакции (заголовок Idempotency-Key
+или idempotencyKey элемента батча).
+Уникальность (user_id, key) гарантирует, что повтор запроса не создаст
+вторую транзакцию, даже если Redis недоступен или потерял ключ.
+"""
+
+from datetime import datetime
+from sqlalchemy import Column, String, DateTime
+from app.core.database import Base
+
+class IdempotencyKey(Base):
+    __tablename__ = "idempotency_keys"
+
+    # пользователь, отправивший запрос (для ADMIN — сам ADMIN, а не userId транзакции)
+    user_id = Column(String, primary_key=True)
+    key = Column(String(255), primary_key=True)
+
+    # sha256 тела запроса: тот же ключ с другим телом — ошибка клиента
+    request_hash = Column(String(64), nullable=False)
+    transaction_id = Column(String, nullable=False)
+
+    created_at = Column(DateTime, default=datetime.utcnow)
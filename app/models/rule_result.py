@@ -1,17 +1,24 @@
 """
 Результат применения одного правила к одной транзакции.
 Обязательно сохраняется для воспроизводимости.
+Партиционируется по месяцу вместе с transactions: tx_timestamp — timestamp транзакции.
 """
 
 import uuid
-from sqlalchemy import Column, String, Boolean, Integer
+from sqlalchemy import Column, String, Boolean, Integer, DateTime, Index
 from app.core.database import Base
 
 class RuleResult(Base):
     __tablename__ = "rule_results"
+    __table_args__ = (
+        # ruleResults транзакции в порядке (priority, rule_id)
+        Index("ix_rule_results_tx_priority_rule", "transaction_id", "priority", "rule_id"),
+        {"postgresql_partition_by": "RANGE (tx_timestamp)"},
+    )
 
     id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
     transaction_id = Column(String, nullable=False)
+    tx_timestamp = Column(DateTime, primary_key=True)
 
     rule_id = Column(String, nullable=False)
     rule_name = Column(String, nullable=False)
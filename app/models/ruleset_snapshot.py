@@ -0,0 +1,18 @@
+"""
+Неизменяемый снимок набора активных правил.
+На него ссылаются транзакции, результаты которых хранятся битовой картой
+(RULE_RESULTS_STORAGE=BITMAP): бит i — matched правила i снимка.
+"""
+
+from datetime import datetime
+from sqlalchemy import Column, String, DateTime, JSON
+from app.core.database import Base
+
+class RulesetSnapshot(Base):
+    __tablename__ = "ruleset_snapshots"
+
+    # sha256 содержимого набора (id, name, priority, enabled, dsl по порядку)
+    version = Column(String(64), primary_key=True)
+    rules = Column(JSON, nullable=False)
+
+    created_at = Column(DateTime, default=datetime.utcnow)
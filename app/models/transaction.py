@@ -1,17 +1,29 @@
 import uuid
 from datetime import datetime
-from sqlalchemy import Column, String, Boolean, DateTime, Numeric, JSON
+from sqlalchemy import Column, String, Boolean, DateTime, Numeric, JSON, Integer, LargeBinary, Index
 from app.core.database import Base
 
 class Transaction(Base):
     __tablename__ = "transactions"
+    # индексы создаются миграциями (migrations/versions/0002_hot_path_indexes.py), здесь — для autogenerate
+    __table_args__ = (
+        # листинг (timestamp desc, id desc) и продолжение по курсору (timestamp, id) < (...):
+        # пользователя (и velocity-окно — только по индексу) — по первому, всех (ADMIN) — по второму,
+        # ADMIN с фильтром status / isFraud — по третьему / четвёртому
+        Index("ix_transactions_user_ts_id_amount", "user_id", "timestamp", "id", postgresql_include=["amount"]),
+        Index("ix_transactions_ts_id", "timestamp", "id"),
+        Index("ix_transactions_status_ts_id", "status", "timestamp", "id"),
+        Index("ix_transactions_fraud_ts_id", "is_fraud", "timestamp", "id"),
+        # помесячные партиции (app/services/partitions.py); ключ партиционирования входит в PK
+        {"postgresql_partition_by": "RANGE (timestamp)"},
+    )
 
     id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
     user_id = Column(String, nullable=False)
 
     amount = Column(Numeric(12, 2), nullable=False)
     currency = Column(String(3), nullable=False)
-    timestamp = Column(DateTime, nullable=False)
+    timestamp = Column(DateTime, primary_key=True)
 
     status = Column(String, nullable=False)   # APPROVED/DECLINED
     is_fraud = Column(Boolean, default=False)
@@ -26,3 +38,9 @@ class Transaction(Base):
     extra = Column("metadata", JSON, nullable=True)
 
     created_at = Column(DateTime, default=datetime.utcnow)
+
+    # RULE_RESULTS_STORAGE=BITMAP: снимок набора правил и matched битами
+    # (бит i — правило i снимка; посчитаны первые rules_evaluated правил)
+    ruleset_version = Column(String(64), nullable=True)
+    rule_bitmap = Column(LargeBinary, nullable=True)
+    rules_evaluated = Column(Integer, nullable=True)
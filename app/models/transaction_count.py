@@ -0,0 +1,17 @@
+"""
+Число транзакций по (пользователь, статус, isFraud).
+Ведётся инкрементально в той же транзакции БД, что и INSERT транзакций,
+поэтому точное: total листинга — сумма нескольких строк вместо COUNT(*).
+"""
+
+from sqlalchemy import Column, String, Boolean, BigInteger
+from app.core.database import Base
+
+class TransactionCount(Base):
+    __tablename__ = "transaction_counts"
+
+    user_id = Column(String, primary_key=True)
+    status = Column(String, primary_key=True)
+    is_fraud = Column(Boolean, primary_key=True)
+
+    n = Column(BigInteger, nullable=False, default=0)
@@ -24,5 +24,6 @@ class User(Base):
     role = Column(String, nullable=False, default="USER")
     is_active = Column(Boolean, default=True)
 
-    created_at = Column(DateTime, default=datetime.utcnow)
+    # index: GET /users (ORDER BY created_at DESC)
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
     updated_at = Column(DateTime, default=datetime.utcnow)
@@ -44,3 +44,48 @@ class FraudRuleValidateResponse(BaseModel):
     isValid: bool
     normalizedExpression: str | None
     errors: list[DslError]
+    # результат оптимизатора: противоречия, лишние условия, правило никогда не сработает
+    warnings: list[DslError] = []
+
+
+class OperandStats(BaseModel):
+    expression: str
+    calls: int
+    hitRate: float | None
+    avgCostNs: float | None
+
+
+class JunctionOrdering(BaseModel):
+    op: str
+    operands: list[OperandStats]
+
+
+class RuleOrderingResponse(BaseModel):
+    ruleId: str
+    ruleName: str
+    junctions: list[JunctionOrdering]
+
+
+class HistogramBucket(BaseModel):
+    upperNs: int
+    count: int
+
+
+class RuleStats(BaseModel):
+    ruleId: str
+    ruleName: str
+    evaluations: int
+    matches: int
+    errors: int
+    hitRate: float | None
+    totalNs: int
+    avgNs: float | None
+    p50Ns: int | None
+    p99Ns: int | None
+    histogram: list[HistogramBucket]
+
+
+class RuleStatsResponse(BaseModel):
+    sampleEvery: int
+    sampledTransactions: int
+    rules: list[RuleStats]
@@ -3,6 +3,8 @@ from __future__ import annotations
 from datetime import datetime, timedelta, timezone
 from pydantic import BaseModel, Field, field_validator, model_validator
 
+from app.core.config import PARTITIONS_MAX_AGE_MONTHS
+
 
 class Location(BaseModel):
     country: str = Field(..., pattern=r"^[A-Z]{2}$")  # ISO 3166-1 alpha-2 (2 заглавные буквы)
@@ -45,11 +47,17 @@ class TransactionCreateRequest(BaseModel):
     location: Location | None = None
     metadata: dict | None = None
 
+    # ключ идемпотентности элемента батча / потока (у одиночной отправки — заголовок Idempotency-Key)
+    idempotencyKey: str | None = Field(None, min_length=1, max_length=255)
+
     @field_validator("timestamp")
     @classmethod
     def timestamp_not_too_future(cls, v: datetime):
         """
         ТЗ: timestamp не более 5 минут в будущем.
+        И не старше PARTITIONS_MAX_AGE_MONTHS месяцев: партиция месяца
+        транзакции создаётся при записи, прошлые месяцы — только в этих пределах
+        (будущие и так не дальше следующего, созданного заранее).
         """
         # приводим к aware UTC
         if v.tzinfo is None:
@@ -57,6 +65,9 @@ class TransactionCreateRequest(BaseModel):
         now = datetime.now(timezone.utc)
         if v > now + timedelta(minutes=5):
             raise ValueError("timestamp must not be more than 5 minutes in the future")
+        v_utc = v.astimezone(timezone.utc)
+        if (now.year - v_utc.year) * 12 + now.month - v_utc.month > PARTITIONS_MAX_AGE_MONTHS:
+            raise ValueError(f"timestamp must not be older than {PARTITIONS_MAX_AGE_MONTHS} months")
         return v
 
 
@@ -95,9 +106,15 @@ class TransactionDecisionResponse(BaseModel):
 
 class TransactionsListResponse(BaseModel):
     items: list[TransactionResponse]
-    total: int
-    page: int
+    # null, если не запрашивался (includeTotal=false / режим курсора)
+    total: int | None = None
+    # EXACT — точный; CACHED — точный на момент подсчёта, до TOTALS_CACHE_SECONDS назад;
+    # ESTIMATE — оценка планировщика
+    totalKind: str | None = None
+    # в режиме курсора page не используется
+    page: int | None = None
     size: int
+    nextCursor: str | None = None
 
 
 class BatchTransactionRequest(BaseModel):
@@ -112,3 +129,15 @@ class BatchItemResult(BaseModel):
 
 class BatchTransactionResponse(BaseModel):
     items: list[BatchItemResult]
+
+
+class ResultSpoolResponse(BaseModel):
+    # журнал отложенной записи rule_results (RULE_RESULTS_WRITE=SPOOL)
+    mode: str
+    pendingRows: int
+    pendingSegments: int
+    lagSeconds: float
+    flushedRows: int
+    flushErrors: int
+    corruptSegments: int
+    failedSegments: int
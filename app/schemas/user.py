@@ -38,5 +38,7 @@ class AdminUserUpdateRequest(UserUpdateRequest):
 class UsersListResponse(BaseModel):
     items: list[UserResponse]
     total: int
+    # CACHED — точное число до TOTALS_CACHE_SECONDS назад; ESTIMATE — оценка планировщика
+    totalKind: str
     page: int
     size: int
@@ -1,17 +1,20 @@
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
 
 from app.core.security import hash_password, verify_password, create_token
 from app.models.user import User
 
 
-def register(db: Session, data) -> User:
+async def register(db: AsyncSession, data) -> User:
     """
     Создаём нового USER.
     Проверка уникальности email делается в роутере (409).
+    bcrypt считается в пуле потоков, чтобы не блокировать event loop.
     """
     user = User(
         email=data.email,
-        password_hash=hash_password(data.password),
+        password_hash=await run_in_threadpool(hash_password, data.password),
         full_name=data.fullName,
         age=data.age,
         region=data.region,
@@ -21,16 +24,16 @@ def register(db: Session, data) -> User:
         is_active=True,
     )
     db.add(user)
-    db.commit()
-    db.refresh(user)
+    await db.commit()
+    await db.refresh(user)
     return user
 
 
-def authenticate(db: Session, email: str, password: str):
+async def authenticate(db: AsyncSession, email: str, password: str):
     """
     Возвращает (token, user) или None.
     """
-    user = db.query(User).filter(User.email == email).first()
+    user = await db.scalar(select(User).where(User.email == email))
     if not user:
         return None
 
@@ -38,7 +41,7 @@ def authenticate(db: Session, email: str, password: str):
         # по ТЗ 423 на login
         return ("DEACTIVATED", user)
 
-    if not verify_password(password, user.password_hash):
+    if not await run_in_threadpool(verify_password, password, user.password_hash):
         return None
 
     token = create_token(str(user.id), user.role)
@@ -1,22 +1,22 @@
-from sqlalchemy.orm import Session
-from sqlalchemy import asc
+from sqlalchemy import asc, select
+from sqlalchemy.ext.asyncio import AsyncSession
 from app.models.fraud_rule import FraudRule
-from app.core.redis import cache_invalidate_active_rules
+from app.services.rules_snapshot import active_program, bump_version
 
 
-def get_rule(db: Session, rid: str):
-    return db.query(FraudRule).filter(FraudRule.id == rid).first()
+async def get_rule(db: AsyncSession, rid: str):
+    return await db.scalar(select(FraudRule).where(FraudRule.id == rid))
 
 
-def get_by_name(db: Session, name: str):
-    return db.query(FraudRule).filter(FraudRule.name == name).first()
+async def get_by_name(db: AsyncSession, name: str):
+    return await db.scalar(select(FraudRule).where(FraudRule.name == name))
 
 
-def list_rules(db: Session):
-    return db.query(FraudRule).order_by(asc(FraudRule.priority), asc(FraudRule.id)).all()
+async def list_rules(db: AsyncSession):
+    return (await db.scalars(select(FraudRule).order_by(asc(FraudRule.priority), asc(FraudRule.id)))).all()
 
 
-def create_rule(db: Session, data):
+async def create_rule(db: AsyncSession, data):
     rule = FraudRule(
         name=data.name,
         description=data.description,
@@ -25,28 +25,48 @@ def create_rule(db: Session, data):
         priority=data.priority,
     )
     db.add(rule)
-    db.commit()
-    db.refresh(rule)
-    cache_invalidate_active_rules()
+    await db.commit()
+    await db.refresh(rule)
+    await bump_version()
     return rule
 
 
-def update_rule(db: Session, rule: FraudRule, data):
+async def update_rule(db: AsyncSession, rule: FraudRule, data):
     rule.name = data.name
     rule.description = data.description
     rule.dsl_expression = data.dslExpression
     rule.enabled = data.enabled
     rule.priority = data.priority
     db.add(rule)
-    db.commit()
-    db.refresh(rule)
-    cache_invalidate_active_rules()
+    await db.commit()
+    await db.refresh(rule)
+    await bump_version()
     return rule
 
 
-def disable_rule(db: Session, rule: FraudRule):
+async def disable_rule(db: AsyncSession, rule: FraudRule):
     if rule.enabled:
         rule.enabled = False
         db.add(rule)
-        db.commit()
-        cache_invalidate_active_rules()
+        await db.commit()
+        await bump_version()
+
+
+async def rules_ordering(db: AsyncSession) -> list[dict]:
+    """
+    Обученный порядок операндов AND/OR в скомпилированном наборе активных правил.
+    """
+    return (await active_program(db)).ordering()
+
+
+async def rules_stats(db: AsyncSession) -> dict:
+    """
+    Профиль правил текущего набора (сэмплированный, с момента его компиляции).
+    """
+    program = await active_program(db)
+    profiler = program.profiler
+    return {
+        "sampleEvery": program.profile_every,
+        "sampledTransactions": profiler.sampled if profiler else 0,
+        "rules": profiler.describe(program.rules) if profiler else [],
+    }
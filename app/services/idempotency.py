@@ -0,0 +1,119 @@
+"""
+Идемпотентность отправки транзакций (Idempotency-Key).
+
+Быстрый путь — один GET/MGET в Redis: там по ключу лежит готовый ответ
+(TransactionDecisionResponse) и хэш тела запроса. Пока запрос с ключом
+выполняется, ключ занят меткой PENDING (SET NX PX), параллельный повтор
+получает 409.
+
+Гарантию «не больше одной транзакции на ключ» даёт строка
+idempotency_keys (PK user_id, key), которая пишется в той же транзакции БД,
+что и сама транзакция. Если Redis ключ потерял (вытеснение, рестарт) или
+недоступен, ответ восстанавливается по transaction_id из этой таблицы.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+
+from redis.exceptions import RedisError
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import IDEMPOTENCY_LOCK_MS, IDEMPOTENCY_TTL_SECONDS
+from app.core.redis import (
+    idempotency_delete_many,
+    idempotency_get_many,
+    idempotency_reserve,
+    idempotency_set_many,
+)
+from app.models.idempotency_key import IdempotencyKey
+
+logger = logging.getLogger(__name__)
+
+PENDING = "PENDING"
+
+
+def fingerprint(data) -> str:
+    """
+    Хэш тела запроса (без самого ключа) — чтобы отличить повтор от
+    другого запроса с тем же ключом.
+    """
+    raw = data.model_dump_json(exclude={"idempotencyKey"})
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+def row(user_id: str, key: str, request_hash: str) -> dict:
+    # transaction_id дописывает сервис транзакций
+    return {"user_id": user_id, "key": key, "request_hash": request_hash}
+
+
+def _redis_key(user_id: str, key: str) -> str:
+    return f"{user_id}:{key}"
+
+
+async def stored(db: AsyncSession, user_id: str, keys: list[str]) -> dict[str, dict | str]:
+    """
+    Что уже известно по ключам: PENDING, {"h": хэш, "r": ответ} из Redis
+    или {"h": хэш, "tx": id транзакции} из БД (ответ нужно собрать заново).
+    Ключей, которых нет нигде, в результате нет.
+    """
+    out: dict[str, dict | str] = {}
+    try:
+        values = await idempotency_get_many([_redis_key(user_id, k) for k in keys])
+    except RedisError:
+        logger.warning("redis unavailable, idempotency keys checked in the database only")
+        values = [None] * len(keys)
+    for key, value in zip(keys, values):
+        if value is not None:
+            out[key] = value if value == PENDING else json.loads(value)
+
+    missing = [k for k in keys if k not in out]
+    if missing:
+        rows = await db.scalars(
+            select(IdempotencyKey).where(IdempotencyKey.user_id == user_id, IdempotencyKey.key.in_(missing))
+        )
+        for r in rows:
+            out[r.key] = {"h": r.request_hash, "tx": r.transaction_id}
+    return out
+
+
+async def reserve(user_id: str, keys: list[str]) -> set[str]:
+    """
+    Занимает ключи на время выполнения запроса; возвращает занятые.
+    Без Redis считаются занятыми все — от дубля защитит PK в БД.
+    """
+    acquired = set()
+    for key in keys:
+        try:
+            if await idempotency_reserve(_redis_key(user_id, key), PENDING, IDEMPOTENCY_LOCK_MS):
+                acquired.add(key)
+        except RedisError:
+            acquired.add(key)
+    return acquired
+
+
+async def remember(user_id: str, responses: dict[str, tuple[str, dict]]) -> None:
+    """
+    responses — ключ -> (хэш тела, ответ); ответ отдаётся повторам из Redis.
+    """
+    try:
+        await idempotency_set_many(
+            {
+                _redis_key(user_id, key): json.dumps({"h": h, "r": response}, separators=(",", ":"))
+                for key, (h, response) in responses.items()
+            },
+            IDEMPOTENCY_TTL_SECONDS,
+        )
+    except RedisError:
+        logger.warning("redis unavailable, idempotent responses not cached")
+
+
+async def release(user_id: str, keys: list[str]) -> None:
+    # запрос не выполнен — ключ снова свободен для повтора
+    try:
+        await idempotency_delete_many([_redis_key(user_id, k) for k in keys])
+    except RedisError:
+        pass
@@ -0,0 +1,290 @@
+"""
+Помесячные партиции transactions и rule_results (PARTITION BY RANGE).
+
+transactions секционирована по timestamp, rule_results — по tx_timestamp
+(копия timestamp транзакции) с теми же границами месяцев: результаты
+транзакции лежат в партиции того же месяца, и ruleResults читаются по
+(transaction_id, tx_timestamp) из одной партиции.
+
+Партиции DEFAULT нет: с ней невозможен DETACH ... CONCURRENTLY, и планировщик
+не обходит партиции по порядку для ORDER BY timestamp LIMIT. Поэтому
+партиция месяца должна существовать до INSERT:
+- фоновая задача раз в PARTITIONS_CHECK_SECONDS создаёт партиции текущего
+  месяца и PARTITIONS_AHEAD_MONTHS следующих;
+- для транзакций задним числом ensure() перед записью создаёт недостающие
+  партиции отдельной транзакцией БД.
+Партиция создаётся отдельной таблицей и подключается ATTACH PARTITION:
+родитель блокируется в режиме SHARE UPDATE EXCLUSIVE, который не мешает
+чтению и записи (CREATE TABLE ... PARTITION OF взял бы ACCESS EXCLUSIVE).
+
+Архивация месяца: python -m app.services.partitions detach 2024-01 —
+DETACH PARTITION ... CONCURRENTLY (без долгих блокировок), затем месяц
+вычитается из transaction_counts, его ключи идемпотентности удаляются,
+а таблицы переименовываются в *_archived_<время> (выгрузить pg_dump -t и удалить).
+Другие процессы узнают об отключении по ошибке записи в месяц (forget_detached):
+месяц забывается, и повторная запись создаёт его партицию заново.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import logging
+import re
+from datetime import date, datetime
+
+from sqlalchemy import bindparam, text, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import PARTITIONS_AHEAD_MONTHS, PARTITIONS_CHECK_SECONDS
+from app.core.database import AsyncSessionLocal, async_engine
+from app.models.transaction_count import TransactionCount
+
+logger = logging.getLogger(__name__)
+
+# родитель первым: по его партициям определяется, какие месяцы подключены
+_TABLES = ("transactions", "rule_results")
+# pg_advisory_xact_lock: создание и архивация партиций между процессами по одному
+_LOCK_KEY = 2501
+# ожидание блокировки родителя при ATTACH: параллельный DETACH CONCURRENTLY
+# ждёт открытые транзакции, в том числе ту, что ждёт новую партицию
+_LOCK_TIMEOUT = "5s"
+_NAME = re.compile(r"^transactions_p(\d{4})_(\d{2})$")
+
+# месяцы, партиции которых точно подключены (в этом процессе)
+_known: set[date] = set()
+_maintainer: asyncio.Task | None = None
+
+
+def month_start(ts: datetime | date) -> date:
+    return date(ts.year, ts.month, 1)
+
+
+def add_months(month: date, n: int) -> date:
+    i = month.year * 12 + month.month - 1 + n
+    return date(i // 12, i % 12 + 1, 1)
+
+
+def partition_name(table: str, month: date) -> str:
+    return f"{table}_p{month:%Y_%m}"
+
+
+async def attached_months(db: AsyncSession) -> set[date]:
+    names = await db.scalars(
+        text(
+            "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+            "WHERE i.inhparent = 'transactions'::regclass AND NOT i.inhdetachpending"
+        )
+    )
+    return {date(int(m[1]), int(m[2]), 1) for m in map(_NAME.match, names) if m}
+
+
+async def _create(months: set[date]) -> None:
+    """
+    Создаёт и подключает недостающие партиции месяцев (обеих таблиц) одной
+    транзакцией БД; уже существующие пропускаются.
+    """
+    async with AsyncSessionLocal() as db:
+        await db.execute(text(f"SET LOCAL lock_timeout = '{_LOCK_TIMEOUT}'"))
+        await db.execute(text("SELECT pg_advisory_xact_lock(:k)"), {"k": _LOCK_KEY})
+        for month in sorted(months):
+            start, end = month, add_months(month, 1)
+            for table in _TABLES:
+                name = partition_name(table, month)
+                if await db.scalar(text("SELECT to_regclass(:n)"), {"n": name}) is not None:
+                    if not await db.scalar(
+                        text("SELECT count(*) FROM pg_inherits WHERE inhrelid = to_regclass(:n)"), {"n": name}
+                    ):
+                        # отключена, но архивация не завершена
+                        raise RuntimeError(f"partition {name} is detached, finish: detach {month:%Y-%m}")
+                    continue
+                await db.execute(text(f"CREATE TABLE {name} (LIKE {table} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"))
+                # индексы и PK родителя создаются на партиции при подключении (она пустая)
+                await db.execute(
+                    text(f"ALTER TABLE {table} ATTACH PARTITION {name} FOR VALUES FROM ('{start}') TO ('{end}')")
+                )
+                logger.info("created partition %s", name)
+        await db.commit()
+    _known.update(months)
+
+
+async def ensure(db: AsyncSession, timestamps) -> None:
+    """
+    Партиции месяцев этих транзакций; вызывается перед их INSERT/COPY.
+    Обычно все месяцы уже известны — проверка по множеству в памяти.
+    """
+    missing = {month_start(ts) for ts in timestamps} - _known
+    if missing and db.get_bind().dialect.name == "postgresql":
+        await _create(missing)
+
+
+def forget_detached(exc: BaseException, timestamps) -> bool:
+    """
+    True, если INSERT/COPY упал из-за отсутствия партиции месяца — её отключил
+    detach в другом процессе, а этот ещё считал её подключённой. Месяцы
+    транзакций забываются: повторная запись после ensure() создаст партиции.
+    """
+    if "no partition of relation" not in str(exc):
+        return False
+    _known.difference_update(month_start(ts) for ts in timestamps)
+    return True
+
+
+async def maintain() -> None:
+    """
+    Перечитывает подключённые партиции и создаёт партиции текущего месяца
+    и PARTITIONS_AHEAD_MONTHS следующих.
+    """
+    global _known
+    async with AsyncSessionLocal() as db:
+        if db.get_bind().dialect.name != "postgresql":
+            return
+        _known = await attached_months(db)
+    current = month_start(datetime.utcnow())
+    ahead = {add_months(current, i) for i in range(PARTITIONS_AHEAD_MONTHS + 1)}
+    if ahead - _known:
+        await _create(ahead - _known)
+
+
+async def _maintain_loop() -> None:
+    while True:
+        await asyncio.sleep(PARTITIONS_CHECK_SECONDS)
+        try:
+            await maintain()
+        except Exception:
+            # повтор на следующем шаге; до конца запаса месяцев ещё далеко
+            logger.exception("partition maintenance failed")
+
+
+async def start_maintenance() -> None:
+    """
+    Партиции вперёд — при старте приложения (до приёма транзакций) и затем в фоне.
+    """
+    global _maintainer
+    if _maintainer is None:
+        await maintain()
+        _maintainer = asyncio.create_task(_maintain_loop())
+
+
+async def stop_maintenance() -> None:
+    global _maintainer
+    if _maintainer is None:
+        return
+    _maintainer.cancel()
+    try:
+        await _maintainer
+    except asyncio.CancelledError:
+        pass
+    _maintainer = None
+
+
+async def _archive(db: AsyncSession, month: date) -> bool:
+    """
+    Учёт отключённого месяца: вычитание из счётчиков total, удаление ключей
+    идемпотентности его транзакций и переименование таблиц в *_archived_<время> —
+    одной транзакцией БД, поэтому повторный запуск после сбоя не вычтет дважды.
+    """
+    await db.execute(text("SELECT pg_advisory_xact_lock(:k)"), {"k": _LOCK_KEY})
+    name = partition_name("transactions", month)
+    if await db.scalar(text("SELECT to_regclass(:n)"), {"n": name}) is None:
+        return False
+    attached = await db.scalar(
+        text("SELECT count(*) FROM pg_inherits WHERE inhrelid IN (to_regclass(:t), to_regclass(:r))"),
+        {"t": name, "r": partition_name("rule_results", month)},
+    )
+    if attached:
+        raise RuntimeError(f"partitions of {month:%Y-%m} are still attached")
+    counts = (
+        await db.execute(
+            text(
+                f"SELECT user_id, status, coalesce(is_fraud, false), count(*) FROM {name} "
+                "GROUP BY 1, 2, 3 ORDER BY 1, 2, 3"
+            )
+        )
+    ).all()
+    if counts:
+        # по порядку ключа, как totals.increment: без взаимоблокировок со вставками
+        counters = TransactionCount.__table__
+        await db.execute(
+            update(counters)
+            .where(
+                counters.c.user_id == bindparam("u_"),
+                counters.c.status == bindparam("s_"),
+                counters.c.is_fraud == bindparam("f_"),
+            )
+            .values(n=counters.c.n - bindparam("n_")),
+            [{"u_": u, "s_": s, "f_": f, "n_": n} for u, s, f, n in counts],
+        )
+    await db.execute(text(f"DELETE FROM idempotency_keys k USING {name} t WHERE k.transaction_id = t.id"))
+    # месяц мог архивироваться и раньше (партицию пересоздала транзакция задним числом)
+    suffix = datetime.utcnow().strftime("%Y%m%d%H%M%S")
+    for table in _TABLES:
+        part = partition_name(table, month)
+        await db.execute(text(f"ALTER TABLE IF EXISTS {part} RENAME TO {part}_archived_{suffix}"))
+    await db.commit()
+    return True
+
+
+async def detach(month: date) -> None:
+    """
+    Отключение партиций месяца для архивации. DETACH ... CONCURRENTLY
+    выполняется вне транзакции и не блокирует чтение и запись в родителя;
+    прерванное отключение (inhdetachpending) доводится FINALIZE.
+    """
+    _known.discard(month)
+    async with async_engine.connect() as conn:
+        conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+        for table in _TABLES:
+            name = partition_name(table, month)
+            pending = await conn.scalar(
+                text("SELECT inhdetachpending FROM pg_inherits WHERE inhrelid = to_regclass(:n)"), {"n": name}
+            )
+            if pending is None:
+                continue
+            mode = "FINALIZE" if pending else "CONCURRENTLY"
+            await conn.execute(text(f"ALTER TABLE {table} DETACH PARTITION {name} {mode}"))
+            logger.info("detached partition %s", name)
+    async with AsyncSessionLocal() as db:
+        if await _archive(db, month):
+            logger.info("archived %s", month.strftime("%Y-%m"))
+
+
+async def partitions() -> list[dict]:
+    async with AsyncSessionLocal() as db:
+        rows = await db.execute(
+            text(
+                "SELECT p.relname AS parent, c.relname AS name, c.reltuples::bigint AS rows, "
+                "i.inhdetachpending AS detaching "
+                "FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid JOIN pg_class p ON p.oid = i.inhparent "
+                "WHERE p.relname IN ('transactions', 'rule_results') ORDER BY 1 DESC, 2"
+            )
+        )
+        return [dict(r._mapping) for r in rows]
+
+
+async def _run(args) -> None:
+    try:
+        if args.command == "list":
+            for p in await partitions():
+                print(f"{p['name']:32} rows~{max(p['rows'], 0):<12} {'DETACHING' if p['detaching'] else ''}")
+        elif args.command == "maintain":
+            await maintain()
+        else:
+            await detach(month_start(datetime.strptime(args.month, "%Y-%m")))
+    finally:
+        await async_engine.dispose()
+
+
+def main() -> None:
+    logging.basicConfig(level=logging.INFO)
+    ap = argparse.ArgumentParser(description="Помесячные партиции transactions / rule_results")
+    sub = ap.add_subparsers(dest="command", required=True)
+    sub.add_parser("list", help="подключённые партиции")
+    sub.add_parser("maintain", help="создать партиции на PARTITIONS_AHEAD_MONTHS месяцев вперёд")
+    detach_cmd = sub.add_parser("detach", help="отключить месяц для архивации")
+    detach_cmd.add_argument("month", help="YYYY-MM")
+    asyncio.run(_run(ap.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,381 @@
+"""
+Отложенная запись RuleResult через локальный журнал (RULE_RESULTS_WRITE=SPOOL).
+
+Транзакция и решение коммитятся в БД синхронно, а строки rule_results
+дописываются в журнал на диске: одна JSON-строка на транзакцию, write +
+fsync до COMMIT транзакции, чтобы у закоммиченных они не терялись. Если
+транзакция затем откатилась, в журнал дописывается отметка drop: перенос
+пропускает её строки, а уже перенесённые удаляет. Фоновая задача раз в RESULT_SPOOL_FLUSH_MS
+закрывает текущий сегмент и переносит закрытые сегменты в Postgres
+пакетными INSERT ... ON CONFLICT DO NOTHING (id строк генерируются заранее,
+поэтому повторный перенос безопасен); перенесённый сегмент удаляется.
+
+Восстановление после падения: при старте все найденные сегменты считаются
+закрытыми и переносятся первыми. Недописанная последняя строка сегмента
+(падение посреди записи) отбрасывается — ответ по ней клиенту не ушёл.
+Сегмент с битой строкой в середине (повреждение диска) переименовывается
+в *.corrupt и пропускается, чтобы не останавливать перенос и старт.
+Сегменты переносятся по одному: если БД отвергает строки сегмента (например,
+партиция месяца уже отключена), после RESULT_SPOOL_MAX_ATTEMPTS попыток он
+откладывается в *.failed, а перенос идёт дальше. Недоступность БД попыткой
+не считается — перенос просто ждёт следующего шага.
+Пока строки не перенесены, они доступны из памяти процесса (pending),
+чтобы GET /transactions/{id} возвращал полный ruleResults.
+
+Журнал локален для процесса (как и velocity-окна: uvicorn одним воркером).
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+
+from sqlalchemy import delete, tuple_
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.exc import DBAPIError, InterfaceError, OperationalError
+
+from app.core.config import (
+    RESULT_SPOOL_DIR,
+    RESULT_SPOOL_FLUSH_MS,
+    RESULT_SPOOL_MAX_ATTEMPTS,
+    RESULT_SPOOL_SEGMENT_BYTES,
+)
+from app.core.database import AsyncSessionLocal
+from app.models.rule_result import RuleResult
+
+logger = logging.getLogger(__name__)
+
+_PREFIX = "results-"
+_SUFFIX = ".spool"
+_CORRUPT = ".corrupt"
+_FAILED = ".failed"
+# строк в одном INSERT при переносе
+_CHUNK_ROWS = 5000
+
+
+def _segment_seq(name: str) -> int | None:
+    if name.startswith(_PREFIX) and name.endswith(_SUFFIX):
+        try:
+            return int(name[len(_PREFIX):-len(_SUFFIX)])
+        except ValueError:
+            return None
+    return None
+
+
+def _encode(value):
+    # tx_timestamp строк — ISO-строкой, обратно в datetime при чтении сегмента
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def _read_segment(path: str) -> tuple[list[tuple[float, list[dict]]], list[tuple[str, datetime]]]:
+    """
+    Записи сегмента (время записи, строки) и отметки drop — (id, timestamp)
+    откатившихся транзакций. Битая строка возможна только последней — хвост,
+    недописанный при падении.
+    """
+    entries = []
+    dropped = []
+    with open(path, "rb") as f:
+        lines = f.read().split(b"\n")
+    for n, line in enumerate(lines):
+        if not line:
+            continue
+        try:
+            entry = json.loads(line)
+        except ValueError:
+            if n < len(lines) - 1 and any(lines[n + 1:]):
+                raise
+            logger.warning("dropping torn tail of spool segment %s", path)
+            break
+        if "drop" in entry:
+            dropped.extend((tx_id, datetime.fromisoformat(ts)) for tx_id, ts in entry["drop"])
+            continue
+        for row in entry["rows"]:
+            row["tx_timestamp"] = datetime.fromisoformat(row["tx_timestamp"])
+        entries.append((entry["t"], entry["rows"]))
+    return entries, dropped
+
+
+def _quarantine(path: str) -> None:
+    # только из обработчика ошибки чтения (в этом же потоке): в лог попадает и она
+    logger.exception("corrupt spool segment %s, moved to %s%s", path, path, _CORRUPT)
+    os.rename(path, path + _CORRUPT)
+
+
+def _unavailable(e: Exception) -> bool:
+    # БД недоступна (соединение, таймаут): ошибка не в строках сегмента
+    return (
+        isinstance(e, (OSError, OperationalError, InterfaceError))
+        or isinstance(e, DBAPIError) and e.connection_invalidated
+    )
+
+
+class ResultSpool:
+    def __init__(self, directory: str = RESULT_SPOOL_DIR, segment_bytes: int = RESULT_SPOOL_SEGMENT_BYTES):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self._lock = threading.Lock()
+        self._file = None
+        self._seq = 0
+        # закрытые сегменты, ожидающие переноса: seq -> путь
+        self._closed: dict[int, str] = {}
+        # не перенесённые строки: сегмент -> [(время записи, id транзакции, число строк)],
+        # id транзакции -> строки (в порядке записи)
+        self._entries: dict[int, list[tuple[float, str, int]]] = {}
+        self._pending: dict[str, list[dict]] = {}
+        # откатившиеся транзакции: id -> сегмент отметки drop (нужна, пока
+        # не перенесены все сегменты до неё включительно)
+        self._dropped: dict[str, int] = {}
+        self.pending_rows = 0
+        self.flushed_rows = 0
+        self.flush_errors = 0
+        self.corrupt_segments = 0
+        self.failed_segments = 0
+        # неудачные попытки переноса сегмента подряд: seq -> число
+        self._attempts: dict[int, int] = {}
+
+    def _path(self, seq: int) -> str:
+        return os.path.join(self.directory, f"{_PREFIX}{seq:012d}{_SUFFIX}")
+
+    def recover(self) -> None:
+        """
+        Подхватывает сегменты, оставшиеся от прошлого запуска; новые записи
+        пойдут в следующий по номеру сегмент.
+        """
+        if not os.path.isdir(self.directory):
+            return
+        with self._lock:
+            for name in sorted(os.listdir(self.directory)):
+                seq = _segment_seq(name)
+                if seq is None or seq in self._closed or (self._file is not None and seq == self._seq):
+                    continue
+                path = os.path.join(self.directory, name)
+                try:
+                    entries, dropped = _read_segment(path)
+                except ValueError:
+                    _quarantine(path)
+                    self.corrupt_segments += 1
+                    continue
+                self._closed[seq] = path
+                self._note(seq, entries)
+                self._note_dropped(seq, dropped)
+                self._seq = max(self._seq, seq)
+            if self._closed:
+                logger.info("recovered %d spool segments, %d rows", len(self._closed), self.pending_rows)
+
+    def _note(self, seq: int, entries: list[tuple[float, list[dict]]]) -> None:
+        notes = self._entries.setdefault(seq, [])
+        for t, rows in entries:
+            tx_id = rows[0]["transaction_id"]
+            self._pending.setdefault(tx_id, []).extend(rows)
+            notes.append((t, tx_id, len(rows)))
+            self.pending_rows += len(rows)
+
+    def _note_dropped(self, seq: int, dropped) -> None:
+        for tx_id, _ in dropped:
+            self._pending.pop(tx_id, None)
+            self._dropped[tx_id] = seq
+
+    def _rotate(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._closed[self._seq] = self._path(self._seq)
+            self._file = None
+
+    def append(self, rows: list[dict]) -> None:
+        """
+        Строки RuleResult одной транзакции; возвращается после fsync.
+        """
+        if not rows:
+            return
+        t = time.time()
+        with self._lock:
+            self._write({"t": t, "rows": rows})
+            self._note(self._seq, [(t, rows)])
+            self._rotate_full()
+
+    def drop(self, txs: list[tuple[str, datetime]]) -> None:
+        """
+        Отметка drop для транзакций (id, timestamp), строки которых уже в
+        журнале, но сами они откатились; возвращается после fsync.
+        """
+        if not txs:
+            return
+        with self._lock:
+            self._write({"t": time.time(), "drop": txs})
+            self._note_dropped(self._seq, txs)
+            self._rotate_full()
+
+    def _write(self, entry: dict) -> None:
+        line = json.dumps(entry, separators=(",", ":"), default=_encode).encode() + b"\n"
+        if self._file is None:
+            os.makedirs(self.directory, exist_ok=True)
+            self._seq += 1
+            self._file = open(self._path(self._seq), "ab")
+        self._file.write(line)
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def _rotate_full(self) -> None:
+        if self._file.tell() >= self.segment_bytes:
+            self._rotate()
+
+    def pending(self, tx_id: str) -> list[dict]:
+        with self._lock:
+            return list(self._pending.get(tx_id, ()))
+
+    def lag(self) -> dict:
+        with self._lock:
+            oldest = min((notes[0][0] for notes in self._entries.values() if notes), default=None)
+            return {
+                "pendingRows": self.pending_rows,
+                "pendingSegments": len(self._closed) + (self._file is not None),
+                "lagSeconds": time.time() - oldest if oldest is not None else 0.0,
+                "flushedRows": self.flushed_rows,
+                "flushErrors": self.flush_errors,
+                "corruptSegments": self.corrupt_segments,
+                "failedSegments": self.failed_segments,
+            }
+
+    def _take_closed(self) -> list[tuple[int, str]]:
+        with self._lock:
+            self._rotate()
+            return sorted(self._closed.items())
+
+    def _forget(self, seq: int, flushed: bool = True) -> int:
+        """
+        Убирает перенесённый (или отложенный) сегмент из памяти; возвращает
+        число его строк.
+        """
+        rows = 0
+        with self._lock:
+            self._closed.pop(seq, None)
+            for _, tx_id, n in self._entries.pop(seq, ()):
+                rows += n
+                # у транзакции могут быть строки и в следующих сегментах (фоновый аудит)
+                tx_rows = self._pending.get(tx_id)
+                if tx_rows is not None:
+                    del tx_rows[:n]
+                    if not tx_rows:
+                        del self._pending[tx_id]
+            self.pending_rows -= rows
+            if flushed:
+                self.flushed_rows += rows
+            low = min(self._entries, default=None)
+            self._dropped = {tx_id: s for tx_id, s in self._dropped.items() if low is not None and s >= low}
+        return rows
+
+    async def flush(self) -> int:
+        """
+        Переносит все закрытые сегменты в БД; возвращает число строк.
+        Сегмент удаляется только после коммита его строк. Если БД недоступна,
+        исключение выходит наружу: остальные сегменты ждут следующего шага.
+        """
+        total = 0
+        for seq, path in self._take_closed():
+            try:
+                entries, dropped = await asyncio.to_thread(_read_segment, path)
+            except ValueError:
+                _quarantine(path)
+                self._forget(seq, flushed=False)
+                self.corrupt_segments += 1
+                continue
+            with self._lock:
+                skip = set(self._dropped)
+            rows = [row for _, tx_rows in entries for row in tx_rows if row["transaction_id"] not in skip]
+            try:
+                async with AsyncSessionLocal() as db:
+                    for i in range(0, len(rows), _CHUNK_ROWS):
+                        await db.execute(
+                            pg_insert(RuleResult).on_conflict_do_nothing(index_elements=[RuleResult.id, RuleResult.tx_timestamp]),
+                            rows[i:i + _CHUNK_ROWS],
+                        )
+                    if dropped:
+                        # строки могли быть перенесены до отката транзакции
+                        await db.execute(
+                            delete(RuleResult).where(
+                                tuple_(RuleResult.transaction_id, RuleResult.tx_timestamp).in_(dropped)
+                            )
+                        )
+                    await db.commit()
+            except Exception as e:
+                if _unavailable(e):
+                    raise
+                self._failed(seq, path)
+                continue
+            self._attempts.pop(seq, None)
+            await asyncio.to_thread(os.remove, path)
+            total += self._forget(seq)
+        return total
+
+    def _failed(self, seq: int, path: str) -> None:
+        # только из обработчика ошибки переноса: в лог попадает и она
+        self.flush_errors += 1
+        attempts = self._attempts[seq] = self._attempts.get(seq, 0) + 1
+        if attempts < RESULT_SPOOL_MAX_ATTEMPTS:
+            logger.exception("rule results spool segment %s failed (attempt %d)", path, attempts)
+            return
+        logger.exception("rule results spool segment %s failed %d times, moved to %s%s", path, attempts, path, _FAILED)
+        os.rename(path, path + _FAILED)
+        del self._attempts[seq]
+        self._forget(seq, flushed=False)
+        self.failed_segments += 1
+
+    def close(self) -> None:
+        with self._lock:
+            self._rotate()
+
+
+spool = ResultSpool()
+_flusher: asyncio.Task | None = None
+
+
+async def _flush_loop() -> None:
+    while True:
+        await asyncio.sleep(RESULT_SPOOL_FLUSH_MS / 1000)
+        try:
+            await spool.flush()
+        except Exception:
+            # БД недоступна: сегменты остаются на диске, повтор на следующем шаге
+            spool.flush_errors += 1
+            logger.exception("rule results spool flush failed")
+
+
+async def start_flusher() -> None:
+    """
+    Восстановление журнала и запуск фонового переноса; при старте приложения.
+    Запускается и при RULE_RESULTS_WRITE=SYNC — чтобы перенести сегменты,
+    оставшиеся от запуска в режиме SPOOL.
+    """
+    global _flusher
+    if _flusher is None:
+        await asyncio.to_thread(spool.recover)
+        _flusher = asyncio.create_task(_flush_loop())
+
+
+async def stop_flusher() -> None:
+    """
+    Остановка переноса и последний перенос; что не успело — останется
+    на диске до следующего старта.
+    """
+    global _flusher
+    if _flusher is None:
+        return
+    _flusher.cancel()
+    try:
+        await _flusher
+    except asyncio.CancelledError:
+        pass
+    _flusher = None
+    try:
+        await spool.flush()
+    except Exception:
+        logger.exception("final rule results spool flush failed")
+    spool.close()
@@ -0,0 +1,124 @@
+"""
+Компактное хранение результатов правил (RULE_RESULTS_STORAGE=BITMAP).
+
+Вместо строки rule_results на каждое правило каждой транзакции набор
+правил один раз сохраняется неизменяемым снимком (ruleset_snapshots,
+ключ — хэш содержимого), а в транзакции лежат версия снимка и битовая
+карта matched: ceil(N / 8) байт на транзакцию вместо N строк.
+При чтении список RuleResult восстанавливается из снимка и битов.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import threading
+
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.dsl.ruleset import CompiledRuleset
+from app.models.rule_result import RuleResult
+from app.models.ruleset_snapshot import RulesetSnapshot
+from app.models.transaction import Transaction
+
+_SNAPSHOT_FIELDS = ("id", "name", "priority", "enabled", "dsl")
+
+# (набор, версия) последнего посчитанного набора
+_version: tuple[CompiledRuleset | None, str] = (None, "")
+# версии, уже записанные в БД этим процессом, и прочитанные снимки (неизменяемы)
+_persisted: set[str] = set()
+_snapshots: dict[str, list[dict]] = {}
+_lock = threading.Lock()
+
+
+def snapshot_rules(program: CompiledRuleset) -> list[dict]:
+    return [{k: r[k] for k in _SNAPSHOT_FIELDS} for r in program.rules]
+
+
+def ruleset_version(program: CompiledRuleset) -> str:
+    global _version
+    cached_program, version = _version
+    if cached_program is not program:
+        raw = json.dumps(snapshot_rules(program), sort_keys=True, separators=(",", ":"))
+        version = hashlib.sha256(raw.encode()).hexdigest()
+        _version = (program, version)
+    return version
+
+
+def pack(matched_list: list[bool]) -> bytes:
+    """
+    Бит i (байт i // 8, разряд i % 8) — matched правила i.
+    """
+    out = bytearray((len(matched_list) + 7) // 8)
+    for i, matched in enumerate(matched_list):
+        if matched:
+            out[i >> 3] |= 1 << (i & 7)
+    return bytes(out)
+
+
+def unpack(bitmap: bytes, n: int) -> list[bool]:
+    return [bool(bitmap[i >> 3] >> (i & 7) & 1) for i in range(n)]
+
+
+async def ensure_snapshot(db: AsyncSession, program: CompiledRuleset) -> str:
+    """
+    Версия набора; снимок добавляется в текущую транзакцию БД, если этот
+    процесс его ещё не писал (повтор из другого процесса — ON CONFLICT DO NOTHING).
+    Вызывающий коммитит вместе с транзакцией — до коммита версия не
+    считается записанной (mark_persisted).
+    """
+    version = ruleset_version(program)
+    if version not in _persisted:
+        await db.execute(
+            pg_insert(RulesetSnapshot)
+            .values(version=version, rules=snapshot_rules(program))
+            .on_conflict_do_nothing(index_elements=[RulesetSnapshot.version])
+        )
+    return version
+
+
+def mark_persisted(version: str) -> None:
+    with _lock:
+        _persisted.add(version)
+
+
+def store_bitmap(tx: Transaction, version: str, matched_list: list[bool], evaluated: int) -> None:
+    tx.ruleset_version = version
+    tx.rule_bitmap = pack(matched_list[:evaluated])
+    tx.rules_evaluated = evaluated
+
+
+async def _snapshot(db: AsyncSession, version: str) -> list[dict]:
+    rules = _snapshots.get(version)
+    if rules is None:
+        snap = await db.scalar(select(RulesetSnapshot).where(RulesetSnapshot.version == version))
+        rules = snap.rules if snap else []
+        if snap:
+            with _lock:
+                _snapshots[version] = rules
+    return rules
+
+
+async def results_from_bitmap(db: AsyncSession, tx: Transaction) -> list[RuleResult]:
+    """
+    Тот же список RuleResult, что хранился бы строками (порядок priority, rule_id).
+    """
+    rules = await _snapshot(db, tx.ruleset_version)
+    n = min(tx.rules_evaluated or 0, len(rules))
+    results = [
+        RuleResult(
+            transaction_id=tx.id,
+            tx_timestamp=tx.timestamp,
+            rule_id=r["id"],
+            rule_name=r["name"],
+            priority=r["priority"],
+            enabled=r["enabled"],
+            matched=matched,
+            description=f"Evaluated: {r['dsl']}",
+        )
+        for r, matched in zip(rules, unpack(tx.rule_bitmap, n))
+    ]
+    results.sort(key=lambda rr: (rr.priority, rr.rule_id))
+    return results
@@ -0,0 +1,188 @@
+"""
+Снимок скомпилированного набора активных правил в памяти процесса.
+
+Снимок помечен версией набора (счётчик в Redis). create_rule / update_rule /
+disable_rule увеличивают версию и публикуют её (pub/sub); фоновый поток
+процесса (задача event loop) запоминает последнюю версию. Пока версия снимка совпадает с ней,
+active_program() не делает ни одного сетевого запроса. Раз в
+RULES_VERSION_CHECK_SECONDS версия дополнительно перечитывается из Redis —
+на случай потерянной публикации; без подписки — на каждом вызове.
+
+Защита от «стада» при смене версии: в процессе набор пересобирает один
+запрос, остальные в это время получают предыдущий снимок; между процессами
+запрос в БД делает держатель короткой блокировки в Redis, остальные ждут,
+пока он положит список правил в кэш.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import time
+
+from sqlalchemy import asc, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import (
+    RULE_PROFILE_EVERY,
+    RULES_LOAD_LOCK_MS,
+    RULES_LOAD_WAIT_MS,
+    RULES_VERSION_CHECK_SECONDS,
+)
+from app.core.redis import (
+    cache_get_active_rules,
+    cache_lock_active_rules,
+    cache_set_active_rules,
+    cache_unlock_active_rules,
+    listen_rules_version,
+    rules_version_bump,
+    rules_version_get,
+)
+from app.dsl.ruleset import CompiledRuleset
+from app.models.fraud_rule import FraudRule
+
+# последняя известная версия набора (из pub/sub или GET)
+_latest: int | None = None
+_checked_at = 0.0
+_subscribed = False
+_listener: asyncio.Task | None = None
+
+# (версия, ключ набора, программа)
+_snapshot: tuple[int | None, tuple, CompiledRuleset] | None = None
+# single-flight: пересборку снимка в процессе ведёт один запрос
+_rebuild_lock = asyncio.Lock()
+
+# шаг ожидания чужой загрузки набора (секунды)
+_WAIT_STEP = 0.05
+
+
+def _note_version(version: int) -> None:
+    global _latest
+    _latest = version
+
+
+def _note_subscribed(ok: bool) -> None:
+    global _subscribed
+    _subscribed = ok
+
+
+async def start_listener() -> None:
+    """
+    Задача подписки на версии набора; запускается при старте приложения.
+    """
+    global _listener
+    if _listener is None:
+        _listener = asyncio.create_task(listen_rules_version(_note_version, _note_subscribed))
+
+
+async def stop_listener() -> None:
+    global _listener
+    if _listener is not None:
+        _listener.cancel()
+        try:
+            await _listener
+        except asyncio.CancelledError:
+            pass
+        _listener = None
+
+
+async def bump_version() -> None:
+    """
+    Вызывается после коммита изменения правил.
+    """
+    _note_version(await rules_version_bump())
+
+
+async def _query_active_rules(db: AsyncSession) -> list[dict]:
+    rules = (
+        await db.scalars(
+            select(FraudRule)
+            .where(FraudRule.enabled == True)
+            .order_by(asc(FraudRule.priority), asc(FraudRule.id))
+        )
+    ).all()
+    return [
+        {
+            "id": str(r.id),
+            "name": r.name,
+            "priority": r.priority,
+            "enabled": r.enabled,
+            "dsl": r.dsl_expression,
+        }
+        for r in rules
+    ]
+
+
+async def load_active_rules(db: AsyncSession, version: int | None) -> list[dict]:
+    """
+    Сначала пробуем Redis (ключ по версии набора).
+    В кэше храним только нужные поля, чтобы не сериализовать ORM.
+    При промахе в БД идёт только держатель блокировки версии; остальные
+    процессы ждут его результат в кэше (не дольше RULES_LOAD_WAIT_MS).
+    """
+    if version is None:
+        return await _query_active_rules(db)
+
+    cached = await cache_get_active_rules(version)
+    if cached is not None:
+        return cached
+
+    deadline = time.monotonic() + RULES_LOAD_WAIT_MS / 1000
+    while True:
+        token = await cache_lock_active_rules(version, RULES_LOAD_LOCK_MS)
+        if token is not None:
+            try:
+                data = await _query_active_rules(db)
+                await cache_set_active_rules(data, version, ttl_seconds=30)
+                return data
+            finally:
+                await cache_unlock_active_rules(version, token)
+        if time.monotonic() >= deadline:
+            # держатель блокировки завис — загружаем сами
+            return await _query_active_rules(db)
+        await asyncio.sleep(_WAIT_STEP)
+        cached = await cache_get_active_rules(version)
+        if cached is not None:
+            return cached
+
+
+async def _rebuild(db: AsyncSession) -> CompiledRuleset:
+    global _snapshot
+    # версию читаем до загрузки: правка во время загрузки даст следующую версию
+    # и ещё одну пересборку, но не снимок со старыми правилами и новой версией
+    version = _latest
+    rules = await load_active_rules(db, version)
+    key = tuple((r["id"], r["name"], r["priority"], r["dsl"]) for r in rules)
+    old = _snapshot
+    if old is not None and old[1] == key:
+        # набор не изменился (например, правка описания) — сохраняем
+        # выученный порядок операндов и профиль
+        program = old[2]
+    else:
+        program = CompiledRuleset(rules, profile_every=RULE_PROFILE_EVERY)
+    _snapshot = (version, key, program)
+    return program
+
+
+async def active_program(db: AsyncSession) -> CompiledRuleset:
+    """
+    Скомпилированный набор активных правил текущей версии.
+    """
+    global _checked_at
+    now = time.monotonic()
+    if not _subscribed or now - _checked_at >= RULES_VERSION_CHECK_SECONDS:
+        _note_version(await rules_version_get())
+        _checked_at = now
+
+    snapshot = _snapshot
+    if snapshot is not None and snapshot[0] == _latest:
+        return snapshot[2]
+
+    # пересборка уже идёт в другом запросе — отдаём предыдущий снимок;
+    # если снимка ещё нет, ждём того, кто его строит
+    if snapshot is not None and _rebuild_lock.locked():
+        return snapshot[2]
+    async with _rebuild_lock:
+        snapshot = _snapshot
+        if snapshot is not None and snapshot[0] == _latest:
+            return snapshot[2]
+        return await _rebuild(db)
@@ -0,0 +1,141 @@
+"""
+total для листингов без COUNT(*) по таблице.
+
+- transactions с фильтром по пользователю — точная сумма из transaction_counts
+  (несколько строк по индексу PK), totalKind=EXACT;
+- transactions ADMIN без userId, но со status/isFraud — сумма по
+  transaction_counts, кэшируется в процессе на TOTALS_CACHE_SECONDS, CACHED;
+- без фильтров (transactions ADMIN, users) — оценка планировщика
+  pg_class.reltuples, ESTIMATE; если таблица меньше TOTALS_ESTIMATE_MIN_ROWS
+  или оценки нет (не Postgres, таблица не анализировалась) — точное число
+  через тот же кэш, CACHED.
+"""
+
+from __future__ import annotations
+
+import logging
+import time
+from collections import Counter
+
+from sqlalchemy import false, func, select, text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import TOTALS_CACHE_SECONDS, TOTALS_ESTIMATE_MIN_ROWS
+from app.models.transaction import Transaction
+from app.models.transaction_count import TransactionCount
+from app.models.user import User
+
+logger = logging.getLogger(__name__)
+
+EXACT = "EXACT"
+CACHED = "CACHED"
+ESTIMATE = "ESTIMATE"
+
+# ключ запроса -> (момент истечения, значение)
+_cache: dict[tuple, tuple[float, int]] = {}
+
+
+def increment(txs) -> object | None:
+    """
+    UPSERT счётчиков по транзакциям пакета; выполняется вызывающим в той же
+    транзакции БД, что и их INSERT. Строки упорядочены по ключу: параллельные
+    пакеты блокируют строки счётчиков в одном порядке (без взаимоблокировок).
+    """
+    counts = Counter((tx.user_id, tx.status, bool(tx.is_fraud)) for tx in txs)
+    if not counts:
+        return None
+    stmt = pg_insert(TransactionCount).values([
+        {"user_id": u, "status": s, "is_fraud": f, "n": n} for (u, s, f), n in sorted(counts.items())
+    ])
+    return stmt.on_conflict_do_update(
+        index_elements=[TransactionCount.user_id, TransactionCount.status, TransactionCount.is_fraud],
+        set_={"n": TransactionCount.n + stmt.excluded.n},
+    )
+
+
+async def backfill(db: AsyncSession) -> None:
+    """
+    Первичное заполнение transaction_counts по существующим транзакциям
+    (при старте приложения). Таблицы блокируются на время пересчёта,
+    поэтому параллельные вставки не теряются и не считаются дважды;
+    повторный запуск (другой процесс) видит счётчики и ничего не делает.
+    """
+    postgres = db.get_bind().dialect.name == "postgresql"
+    if postgres:
+        await db.execute(text("LOCK TABLE transaction_counts IN EXCLUSIVE MODE"))
+    if await db.scalar(select(TransactionCount.user_id).limit(1)) is None:
+        if postgres:
+            await db.execute(text("LOCK TABLE transactions IN SHARE MODE"))
+        # false() — литерал: с параметром ($1, $2) Postgres не сочтёт выражения в SELECT и GROUP BY одним
+        is_fraud = func.coalesce(Transaction.is_fraud, false())
+        grouped = (
+            select(Transaction.user_id, Transaction.status, is_fraud, func.count())
+            .group_by(Transaction.user_id, Transaction.status, is_fraud)
+        )
+        await db.execute(
+            TransactionCount.__table__.insert().from_select(["user_id", "status", "is_fraud", "n"], grouped)
+        )
+    await db.commit()
+
+
+async def _cached(key: tuple, load) -> int:
+    now = time.monotonic()
+    hit = _cache.get(key)
+    if hit is not None and hit[0] > now:
+        return hit[1]
+    value = int(await load())
+    _cache[key] = (now + TOTALS_CACHE_SECONDS, value)
+    return value
+
+
+async def _estimate(db: AsyncSession, table: str) -> int | None:
+    if db.get_bind().dialect.name != "postgresql":
+        return None
+    # партиционированная таблица (transactions) — сумма оценок партиций:
+    # у самого родителя строк нет, и autovacuum его не анализирует
+    rows = await db.scalar(
+        text(
+            "SELECT CASE WHEN c.relkind = 'p' THEN ("
+            "  SELECT sum(greatest(p.reltuples, 0))::bigint FROM pg_inherits i"
+            "  JOIN pg_class p ON p.oid = i.inhrelid WHERE i.inhparent = c.oid"
+            ") ELSE c.reltuples::bigint END FROM pg_class c WHERE c.oid = to_regclass(:t)"
+        ),
+        {"t": table},
+    )
+    # -1 — таблица ещё не анализировалась
+    return rows if rows is not None and rows >= 0 else None
+
+
+def _counts_sum(user_id: str | None, status: str | None, is_fraud: bool | None):
+    q = select(func.coalesce(func.sum(TransactionCount.n), 0))
+    if user_id is not None:
+        q = q.where(TransactionCount.user_id == user_id)
+    if status is not None:
+        q = q.where(TransactionCount.status == status)
+    if is_fraud is not None:
+        q = q.where(TransactionCount.is_fraud == is_fraud)
+    return q
+
+
+async def transactions_total(
+    db: AsyncSession, user_id: str | None, status: str | None, is_fraud: bool | None
+) -> tuple[int, str]:
+    """
+    (total, totalKind) для листинга транзакций с такими фильтрами.
+    """
+    q = _counts_sum(user_id, status, is_fraud)
+    if user_id is not None:
+        return int(await db.scalar(q)), EXACT
+    if status is None and is_fraud is None:
+        estimate = await _estimate(db, Transaction.__tablename__)
+        if estimate is not None and estimate >= TOTALS_ESTIMATE_MIN_ROWS:
+            return estimate, ESTIMATE
+    return await _cached(("transactions", status, is_fraud), lambda: db.scalar(q)), CACHED
+
+
+async def users_total(db: AsyncSession) -> tuple[int, str]:
+    estimate = await _estimate(db, User.__tablename__)
+    if estimate is not None and estimate >= TOTALS_ESTIMATE_MIN_ROWS:
+        return estimate, ESTIMATE
+    return await _cached(("users",), lambda: db.scalar(select(func.count()).select_from(User))), CACHED
@@ -1,54 +1,49 @@
+import json
+import logging
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
-from sqlalchemy.orm import Session
-from sqlalchemy import asc
+from decimal import Decimal, ROUND_HALF_UP
+from sqlalchemy import asc, insert, inspect, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
 
 from app.models.transaction import Transaction
 from app.models.rule_result import RuleResult
-from app.models.fraud_rule import FraudRule
-from app.dsl.simple_engine import evaluate_simple
+from app.models.idempotency_key import IdempotencyKey
+from app.dsl.ruleset import CompiledRuleset
+from app.dsl.vectorized import evaluate_batch
 from app.models.user import User
+from app.services import partitions, result_spool, rule_storage, rules_snapshot, totals, velocity
 
 
-from app.core.redis import cache_get_active_rules, cache_set_active_rules
+from app.core.config import DECISION_MODE, AUDIT_WORKERS, RULE_RESULTS_STORAGE, RULE_RESULTS_WRITE
+from app.core.database import SessionLocal
 
+logger = logging.getLogger(__name__)
 
-def _load_active_rules(db: Session) -> list[dict]:
-    """
-    Сначала пробуем Redis.
-    В кэше храним только нужные поля, чтобы не сериализовать ORM.
-    """
-    cached = cache_get_active_rules()
-    if cached is not None:
-        return cached
+# досчёт правил после раннего решения (DECISION_MODE=FIRST_MATCH)
+_audit_pool = ThreadPoolExecutor(max_workers=AUDIT_WORKERS, thread_name_prefix="rule-audit")
 
-    rules = (
-        db.query(FraudRule)
-        .filter(FraudRule.enabled == True)
-        .order_by(asc(FraudRule.priority), asc(FraudRule.id))
-        .all()
-    )
-    data = [
-        {
-            "id": str(r.id),
-            "name": r.name,
-            "priority": r.priority,
-            "enabled": r.enabled,
-            "dsl": r.dsl_expression,
-        }
-        for r in rules
-    ]
-    cache_set_active_rules(data, ttl_seconds=30)
-    return data
+# строки rule_results пишутся через журнал (app.services.result_spool), а не в транзакции запроса
+_SPOOLED = RULE_RESULTS_WRITE == "SPOOL" and RULE_RESULTS_STORAGE != "BITMAP"
 
 
-def create_transaction_tier0(db: Session, user_id: str, data) -> tuple[Transaction, list[RuleResult]]:
+def _build_transaction(user_id: str, data) -> Transaction:
+    """
+    Транзакция целиком собирается на клиенте (id, created_at, сумма с точностью
+    колонки), чтобы после INSERT её не нужно было перечитывать из БД.
+    """
+    # в БД timestamp без зоны — храним UTC (asyncpg не принимает aware datetime для такой колонки)
     ts = data.timestamp
-    if ts.tzinfo is None:
-        ts = ts.replace(tzinfo=timezone.utc)
+    if ts.tzinfo is not None:
+        ts = ts.astimezone(timezone.utc).replace(tzinfo=None)
 
-    tx = Transaction(
+    return Transaction(
+        id=str(uuid.uuid4()),
+        created_at=datetime.utcnow(),
         user_id=user_id,
-        amount=data.amount,
+        amount=Decimal(str(data.amount)).quantize(Decimal("0.01"), rounding=ROUND_HALF_UP),
         currency=data.currency,
         timestamp=ts,
         status="APPROVED",
@@ -61,14 +56,10 @@ def create_transaction_tier0(db: Session, user_id: str, data) -> tuple[Transacti
         location=data.location.model_dump() if data.location else None,
         extra=data.metadata,
     )
-    db.add(tx)
-    db.commit()
-    db.refresh(tx)
 
-    rules = _load_active_rules(db)
-    results: list[RuleResult] = []
 
-    tx_ctx = {
+def _tx_context(tx: Transaction) -> dict:
+    return {
         "amount": float(tx.amount),
         "currency": tx.currency,
         "merchantId": tx.merchant_id,
@@ -79,49 +70,382 @@ def create_transaction_tier0(db: Session, user_id: str, data) -> tuple[Transacti
         "location": tx.location or {},
     }
 
-    # user context (Tier 5)
-    user = db.query(User).filter(User.id == user_id).first()
-    user_ctx = {
+
+def _user_context(user: User | None, features: dict | None = None) -> dict:
+    # user context (Tier 5) + velocity-признаки (user.txCount1h, ...)
+    ctx = {
         "age": user.age if user else None,
         "region": user.region if user else None,
     }
+    if features:
+        ctx.update(features)
+    return ctx
 
-    any_matched = False
 
-    for r in rules:
-        try:
-            matched = evaluate_simple(r["dsl"], tx_ctx, user_ctx)
-        except Exception:
-            matched = False
-
-        if matched:
-            any_matched = True
-
-        rr = RuleResult(
-            transaction_id=str(tx.id),
-            rule_id=r["id"],
-            rule_name=r["name"],
-            priority=r["priority"],
-            enabled=r["enabled"],
-            matched=matched,
-            description=f"Evaluated: {r['dsl']}",
-        )
-        db.add(rr)
-        results.append(rr)
+def _rule_result_row(tx_id: str, tx_ts: datetime, r: dict, matched: bool) -> dict:
+    return {
+        "id": str(uuid.uuid4()),
+        "transaction_id": tx_id,
+        "tx_timestamp": tx_ts,
+        "rule_id": r["id"],
+        "rule_name": r["name"],
+        "priority": r["priority"],
+        "enabled": r["enabled"],
+        "matched": matched,
+        "description": f"Evaluated: {r['dsl']}",
+    }
+
 
-    if any_matched:
+def _decide(tx: Transaction, rules: list[dict], matched_list: list[bool], decided: int | None = None) -> list[dict]:
+    """
+    Итоговый статус транзакции и строки RuleResult по каждому активному правилу.
+    decided — сколько первых правил уже посчитано (режим FIRST_MATCH),
+    результаты остальных допишет _audit_remaining.
+    """
+    if any(matched_list):
         tx.status = "DECLINED"
         tx.is_fraud = True
+    return [_rule_result_row(tx.id, tx.timestamp, r, matched) for r, matched in zip(rules[:decided], matched_list)]
+
+
+_TX_COLUMNS = [a.key for a in inspect(Transaction).column_attrs]
+# (атрибут, колонка) — для COPY: extra лежит в колонке metadata
+_TX_COPY_COLUMNS = [(a.key, a.columns[0].name) for a in inspect(Transaction).column_attrs]
+_TX_JSON_COLUMNS = {"location", "extra"}
+_RR_COPY_COLUMNS = [c.name for c in RuleResult.__table__.columns]
+
+
+def _key_rows(items: list[tuple[Transaction, list[dict]]], keys: dict[str, dict] | None) -> list[dict]:
+    # строки idempotency_keys для транзакций, отправленных с ключом
+    if not keys:
+        return []
+    return [{**keys[tx.id], "transaction_id": tx.id} for tx, _ in items if tx.id in keys]
+
+
+async def _write(
+    db: AsyncSession,
+    program: CompiledRuleset,
+    items: list[tuple[Transaction, list[dict]]],
+    keys: dict[str, dict] | None = None,
+) -> str | None:
+    """
+    INSERT транзакций и их RuleResult пакетами, без COMMIT. Объекты в сессию
+    не добавляются, поэтому после коммита их не нужно перечитывать.
+    В режиме BITMAP вместо строк результатов — битовая карта в самой
+    транзакции (и при первом использовании — снимок набора правил);
+    возвращается версия снимка. В режиме SPOOL строки результатов пишет
+    _spool до коммита. Счётчики для total листинга (transaction_counts)
+    обновляются здесь же.
+    keys — id транзакции -> строка idempotency_keys (без transaction_id):
+    повтор ключа упадёт на PK в этой же транзакции БД.
+    """
+    await partitions.ensure(db, [tx.timestamp for tx, _ in items])
+    version = None
+    if RULE_RESULTS_STORAGE == "BITMAP":
+        version = await rule_storage.ensure_snapshot(db, program)
+        for tx, rows in items:
+            rule_storage.store_bitmap(tx, version, [row["matched"] for row in rows], len(rows))
+    await db.execute(insert(Transaction), [{k: getattr(tx, k) for k in _TX_COLUMNS} for tx, _ in items])
+    key_rows = _key_rows(items, keys)
+    if key_rows:
+        await db.execute(insert(IdempotencyKey), key_rows)
+    await db.execute(totals.increment([tx for tx, _ in items]))
+    if version is None and not _SPOOLED:
+        rows = [row for _, tx_rows in items for row in tx_rows]
+        if rows:
+            await db.execute(insert(RuleResult), rows)
+    return version
+
+
+async def _spool(db: AsyncSession, rows_per_tx: list[list[dict]]) -> None:
+    """
+    Строки RuleResult — в журнал (write + fsync в пуле потоков) до COMMIT
+    транзакций: после коммита они уже не потеряются при падении процесса.
+    Если транзакции затем откатились — _drop_spooled. Если журнал
+    недоступен (диск), строки пишутся в БД в той же транзакции.
+    """
+    def append_all():
+        for rows in rows_per_tx:
+            result_spool.spool.append(rows)
+
+    try:
+        await run_in_threadpool(append_all)
+    except OSError:
+        logger.exception("rule results spool append failed, writing rows directly")
+        rows = [row for tx_rows in rows_per_tx for row in tx_rows]
+        if rows:
+            # строки, успевшие попасть в журнал, при переносе пропустит ON CONFLICT
+            await db.execute(insert(RuleResult), rows)
+
+
+async def _drop_spooled(txs: list[Transaction]) -> None:
+    """
+    Откат транзакций, строки которых уже в журнале: отметка drop, чтобы
+    перенос не записал результаты несуществующих транзакций.
+    """
+    try:
+        await run_in_threadpool(result_spool.spool.drop, [(tx.id, tx.timestamp) for tx in txs])
+    except OSError:
+        logger.exception("rule results spool drop failed for %d transactions", len(txs))
+
+
+def _copy_value(key: str, value):
+    # asyncpg кодирует json/jsonb из строки
+    if key in _TX_JSON_COLUMNS and value is not None:
+        return json.dumps(value)
+    return value
+
+
+async def _copy(
+    db: AsyncSession,
+    program: CompiledRuleset,
+    items: list[tuple[Transaction, list[dict]]],
+    keys: dict[str, dict] | None = None,
+) -> str | None:
+    """
+    То же, что _write, но через COPY: для потоковой загрузки, где пакеты
+    большие. COPY идёт по соединению сессии (asyncpg), в её транзакции;
+    на других драйверах — обычный _write.
+    """
+    if db.get_bind().dialect.driver != "asyncpg":
+        return await _write(db, program, items, keys)
+    await partitions.ensure(db, [tx.timestamp for tx, _ in items])
+    version = None
+    if RULE_RESULTS_STORAGE == "BITMAP":
+        version = await rule_storage.ensure_snapshot(db, program)
+        for tx, rows in items:
+            rule_storage.store_bitmap(tx, version, [row["matched"] for row in rows], len(rows))
+    key_rows = _key_rows(items, keys)
+    if key_rows:
+        await db.execute(insert(IdempotencyKey), key_rows)
+    # до COPY: через сессию, чтобы её транзакция уже была открыта
+    await db.execute(totals.increment([tx for tx, _ in items]))
+    conn = await (await db.connection()).get_raw_connection()
+    raw = conn.driver_connection
+    # если сессия ещё не начала транзакцию, это её транзакция, иначе — SAVEPOINT
+    async with raw.transaction():
+        await raw.copy_records_to_table(
+            Transaction.__tablename__,
+            columns=[column for _, column in _TX_COPY_COLUMNS],
+            records=[tuple(_copy_value(k, getattr(tx, k)) for k, _ in _TX_COPY_COLUMNS) for tx, _ in items],
+        )
+        if version is None and not _SPOOLED:
+            rows = [row for _, tx_rows in items for row in tx_rows]
+            if rows:
+                await raw.copy_records_to_table(
+                    RuleResult.__tablename__,
+                    columns=_RR_COPY_COLUMNS,
+                    records=[tuple(row[c] for c in _RR_COPY_COLUMNS) for row in rows],
+                )
+    return version
+
+
+async def _write_nested(db: AsyncSession, write, program: CompiledRuleset, items, keys) -> str | None:
+    """
+    write (_write или _copy) в SAVEPOINT. Если месяц успели отключить
+    (partitions.detach), а этот процесс ещё считал его партиции подключёнными,
+    запись повторяется — уже с новыми партициями.
+    """
+    try:
+        async with db.begin_nested():
+            return await write(db, program, items, keys)
+    except Exception as e:
+        if not partitions.forget_detached(e, [tx.timestamp for tx, _ in items]):
+            raise
+    async with db.begin_nested():
+        return await write(db, program, items, keys)
+
+
+def _discard_velocity(txs: list[Transaction]) -> None:
+    for tx in txs:
+        velocity.store.discard(tx.user_id, tx.timestamp, float(tx.amount))
+
+
+async def _persist(
+    db: AsyncSession, tx: Transaction, program: CompiledRuleset, rows: list[dict], key: dict | None = None
+) -> list[RuleResult]:
+    """
+    Транзакция и все её RuleResult — одной транзакцией БД: INSERT транзакции,
+    один пакетный INSERT результатов и COMMIT.
+    Если запись не удалась — транзакция убирается из velocity-окон.
+    """
+    keys = {tx.id: key} if key else None
+    spooled = False
+    try:
+        try:
+            version = await _write(db, program, [(tx, rows)], keys)
+        except Exception as e:
+            if not partitions.forget_detached(e, [tx.timestamp]):
+                raise
+            await db.rollback()
+            version = await _write(db, program, [(tx, rows)], keys)
+        if _SPOOLED:
+            spooled = True
+            await _spool(db, [rows])
+        await db.commit()
+    except Exception:
+        await db.rollback()
+        _discard_velocity([tx])
+        if spooled:
+            await _drop_spooled([tx])
+        raise
+    if version:
+        rule_storage.mark_persisted(version)
+    return [RuleResult(**row) for row in rows]
+
+
+def _audit_remaining(
+    tx_id: str, tx_ts: datetime, program: CompiledRuleset, tx_ctx: dict, user_ctx: dict, start: int
+) -> None:
+    """
+    Фоновый досчёт правил, не исполненных до раннего решения, —
+    чтобы журнал rule_results по транзакции был полным. Идёт в потоке
+    вне event loop (CPU), поэтому через синхронную сессию.
+    """
+    db = SessionLocal()
+    try:
+        matched_list = program.evaluate(tx_ctx, user_ctx)
+        if RULE_RESULTS_STORAGE == "BITMAP":
+            # снимок уже записан вместе с транзакцией — меняем только биты
+            db.execute(
+                update(Transaction)
+                .where(Transaction.id == tx_id, Transaction.timestamp == tx_ts)
+                .values(rule_bitmap=rule_storage.pack(matched_list), rules_evaluated=len(matched_list))
+            )
+        else:
+            rows = [
+                _rule_result_row(tx_id, tx_ts, r, matched)
+                for r, matched in zip(program.rules[start:], matched_list[start:])
+            ]
+            if rows and _SPOOLED:
+                result_spool.spool.append(rows)
+            elif rows:
+                db.execute(insert(RuleResult), rows)
+        db.commit()
+    except Exception:
+        logger.exception("deferred rule audit failed for transaction %s", tx_id)
+    finally:
+        db.close()
+
+
+def shutdown_audit() -> None:
+    # дожидаемся отложенного аудита при остановке приложения
+    _audit_pool.shutdown(wait=True)
+
 
-    db.commit()
+async def create_transaction_tier0(
+    db: AsyncSession, user: User, data, idempotency: dict | None = None
+) -> tuple[Transaction, list[RuleResult]]:
+    """
+    Решение считается до любой записи: правила берутся из снимка в памяти,
+    пользователь приходит из роутера; затем одна транзакция БД (_persist).
+    idempotency — строка idempotency_keys (app.services.idempotency.row),
+    пишется вместе с транзакцией.
+    """
+    tx = _build_transaction(str(user.id), data)
+    program = await rules_snapshot.active_program(db)
+
+    # окна считаются до записи транзакции: история из БД не должна её содержать
+    features = await velocity.store.observe(db, program, tx.user_id, tx.timestamp, float(tx.amount))
+    tx_ctx, user_ctx = _tx_context(tx), _user_context(user, features)
+
+    if DECISION_MODE != "FIRST_MATCH":
+        matched_list = program.evaluate(tx_ctx, user_ctx)
+        return tx, await _persist(db, tx, program, _decide(tx, program.rules, matched_list), idempotency)
+
+    # решает первое сработавшее правило по приоритету; остальные — в фоне
+    matched_list, decided = program.first_match(tx_ctx, user_ctx)
+    results = await _persist(db, tx, program, _decide(tx, program.rules, matched_list, decided), idempotency)
+    if decided < len(program.rules):
+        _audit_pool.submit(_audit_remaining, tx.id, tx.timestamp, program, tx_ctx, user_ctx, decided)
     return tx, results
 
 
-def get_transaction_with_results(db: Session, tx_id: str):
-    tx = db.query(Transaction).filter(Transaction.id == tx_id).first()
+async def create_transactions_batch(
+    db: AsyncSession,
+    items: list[tuple[User, object]],
+    copy: bool = False,
+    idempotency: list[dict | None] | None = None,
+) -> list[tuple[Transaction, list[RuleResult]] | Exception]:
+    """
+    Батч: правила грузятся один раз и считаются колоночно по всему батчу
+    (app.dsl.vectorized), затем все транзакции и результаты пишутся пакетными
+    INSERT в одной транзакции БД. Если пакет не записался, элементы пишутся
+    по одному, каждый в своём SAVEPOINT: неудачный элемент получает
+    исключение вместо результата, остальные сохраняются (ответ 207).
+    items — пары (пользователь, TransactionCreateRequest).
+    copy — пакет пишется через COPY (потоковая загрузка), по одному — INSERT.
+    idempotency — строки idempotency_keys по элементам (None — без ключа).
+    """
+    if not items:
+        # все элементы отклонены или повторены по ключу: писать нечего
+        return []
+    program = await rules_snapshot.active_program(db)
+    txs = [_build_transaction(str(user.id), data) for user, data in items]
+
+    # по порядку батча: следующая транзакция пользователя видит предыдущие
+    user_ctxs = [
+        _user_context(
+            user,
+            await velocity.store.observe(db, program, tx.user_id, tx.timestamp, float(tx.amount)),
+        )
+        for tx, (user, _) in zip(txs, items)
+    ]
+    keys = {tx.id: key for tx, key in zip(txs, idempotency or ()) if key}
+    matched_rows = evaluate_batch(program, [_tx_context(tx) for tx in txs], user_ctxs)
+    decided = [(tx, _decide(tx, program.rules, matched_list)) for tx, matched_list in zip(txs, matched_rows)]
+
+    out: list[tuple[Transaction, list[RuleResult]] | Exception] = [
+        (tx, [RuleResult(**row) for row in rows]) for tx, rows in decided
+    ]
+    version = None
+    spooled: list[Transaction] = []
+    try:
+        try:
+            version = await _write_nested(db, _copy if copy else _write, program, decided, keys)
+        except Exception:
+            for i, item in enumerate(decided):
+                try:
+                    version = await _write_nested(db, _write, program, [item], keys) or version
+                except Exception as e:
+                    out[i] = e
+                    _discard_velocity([item[0]])
+        if _SPOOLED:
+            spooled = [tx for tx, r in zip(txs, out) if not isinstance(r, Exception)]
+            await _spool(db, [rows for (_, rows), r in zip(decided, out) if not isinstance(r, Exception)])
+        await db.commit()
+    except Exception:
+        await db.rollback()
+        _discard_velocity([tx for tx, r in zip(txs, out) if not isinstance(r, Exception)])
+        if spooled:
+            await _drop_spooled(spooled)
+        raise
+    if version:
+        rule_storage.mark_persisted(version)
+    return out
+
+
+async def get_transaction_with_results(db: AsyncSession, tx_id: str):
+    # месяц по id неизвестен: поиск по PK (id, timestamp) в каждой партиции
+    tx = await db.scalar(select(Transaction).where(Transaction.id == tx_id))
     if not tx:
         return None, []
-    results = db.query(RuleResult).filter(RuleResult.transaction_id == tx_id).order_by(
-        asc(RuleResult.priority), asc(RuleResult.rule_id)
+    if tx.rule_bitmap is not None:
+        return tx, await rule_storage.results_from_bitmap(db, tx)
+    results = (
+        await db.scalars(
+            select(RuleResult)
+            # tx_timestamp — ключ партиционирования: чтение из одной партиции
+            .where(RuleResult.transaction_id == tx_id, RuleResult.tx_timestamp == tx.timestamp)
+            .order_by(asc(RuleResult.priority), asc(RuleResult.rule_id))
+        )
     ).all()
+    pending = result_spool.spool.pending(tx_id)
+    if pending:
+        # ещё не перенесённые из журнала строки (строка может быть и там, и уже в БД)
+        seen = {r.id for r in results}
+        results = sorted(
+            [*results, *(RuleResult(**row) for row in pending if row["id"] not in seen)],
+            key=lambda r: (r.priority, r.rule_id),
+        )
     return tx, results
@@ -1,43 +1,46 @@
-from sqlalchemy.orm import Session
-from sqlalchemy import desc
+from sqlalchemy import desc, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
 
 from app.core.security import hash_password
 from app.models.user import User
+from app.services import totals
 
 
-def get_user(db: Session, user_id: str) -> User | None:
-    return db.query(User).filter(User.id == user_id).first()
+async def get_user(db: AsyncSession, user_id: str) -> User | None:
+    return await db.scalar(select(User).where(User.id == user_id))
 
 
-def get_by_email(db: Session, email: str) -> User | None:
-    return db.query(User).filter(User.email == email).first()
+async def get_by_email(db: AsyncSession, email: str) -> User | None:
+    return await db.scalar(select(User).where(User.email == email))
 
 
-def list_users(db: Session, page: int, size: int):
-    total = db.query(User).count()
+async def list_users(db: AsyncSession, page: int, size: int):
+    total, total_kind = await totals.users_total(db)
     items = (
-        db.query(User)
-        .order_by(desc(User.created_at))
-        .offset(page * size)
-        .limit(size)
-        .all()
-    )
-    return items, total
+        await db.scalars(
+            select(User)
+            .order_by(desc(User.created_at))
+            .offset(page * size)
+            .limit(size)
+        )
+    ).all()
+    return items, total, total_kind
 
 
-def update_user_full(db: Session, user: User, data) -> User:
+async def update_user_full(db: AsyncSession, user: User, data) -> User:
     user.full_name = data.fullName
     user.age = data.age
     user.region = data.region
     user.gender = data.gender
     user.marital_status = data.maritalStatus
     db.add(user)
-    db.commit()
-    db.refresh(user)
+    await db.commit()
+    await db.refresh(user)
     return user
 
 
-def admin_update_user_full(db: Session, user: User, data) -> User:
+async def admin_update_user_full(db: AsyncSession, user: User, data) -> User:
     user.full_name = data.fullName
     user.age = data.age
     user.region = data.region
@@ -50,15 +53,15 @@ def admin_update_user_full(db: Session, user: User, data) -> User:
         user.is_active = data.isActive
 
     db.add(user)
-    db.commit()
-    db.refresh(user)
+    await db.commit()
+    await db.refresh(user)
     return user
 
 
-def admin_create_user(db: Session, data) -> User:
+async def admin_create_user(db: AsyncSession, data) -> User:
     user = User(
         email=data.email,
-        password_hash=hash_password(data.password),
+        password_hash=await run_in_threadpool(hash_password, data.password),
         full_name=data.fullName,
         age=data.age,
         region=data.region,
@@ -68,13 +71,13 @@ def admin_create_user(db: Session, data) -> User:
         is_active=True,
     )
     db.add(user)
-    db.commit()
-    db.refresh(user)
+    await db.commit()
+    await db.refresh(user)
     return user
 
 
-def deactivate_user(db: Session, user: User) -> None:
+async def deactivate_user(db: AsyncSession, user: User) -> None:
     if user.is_active:
         user.is_active = False
         db.add(user)
-        db.commit()
+        await db.commit()
@@ -0,0 +1,216 @@
+"""
+Velocity-признаки пользователя для DSL: user.txCount1h, user.amountSum24h, ...
+
+Для каждого пользователя и длины окна в памяти процесса лежит скользящее
+окно (deque событий + текущая сумма). Новое событие добавляется в конец,
+устаревшие снимаются с начала, поэтому значение признака читается за O(1)
+(амортизированно), без агрегатов по transactions.
+
+Поддерживаются только окна, на которые ссылаются активные правила. При
+первом обращении к пользователю (или когда правила запросили окно длиннее
+загруженного) история за нужный период один раз поднимается из БД.
+Хранилище локально для процесса (uvicorn запускается одним воркером);
+холодные пользователи вытесняются по LRU (VELOCITY_MAX_USERS).
+"""
+
+from __future__ import annotations
+
+import asyncio
+import threading
+from collections import OrderedDict, deque
+from datetime import datetime, timezone
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import VELOCITY_MAX_USERS
+from app.dsl.ruleset import CompiledRuleset
+from app.dsl.types import VelocityFeature, parse_velocity_field
+from app.models.transaction import Transaction
+
+
+def _epoch(ts: datetime) -> float:
+    # в БД timestamp хранится без зоны — это UTC
+    if ts.tzinfo is None:
+        ts = ts.replace(tzinfo=timezone.utc)
+    return ts.timestamp()
+
+
+class _Window:
+    """
+    События (ts, amount) одного пользователя за span секунд, по возрастанию ts.
+    """
+
+    __slots__ = ("span", "events", "total")
+
+    def __init__(self, span: int):
+        self.span = span
+        self.events: deque[tuple[float, float]] = deque()
+        self.total = 0.0
+
+    def add(self, ts: float, amount: float) -> None:
+        events = self.events
+        if not events or ts >= events[-1][0]:
+            events.append((ts, amount))
+        else:
+            # запоздавшая транзакция: редкий случай, вставка на место
+            i = len(events)
+            while i > 0 and events[i - 1][0] > ts:
+                i -= 1
+            events.insert(i, (ts, amount))
+        self.total += amount
+        # окно обрезается и здесь: признак этой длины могут больше не читать
+        start = events[-1][0] - self.span
+        while events[0][0] <= start:
+            self.total -= events.popleft()[1]
+
+    def remove(self, ts: float, amount: float) -> None:
+        try:
+            self.events.remove((ts, amount))
+        except ValueError:
+            return
+        self.total = self.total - amount if self.events else 0.0
+
+    def at(self, ts: float) -> tuple[int, float]:
+        """
+        (число, сумма) событий в окне (ts - span, ts].
+        Для запоздавшей транзакции (ts раньше последнего события) окно не
+        сдвигается, а считается перебором — уже вытесненные события в него
+        не попадут.
+        """
+        events = self.events
+        start = ts - self.span
+        if not events or ts >= events[-1][0]:
+            # обычный случай — время идёт вперёд: сдвигаем окно
+            while events and events[0][0] <= start:
+                self.total -= events.popleft()[1]
+            if not events:
+                self.total = 0.0
+            return len(events), self.total
+        count, total = 0, 0.0
+        for t, a in events:
+            if start < t <= ts:
+                count += 1
+                total += a
+        return count, total
+
+
+class _UserWindows:
+    __slots__ = ("windows",)
+
+    def __init__(self):
+        self.windows: dict[int, _Window] = {}
+
+    def extend(self, spans: set[int], history: list[tuple[float, float]]) -> None:
+        for span in spans:
+            w = self.windows[span] = _Window(span)
+            for ts, amount in history:
+                w.add(ts, amount)
+
+
+class VelocityStore:
+    def __init__(self, max_users: int = VELOCITY_MAX_USERS):
+        self.max_users = max_users
+        self._users: OrderedDict[str, _UserWindows] = OrderedDict()
+        self._lock = threading.Lock()
+        # загрузки истории из БД: не больше одной на пользователя
+        self._loading: dict[str, asyncio.Event] = {}
+        # признаки последнего набора правил: (набор, признаки)
+        self._features: tuple[CompiledRuleset | None, tuple[VelocityFeature, ...]] = (None, ())
+
+    def features_of(self, program: CompiledRuleset) -> tuple[VelocityFeature, ...]:
+        cached_program, features = self._features
+        if cached_program is not program:
+            features = tuple(
+                f for f in map(parse_velocity_field, sorted(program.fields)) if f is not None
+            )
+            self._features = (program, features)
+        return features
+
+    async def _hydrate(self, db: AsyncSession, user_id: str, ts: float, span: int) -> list[tuple[float, float]]:
+        since = datetime.fromtimestamp(ts - span, tz=timezone.utc).replace(tzinfo=None)
+        rows = (
+            await db.execute(
+                select(Transaction.timestamp, Transaction.amount)
+                .where(Transaction.user_id == user_id, Transaction.timestamp > since)
+                .order_by(Transaction.timestamp)
+            )
+        ).all()
+        return [(_epoch(t), float(a)) for t, a in rows]
+
+    async def _windows(self, db: AsyncSession, user_id: str, spans: set[int], t: float) -> _UserWindows:
+        """
+        Окна пользователя, среди которых есть окна длины spans. Недостающие
+        строятся по истории из БД; параллельные запросы того же пользователя
+        ждут эту загрузку, а не строят окна заново: в загруженную историю не
+        попадут их незакоммиченные транзакции, уже добавленные в окна.
+        """
+        while True:
+            with self._lock:
+                user = self._users.get(user_id)
+                missing = spans - user.windows.keys() if user is not None else spans
+                if not missing:
+                    return user
+                loading = self._loading.get(user_id)
+                if loading is None:
+                    loading = self._loading[user_id] = asyncio.Event()
+                    break
+            await loading.wait()
+        try:
+            # запрос в БД — вне блокировки
+            history = await self._hydrate(db, user_id, t, max(missing))
+            with self._lock:
+                user = self._users.get(user_id) or _UserWindows()
+                user.extend(spans - user.windows.keys(), history)
+                self._users[user_id] = user
+            return user
+        finally:
+            with self._lock:
+                del self._loading[user_id]
+            loading.set()
+
+    async def observe(self, db: AsyncSession, program: CompiledRuleset, user_id: str, ts: datetime, amount: float) -> dict:
+        """
+        Значения признаков, на которые ссылаются правила, с учётом текущей
+        транзакции; сама транзакция записывается в окна пользователя.
+        Если транзакцию сохранить не удалось — discard().
+        """
+        features = self.features_of(program)
+        if not features:
+            return {}
+        spans = {f.span for f in features}
+        t = _epoch(ts)
+
+        user = await self._windows(db, user_id, spans, t)
+
+        out = {}
+        with self._lock:
+            # пользователь мог быть вытеснен другим потоком — возвращаем его окна
+            self._users[user_id] = user
+            self._users.move_to_end(user_id)
+            while len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+            # окна правил, которых больше нет в наборе, не хранятся
+            for span in user.windows.keys() - spans:
+                del user.windows[span]
+            for f in features:
+                count, total = user.windows[f.span].at(t)
+                out[f.key] = count + 1 if f.kind == "txCount" else total + amount
+            for w in user.windows.values():
+                w.add(t, amount)
+        return out
+
+    def discard(self, user_id: str, ts: datetime, amount: float) -> None:
+        with self._lock:
+            user = self._users.get(user_id)
+            if user is not None:
+                t = _epoch(ts)
+                for w in user.windows.values():
+                    w.remove(t, amount)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._users.clear()
+
+
+store = VelocityStore()
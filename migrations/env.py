@@ -0,0 +1,64 @@
+"""
+Окружение Alembic: адрес БД — тот же синхронный DATABASE_URL, что у
+приложения (если sqlalchemy.url не задан в конфиге); метаданные — модели
+app.models (для autogenerate).
+"""
+
+import re
+from logging.config import fileConfig
+
+from alembic import context
+from sqlalchemy import create_engine, pool
+
+from app.core.config import DATABASE_URL
+from app.core.database import Base
+from app.models import (  # noqa: F401 — регистрация таблиц в Base.metadata
+    fraud_rule,
+    idempotency_key,
+    rule_result,
+    ruleset_snapshot,
+    transaction,
+    transaction_count,
+    user,
+)
+
+config = context.config
+
+if config.config_file_name is not None:
+    fileConfig(config.config_file_name)
+
+target_metadata = Base.metadata
+url = config.get_main_option("sqlalchemy.url") or DATABASE_URL
+
+# помесячные партиции и их архив ведёт app/services/partitions.py — autogenerate их не трогает
+_PARTITION = re.compile(r"_p\d{4}_\d{2}(_archived_\d+)?$")
+
+
+def include_name(name, type_, parent_names) -> bool:
+    return not (type_ == "table" and _PARTITION.search(name))
+
+
+def run_migrations_offline() -> None:
+    context.configure(
+        url=url,
+        target_metadata=target_metadata,
+        include_name=include_name,
+        literal_binds=True,
+        dialect_opts={"paramstyle": "named"},
+    )
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+def run_migrations_online() -> None:
+    connectable = create_engine(url, poolclass=pool.NullPool)
+    with connectable.connect() as connection:
+        context.configure(connection=connection, target_metadata=target_metadata, include_name=include_name)
+        with context.begin_transaction():
+            context.run_migrations()
+
+
+if context.is_offline_mode():
+    run_migrations_offline()
+else:
+    run_migrations_online()
@@ -0,0 +1,121 @@
+"""Начальная схема: таблицы, которые раньше создавал create_all при старте.
+
+IF NOT EXISTS — чтобы миграция применялась и к БД, созданной до Alembic
+(колонки RULE_RESULTS_STORAGE=BITMAP create_all в старые таблицы не добавлял).
+
+Revision ID: 0001_initial
+Revises:
+Create Date: 2026-10-18
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+revision: str = "0001_initial"
+down_revision: Union[str, Sequence[str], None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "users",
+        sa.Column("id", sa.String(), primary_key=True),
+        sa.Column("email", sa.String(254), nullable=False, unique=True),
+        sa.Column("password_hash", sa.String(), nullable=False),
+        sa.Column("full_name", sa.String(200), nullable=False),
+        sa.Column("age", sa.Integer(), nullable=True),
+        sa.Column("region", sa.String(32), nullable=True),
+        sa.Column("gender", sa.String(), nullable=True),
+        sa.Column("marital_status", sa.String(), nullable=True),
+        sa.Column("role", sa.String(), nullable=False),
+        sa.Column("is_active", sa.Boolean(), nullable=True),
+        sa.Column("created_at", sa.DateTime(), nullable=True),
+        sa.Column("updated_at", sa.DateTime(), nullable=True),
+        if_not_exists=True,
+    )
+    op.create_table(
+        "fraud_rules",
+        sa.Column("id", sa.String(), primary_key=True),
+        sa.Column("name", sa.String(120), nullable=False, unique=True),
+        sa.Column("description", sa.String(500), nullable=True),
+        sa.Column("dsl_expression", sa.String(2000), nullable=False),
+        sa.Column("enabled", sa.Boolean(), nullable=True),
+        sa.Column("priority", sa.Integer(), nullable=True),
+        sa.Column("created_at", sa.DateTime(), nullable=True),
+        sa.Column("updated_at", sa.DateTime(), nullable=True),
+        if_not_exists=True,
+    )
+    op.create_table(
+        "transactions",
+        sa.Column("id", sa.String(), primary_key=True),
+        sa.Column("user_id", sa.String(), nullable=False),
+        sa.Column("amount", sa.Numeric(12, 2), nullable=False),
+        sa.Column("currency", sa.String(3), nullable=False),
+        sa.Column("timestamp", sa.DateTime(), nullable=False),
+        sa.Column("status", sa.String(), nullable=False),
+        sa.Column("is_fraud", sa.Boolean(), nullable=True),
+        sa.Column("merchant_id", sa.String(64), nullable=True),
+        sa.Column("merchant_category_code", sa.String(4), nullable=True),
+        sa.Column("ip_address", sa.String(64), nullable=True),
+        sa.Column("device_id", sa.String(128), nullable=True),
+        sa.Column("channel", sa.String(), nullable=True),
+        sa.Column("location", sa.JSON(), nullable=True),
+        sa.Column("metadata", sa.JSON(), nullable=True),
+        sa.Column("created_at", sa.DateTime(), nullable=True),
+        if_not_exists=True,
+    )
+    op.add_column("transactions", sa.Column("ruleset_version", sa.String(64), nullable=True), if_not_exists=True)
+    op.add_column("transactions", sa.Column("rule_bitmap", sa.LargeBinary(), nullable=True), if_not_exists=True)
+    op.add_column("transactions", sa.Column("rules_evaluated", sa.Integer(), nullable=True), if_not_exists=True)
+    op.create_table(
+        "rule_results",
+        sa.Column("id", sa.String(), primary_key=True),
+        sa.Column("transaction_id", sa.String(), nullable=False),
+        sa.Column("rule_id", sa.String(), nullable=False),
+        sa.Column("rule_name", sa.String(), nullable=False),
+        sa.Column("priority", sa.Integer(), nullable=False),
+        sa.Column("enabled", sa.Boolean(), nullable=False),
+        sa.Column("matched", sa.Boolean(), nullable=False),
+        sa.Column("description", sa.String(), nullable=False),
+        if_not_exists=True,
+    )
+    op.create_table(
+        "ruleset_snapshots",
+        sa.Column("version", sa.String(64), primary_key=True),
+        sa.Column("rules", sa.JSON(), nullable=False),
+        sa.Column("created_at", sa.DateTime(), nullable=True),
+        if_not_exists=True,
+    )
+    op.create_table(
+        "idempotency_keys",
+        sa.Column("user_id", sa.String(), primary_key=True),
+        sa.Column("key", sa.String(255), primary_key=True),
+        sa.Column("request_hash", sa.String(64), nullable=False),
+        sa.Column("transaction_id", sa.String(), nullable=False),
+        sa.Column("created_at", sa.DateTime(), nullable=True),
+        if_not_exists=True,
+    )
+    op.create_table(
+        "transaction_counts",
+        sa.Column("user_id", sa.String(), primary_key=True),
+        sa.Column("status", sa.String(), primary_key=True),
+        sa.Column("is_fraud", sa.Boolean(), primary_key=True),
+        sa.Column("n", sa.BigInteger(), nullable=False),
+        if_not_exists=True,
+    )
+
+
+def downgrade() -> None:
+    for table in (
+        "transaction_counts",
+        "idempotency_keys",
+        "ruleset_snapshots",
+        "rule_results",
+        "transactions",
+        "fraud_rules",
+        "users",
+    ):
+        op.drop_table(table, if_exists=True)
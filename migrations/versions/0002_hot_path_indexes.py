@@ -0,0 +1,74 @@
+"""Индексы под горячие запросы API.
+
+Каждый индекс — под конкретный запрос (условие + ORDER BY), чтобы он
+выполнялся поиском по индексу без сортировки:
+
+- GET /transactions пользователя и продолжение курсора:
+  WHERE user_id = ? [AND (timestamp, id) < (?, ?)] ORDER BY timestamp DESC, id DESC
+  -> (user_id, timestamp, id) INCLUDE (amount); тот же индекс — загрузка
+  velocity-окна (WHERE user_id = ? AND timestamp > ? ORDER BY timestamp)
+  только по индексу, без чтения строк таблицы;
+- GET /transactions ADMIN без фильтров -> (timestamp, id);
+- ADMIN с фильтром status / isFraud -> (status, timestamp, id) и
+  (is_fraud, timestamp, id). Не частичные индексы: значение фильтра
+  приходит параметром, и в общем плане подготовленного запроса (asyncpg)
+  частичный индекс WHERE status = 'DECLINED' не применился бы;
+- GET /transactions/{id}: rule_results WHERE transaction_id = ?
+  ORDER BY priority, rule_id -> (transaction_id, priority, rule_id);
+- загрузка набора правил: fraud_rules WHERE enabled ORDER BY priority, id
+  (enabled = true — константа в тексте запроса) -> частичный (priority, id)
+  WHERE enabled;
+- GET /users: ORDER BY created_at DESC -> (created_at).
+
+Индексы строятся CONCURRENTLY (без блокировки записи в таблицы), поэтому
+вне транзакции миграции (autocommit_block). Прерванная CONCURRENTLY-сборка
+оставляет невалидный индекс — его нужно удалить и повторить upgrade.
+
+Revision ID: 0002_hot_path_indexes
+Revises: 0001_initial
+Create Date: 2026-10-18
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+revision: str = "0002_hot_path_indexes"
+down_revision: Union[str, Sequence[str], None] = "0001_initial"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# (имя, таблица, колонки, параметры postgresql_*)
+INDEXES = [
+    ("ix_transactions_user_ts_id_amount", "transactions", ["user_id", "timestamp", "id"],
+     {"postgresql_include": ["amount"]}),
+    ("ix_transactions_ts_id", "transactions", ["timestamp", "id"], {}),
+    ("ix_transactions_status_ts_id", "transactions", ["status", "timestamp", "id"], {}),
+    ("ix_transactions_fraud_ts_id", "transactions", ["is_fraud", "timestamp", "id"], {}),
+    ("ix_rule_results_tx_priority_rule", "rule_results", ["transaction_id", "priority", "rule_id"], {}),
+    ("ix_fraud_rules_enabled_priority_id", "fraud_rules", ["priority", "id"],
+     {"postgresql_where": sa.text("enabled")}),
+    ("ix_users_created_at", "users", ["created_at"], {}),
+]
+
+# индекс из модели до этой миграции (create_all): заменён индексом с INCLUDE (amount)
+LEGACY = [("ix_transactions_user_ts_id", "transactions")]
+
+
+def upgrade() -> None:
+    with op.get_context().autocommit_block():
+        for name, table, columns, kw in INDEXES:
+            op.create_index(name, table, columns, postgresql_concurrently=True, if_not_exists=True, **kw)
+        for name, table in LEGACY:
+            op.drop_index(name, table_name=table, postgresql_concurrently=True, if_exists=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        for name, table in LEGACY:
+            op.create_index(
+                name, table, ["user_id", "timestamp", "id"], postgresql_concurrently=True, if_not_exists=True
+            )
+        for name, table, _, _ in reversed(INDEXES):
+            op.drop_index(name, table_name=table, postgresql_concurrently=True, if_exists=True)
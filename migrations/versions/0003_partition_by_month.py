@@ -0,0 +1,158 @@
+"""Помесячное партиционирование transactions и rule_results.
+
+Таблицы пересоздаются как PARTITION BY RANGE: transactions — по timestamp
+(PK (id, timestamp): ключ партиционирования обязан входить в PK),
+rule_results — по новой колонке tx_timestamp (timestamp транзакции),
+PK (id, tx_timestamp). Партиции — по месяцу: для каждого месяца, где есть
+транзакции, и для текущего и трёх следующих; дальше их ведёт приложение
+(app/services/partitions.py). Строки копируются в партиции, индексы
+строятся на родителе (наследуются партициями).
+
+Миграция блокирует таблицы на время копирования и построения индексов
+(обычный CREATE INDEX на родителе) — выполнять при остановленном приложении
+(журнал RULE_RESULTS_WRITE=SPOOL приложение переносит в БД при остановке).
+
+Revision ID: 0003_partition_by_month
+Revises: 0002_hot_path_indexes
+Create Date: 2026-10-18
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+revision: str = "0003_partition_by_month"
+down_revision: Union[str, Sequence[str], None] = "0002_hot_path_indexes"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# индексы 0002 на этих таблицах: пересоздаются на новых
+INDEXES = [
+    ("ix_transactions_user_ts_id_amount", "transactions", ["user_id", "timestamp", "id"],
+     {"postgresql_include": ["amount"]}),
+    ("ix_transactions_ts_id", "transactions", ["timestamp", "id"], {}),
+    ("ix_transactions_status_ts_id", "transactions", ["status", "timestamp", "id"], {}),
+    ("ix_transactions_fraud_ts_id", "transactions", ["is_fraud", "timestamp", "id"], {}),
+    ("ix_rule_results_tx_priority_rule", "rule_results", ["transaction_id", "priority", "rule_id"], {}),
+]
+
+TX_COLUMNS = (
+    "id, user_id, amount, currency, timestamp, status, is_fraud, merchant_id, merchant_category_code, "
+    "ip_address, device_id, channel, location, metadata, created_at, ruleset_version, rule_bitmap, rules_evaluated"
+)
+RR_COLUMNS = "id, transaction_id, rule_id, rule_name, priority, enabled, matched, description"
+
+CREATE_PARTITIONS = """
+DO $$
+DECLARE m date;
+BEGIN
+    FOR m IN
+        SELECT DISTINCT date_trunc('month', timestamp)::date FROM transactions_unpartitioned
+        UNION
+        SELECT (date_trunc('month', now() AT TIME ZONE 'UTC') + make_interval(months => i))::date
+        FROM generate_series(0, 3) AS i
+    LOOP
+        EXECUTE format(
+            'CREATE TABLE %I PARTITION OF transactions FOR VALUES FROM (%L) TO (%L)',
+            'transactions_p' || to_char(m, 'YYYY_MM'), m, (m + interval '1 month')::date
+        );
+        EXECUTE format(
+            'CREATE TABLE %I PARTITION OF rule_results FOR VALUES FROM (%L) TO (%L)',
+            'rule_results_p' || to_char(m, 'YYYY_MM'), m, (m + interval '1 month')::date
+        );
+    END LOOP;
+END $$
+"""
+
+
+def _transactions(name: str, **kw) -> None:
+    # у партиционированной таблицы ключ партиционирования входит в PK
+    partitioned = "postgresql_partition_by" in kw
+    op.create_table(
+        name,
+        sa.Column("id", sa.String(), nullable=False),
+        sa.Column("user_id", sa.String(), nullable=False),
+        sa.Column("amount", sa.Numeric(12, 2), nullable=False),
+        sa.Column("currency", sa.String(3), nullable=False),
+        sa.Column("timestamp", sa.DateTime(), nullable=False),
+        sa.Column("status", sa.String(), nullable=False),
+        sa.Column("is_fraud", sa.Boolean(), nullable=True),
+        sa.Column("merchant_id", sa.String(64), nullable=True),
+        sa.Column("merchant_category_code", sa.String(4), nullable=True),
+        sa.Column("ip_address", sa.String(64), nullable=True),
+        sa.Column("device_id", sa.String(128), nullable=True),
+        sa.Column("channel", sa.String(), nullable=True),
+        sa.Column("location", sa.JSON(), nullable=True),
+        sa.Column("metadata", sa.JSON(), nullable=True),
+        sa.Column("created_at", sa.DateTime(), nullable=True),
+        sa.Column("ruleset_version", sa.String(64), nullable=True),
+        sa.Column("rule_bitmap", sa.LargeBinary(), nullable=True),
+        sa.Column("rules_evaluated", sa.Integer(), nullable=True),
+        sa.PrimaryKeyConstraint(*(("id", "timestamp") if partitioned else ("id",)), name="transactions_pkey"),
+        **kw,
+    )
+
+
+def _rule_results(name: str, **kw) -> None:
+    partitioned = "postgresql_partition_by" in kw
+    op.create_table(
+        name,
+        sa.Column("id", sa.String(), nullable=False),
+        sa.Column("transaction_id", sa.String(), nullable=False),
+        *([sa.Column("tx_timestamp", sa.DateTime(), nullable=False)] if partitioned else []),
+        sa.Column("rule_id", sa.String(), nullable=False),
+        sa.Column("rule_name", sa.String(), nullable=False),
+        sa.Column("priority", sa.Integer(), nullable=False),
+        sa.Column("enabled", sa.Boolean(), nullable=False),
+        sa.Column("matched", sa.Boolean(), nullable=False),
+        sa.Column("description", sa.String(), nullable=False),
+        sa.PrimaryKeyConstraint(*(("id", "tx_timestamp") if partitioned else ("id",)), name="rule_results_pkey"),
+        **kw,
+    )
+
+
+def _set_aside(suffix: str) -> None:
+    # старые таблицы — под другим именем, без индексов и PK (имена заняты бы новыми)
+    for name, table, _, _ in INDEXES:
+        op.drop_index(name, table_name=table, if_exists=True)
+    for table in ("transactions", "rule_results"):
+        op.execute(f"ALTER TABLE {table} DROP CONSTRAINT IF EXISTS {table}_pkey")
+        op.rename_table(table, f"{table}_{suffix}")
+
+
+def _create_indexes() -> None:
+    for name, table, columns, kw in INDEXES:
+        op.create_index(name, table, columns, **kw)
+
+
+def upgrade() -> None:
+    _set_aside("unpartitioned")
+    _transactions("transactions", postgresql_partition_by="RANGE (timestamp)")
+    _rule_results("rule_results", postgresql_partition_by="RANGE (tx_timestamp)")
+    op.execute(CREATE_PARTITIONS)
+
+    op.execute(f"INSERT INTO transactions ({TX_COLUMNS}) SELECT {TX_COLUMNS} FROM transactions_unpartitioned")
+    rr_columns = ", ".join(f"r.{c}" for c in RR_COLUMNS.split(", "))
+    op.execute(
+        f"INSERT INTO rule_results ({RR_COLUMNS}, tx_timestamp) "
+        f"SELECT {rr_columns}, t.timestamp FROM rule_results_unpartitioned r "
+        "JOIN transactions_unpartitioned t ON t.id = r.transaction_id"
+    )
+    op.drop_table("rule_results_unpartitioned")
+    op.drop_table("transactions_unpartitioned")
+
+    _create_indexes()
+    op.execute("ANALYZE transactions, rule_results")
+
+
+def downgrade() -> None:
+    # партиции удаляются вместе с родителем; отключённые (*_archived_*) остаются
+    _set_aside("partitioned")
+    _transactions("transactions")
+    _rule_results("rule_results")
+    op.execute(f"INSERT INTO transactions ({TX_COLUMNS}) SELECT {TX_COLUMNS} FROM transactions_partitioned")
+    op.execute(f"INSERT INTO rule_results ({RR_COLUMNS}) SELECT {RR_COLUMNS} FROM rule_results_partitioned")
+    op.drop_table("rule_results_partitioned")
+    op.drop_table("transactions_partitioned")
+    _create_indexes()